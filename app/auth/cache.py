@@ -0,0 +1,102 @@
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional
+
+from app.config import Config
+from app.models.user import User
+
+
+class UserCache:
+    """
+    LRU + TTL cache of the users resolved by get_current_user, keyed on (subject, token), so that an
+    authenticated request does not read the user collection.
+    An entry never outlives its token, and invalidate() drops every entry of a user; every path writing
+    a user calls it, through invalidate_user(). That covers this process only, and no endpoint deactivates
+    or updates a user yet: a change made in the database (or through another worker) is seen once the
+    entries expire, the TTL is the only bound on that staleness.
+    Each subject has a generation, bumped by invalidate(), so that a user read while it was being
+    written to is not stored.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.by_subject = defaultdict(set)
+        self.generations = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def generation(self, subject: str) -> int:
+        return self.generations.get(subject, 0)
+
+    def get(self, subject: str, token: str) -> Optional[User]:
+        key = (subject, token)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, user = entry
+        if expires_at < time.time():
+            self._drop(key)
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        # Handlers are free to modify the user they get
+        return user.copy()
+
+    def set(self, subject: str, token: str, user: User, generation: int, token_expires_at: Optional[float] = None):
+        """
+        :param generation: generation of the subject before the user was read
+        :param token_expires_at: "exp" claim of the token
+        """
+        if self.max_size <= 0 or generation != self.generation(subject):
+            return
+        expires_at = time.time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+        key = (subject, token)
+        self.entries[key] = (expires_at, user.copy())
+        self.entries.move_to_end(key)
+        self.by_subject[subject].add(token)
+        while len(self.entries) > self.max_size:
+            self._drop(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+    def invalidate(self, subject: str):
+        self.generations[subject] = self.generation(subject) + 1
+        for token in self.by_subject.pop(subject, ()):
+            if self.entries.pop((subject, token), None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.by_subject.clear()
+
+    def _drop(self, key):
+        self.entries.pop(key, None)
+        tokens = self.by_subject.get(key[0])
+        if tokens is not None:
+            tokens.discard(key[1])
+            if not tokens:
+                del self.by_subject[key[0]]
+
+    def info(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {**self.stats,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0}
+
+
+USER_CACHE = UserCache(max_size=Config.USER_CACHE_SIZE, ttl=Config.USER_CACHE_TTL)
+
+
+def invalidate_user(username: str):
+    """
+    Forget the cached user, to call after any write to it (registration, update, deactivation, logout
+    everywhere)
+    :param username: subject of the tokens, the email_id of the user
+    """
+    USER_CACHE.invalidate(username)
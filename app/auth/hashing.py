@@ -0,0 +1,121 @@
+"""
+Password hashing off the event loop
+
+bcrypt takes 100-300 ms per call by design, run inline it stalls every other request of the worker.
+Calls go to a size-bounded thread (or process) pool instead; once the workers are busy and the queue is
+full, new calls are refused with 429 rather than queued without limit.
+"""
+import asyncio
+import logging
+import math
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from fastapi import status
+from passlib.context import CryptContext
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def verify_password(plain_password, hashed_password):
+    return PWD_CONTEXT.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password):
+    return PWD_CONTEXT.hash(password)
+
+
+class HashingPool:
+    """
+    Bounded pool running the blocking hash functions
+    At most workers calls run at once and max_queue more wait for a worker, any call past that gets a 429.
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 32, kind: str = "thread"):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self.executor: Optional[Executor] = None
+        self.in_flight = 0
+        self.stats = {"calls": 0, "rejected": 0}
+        self.calibration: Dict = {}
+
+    def _executor(self) -> Executor:
+        if self.executor is None:
+            if self.kind == "process":
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        return self.executor
+
+    async def run(self, func, *args):
+        """
+        :raise HTTPException: 429 when the pool is saturated
+        """
+        if self.in_flight >= self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                detail="Too many authentication requests, retry later",
+                                headers={"Retry-After": "1"})
+        self.in_flight += 1
+        self.stats["calls"] += 1
+        try:
+            return await asyncio.get_event_loop().run_in_executor(self._executor(), func, *args)
+        finally:
+            self.in_flight -= 1
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def info(self) -> Dict:
+        return {**self.stats, "in_flight": self.in_flight, "workers": self.workers, "max_queue": self.max_queue,
+                "kind": self.kind, "calibration": self.calibration}
+
+
+PASSWORD_POOL = HashingPool(workers=Config.PASSWORD_HASH_WORKERS, max_queue=Config.PASSWORD_HASH_QUEUE,
+                            kind=Config.PASSWORD_HASH_EXECUTOR)
+
+
+async def hash_password(password: str) -> str:
+    return await PASSWORD_POOL.run(get_password_hash, password)
+
+
+async def check_password(plain_password: str, hashed_password: str) -> bool:
+    return await PASSWORD_POOL.run(verify_password, plain_password, hashed_password)
+
+
+def _timed_hash(password: str) -> float:
+    started = time.perf_counter()
+    get_password_hash(password)
+    return time.perf_counter() - started
+
+
+async def calibrate(samples: int = 8) -> Dict:
+    """
+    Time the configured scheme in the pool and log its cost, p99 latency and the throughput it allows
+    :param samples: number of hashes to time
+    """
+    try:
+        durations = sorted([await PASSWORD_POOL.run(_timed_hash, "calibration-password") for _ in range(samples)])
+    except Exception:
+        logger.exception("Password hashing calibration failed")
+        return {}
+    p99 = durations[min(len(durations) - 1, math.ceil(0.99 * len(durations)) - 1)]
+    mean = sum(durations) / len(durations)
+    scheme = PWD_CONTEXT.default_scheme()
+    PASSWORD_POOL.calibration = {"scheme": scheme,
+                                 "rounds": getattr(PWD_CONTEXT.handler(scheme), "default_rounds", None),
+                                 "samples": samples,
+                                 "mean_ms": round(mean * 1000, 1),
+                                 "p99_ms": round(p99 * 1000, 1),
+                                 "max_per_second": round(PASSWORD_POOL.workers / mean, 1)}
+    logger.info("Password hashing calibration: %s", PASSWORD_POOL.calibration)
+    return PASSWORD_POOL.calibration
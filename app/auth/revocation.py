@@ -0,0 +1,190 @@
+"""
+Access token revocation without a database query per request
+
+A token is revoked by its jti (logout), or every token of a user issued before a cutoff (logout
+everywhere). Revocations are stored in the revoked_token collection, where a TTL index drops them once
+the tokens they cover have expired.
+
+Each worker keeps a Bloom filter of the revoked jtis and the exact cutoffs of the users. A token missing
+from the filter is not revoked, which is the answer for nearly every request; only a filter hit, a revoked
+token or a rare false positive, is confirmed with the collection. The filter is loaded at startup,
+refreshed incrementally with the revocations of the other workers and periodically rebuilt from the
+live revocations, so expired ones stop taking space.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from app.config import Config
+from app.db import DB_ENGINE
+from app.models.token import RevokedToken
+
+logger = logging.getLogger(__name__)
+
+# Revocations written by other workers shortly before the last refresh may carry an older revoked_at
+REFRESH_OVERLAP = timedelta(seconds=5)
+
+
+def _timestamp(value) -> float:
+    """
+    Stored dates are naive UTC datetimes, claims are timestamps
+    """
+    return value.replace(tzinfo=timezone.utc).timestamp() if isinstance(value, datetime) else value
+
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter, k positions per key from two halves of a blake2b digest
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    """
+    In-memory view of the revoked_token collection, see the module docstring
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filter = BloomFilter(capacity, error_rate)
+        # sub -> (cutoff timestamp, expiry timestamp)
+        self.cutoffs: Dict[str, tuple] = {}
+        # jti -> expiry timestamp, filter hits confirmed by the collection
+        self.confirmed: Dict[str, float] = {}
+        self.synced_at: Optional[datetime] = None
+        self.stats = {"checks": 0, "filter_hits": 0, "false_positives": 0, "revoked": 0}
+
+    def _add(self, revoked: dict):
+        expires_at = _timestamp(revoked["expires_at"])
+        if revoked.get("jti"):
+            self.filter.add(revoked["jti"])
+        elif revoked.get("cutoff") is not None:
+            cutoff = _timestamp(revoked["cutoff"])
+            if cutoff > self.cutoffs.get(revoked["sub"], (0, 0))[0]:
+                self.cutoffs[revoked["sub"]] = (cutoff, expires_at)
+
+    def check(self, payload: dict) -> Optional[bool]:
+        """
+        O(1) check of a decoded token against the in-memory state
+        :return: True if revoked, False if not, None when the filter has to be confirmed by the collection
+        """
+        self.stats["checks"] += 1
+        cutoff = self.cutoffs.get(payload.get("sub"))
+        if cutoff is not None and payload.get("iat", 0) < cutoff[0]:
+            return True
+        jti = payload.get("jti")
+        if jti is None or jti not in self.filter:
+            return False
+        if jti in self.confirmed:
+            return True
+        self.stats["filter_hits"] += 1
+        return None
+
+    async def is_revoked(self, payload: dict) -> bool:
+        revoked = self.check(payload)
+        if revoked is None:
+            revoked = await DB_ENGINE.get_collection(RevokedToken).count_documents({"jti": payload["jti"]},
+                                                                                   limit=1) > 0
+            if revoked:
+                self.confirmed[payload["jti"]] = payload.get("exp", time.time())
+            else:
+                self.stats["false_positives"] += 1
+        if revoked:
+            self.stats["revoked"] += 1
+        return revoked
+
+    async def revoke(self, payload: dict):
+        """
+        Revoke a single token
+        """
+        expires_at = datetime.utcfromtimestamp(payload.get("exp", time.time()))
+        revoked = {"jti": payload["jti"], "sub": payload.get("sub"), "expires_at": expires_at,
+                   "revoked_at": datetime.utcnow()}
+        await DB_ENGINE.get_collection(RevokedToken).insert_one(dict(revoked))
+        self._add(revoked)
+        self.confirmed[payload["jti"]] = _timestamp(expires_at)
+
+    async def revoke_user(self, sub: str, cutoff: Optional[float] = None):
+        """
+        Revoke every token of a user issued before the cutoff (default: now)
+        """
+        cutoff = time.time() if cutoff is None else cutoff
+        # Every token issued before the cutoff is expired once their lifetime has passed
+        expires_at = datetime.utcfromtimestamp(cutoff) + timedelta(minutes=Config.ACCESS_TOKEN_EXPIRE_MINUTES)
+        revoked = {"sub": sub, "cutoff": cutoff, "expires_at": expires_at, "revoked_at": datetime.utcnow()}
+        await DB_ENGINE.get_collection(RevokedToken).insert_one(dict(revoked))
+        self._add(revoked)
+
+    async def load(self):
+        """
+        Rebuild the filter from the live revocations
+        """
+        started_at = datetime.utcnow()
+        revocations = RevocationList(self.capacity, self.error_rate)
+        async for revoked in DB_ENGINE.get_collection(RevokedToken).find({"expires_at": {"$gt": started_at}}):
+            revocations._add(revoked)
+        if revocations.filter.count > self.capacity:
+            logger.warning("%d revoked tokens for a filter sized for %d, false positives will go up",
+                           revocations.filter.count, self.capacity)
+        now = time.time()
+        self.filter, self.cutoffs = revocations.filter, revocations.cutoffs
+        self.confirmed = {jti: expires_at for jti, expires_at in self.confirmed.items() if expires_at > now}
+        self.synced_at = started_at
+
+    async def refresh(self):
+        """
+        Add the revocations made since the last load / refresh, by any worker
+        """
+        if self.synced_at is None:
+            return await self.load()
+        started_at = datetime.utcnow()
+        query = {"revoked_at": {"$gte": self.synced_at - REFRESH_OVERLAP}}
+        async for revoked in DB_ENGINE.get_collection(RevokedToken).find(query):
+            self._add(revoked)
+        now = time.time()
+        self.cutoffs = {sub: cutoff for sub, cutoff in self.cutoffs.items() if cutoff[1] > now}
+        self.synced_at = started_at
+
+    async def keep_in_sync(self, refresh_interval: float, rebuild_interval: float):
+        rebuilt_at = time.monotonic()
+        while True:
+            await asyncio.sleep(refresh_interval)
+            try:
+                if time.monotonic() - rebuilt_at >= rebuild_interval:
+                    await self.load()
+                    rebuilt_at = time.monotonic()
+                else:
+                    await self.refresh()
+            except Exception:
+                logger.exception("Cannot refresh the revoked tokens")
+
+    def info(self) -> Dict:
+        return {**self.stats, "filter_size": self.filter.count, "capacity": self.capacity,
+                "cutoffs": len(self.cutoffs), "confirmed": len(self.confirmed)}
+
+
+REVOKED_TOKENS = RevocationList(capacity=Config.REVOCATION_FILTER_CAPACITY)
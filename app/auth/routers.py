@@ -1,10 +1,14 @@
+import asyncio
 from datetime import timedelta
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi import Request, Response, Cookie
 from fastapi import status
 
-from app.auth.utils import authenticate_user, create_access_token, get_current_active_user, get_password_hash
+from app.auth.cache import invalidate_user
+from app.auth.hashing import PASSWORD_POOL, calibrate, hash_password
+from app.auth.revocation import REVOKED_TOKENS
+from app.auth.utils import authenticate_user, create_access_token, get_current_active_user
 from app.config import Config
 from app.db import DB_ENGINE
 from app.models.user import User, AnonymousUser, UserDB, AuthUser
@@ -13,8 +17,45 @@ from app.models.token import Token
 auth_router = APIRouter()
 
 
+BACKGROUND_TASKS = []
+
+
+@auth_router.on_event("startup")
+async def startup():
+    if Config.PASSWORD_HASH_CALIBRATION_SAMPLES > 0:
+        # In the background, the calibration takes a few hundred ms per sample
+        asyncio.ensure_future(calibrate(Config.PASSWORD_HASH_CALIBRATION_SAMPLES))
+    await REVOKED_TOKENS.load()
+    BACKGROUND_TASKS.append(asyncio.ensure_future(
+        REVOKED_TOKENS.keep_in_sync(Config.REVOCATION_REFRESH_SECONDS, Config.REVOCATION_REBUILD_SECONDS)))
+
+
+@auth_router.on_event("shutdown")
+def shutdown():
+    PASSWORD_POOL.shutdown()
+    while BACKGROUND_TASKS:
+        BACKGROUND_TASKS.pop().cancel()
+
+
+@auth_router.get("/auth/stats")
+async def auth_stats():
+    return {**PASSWORD_POOL.info(), "revocations": REVOKED_TOKENS.info()}
+
+
 @auth_router.get("/logout")
-async def logout(current_user: User = Depends(get_current_active_user)):
+async def logout(request: Request, everywhere: bool = False, current_user: User = Depends(get_current_active_user)):
+    """
+    Revoke the access token of the request
+    :param everywhere: revoke every token of the user issued so far instead
+    :param current_user: Dependency Injection
+    """
+    payload = request.state.token_payload
+    # Tokens issued without a jti can only be revoked with the other tokens of the user
+    if everywhere or "jti" not in payload:
+        await REVOKED_TOKENS.revoke_user(current_user.email_id)
+        invalidate_user(current_user.email_id)
+    else:
+        await REVOKED_TOKENS.revoke(payload)
     return "ok"
 
 
@@ -36,8 +77,9 @@ async def register(new_user: UserDB):
 
     user = await DB_ENGINE.find_one(UserDB, UserDB.email_id == new_user.email_id)
     if user is None:
-        new_user.password = get_password_hash(new_user.password)
+        new_user.password = await hash_password(new_user.password)
         await DB_ENGINE.save(new_user)
+        invalidate_user(new_user.email_id)
         return User(id=str(new_user.id),
                     username=new_user.username,
                     email_id=new_user.email_id,
@@ -1,4 +1,6 @@
 import os
+import time
+import uuid
 from datetime import timedelta, datetime
 from typing import Optional
 
@@ -7,30 +9,23 @@ from fastapi import Request
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError, ExpiredSignatureError
-from passlib.context import CryptContext
 
+from app.auth.cache import USER_CACHE
+from app.auth.revocation import REVOKED_TOKENS
+from app.auth.hashing import check_password
 from app.db.query import get_user
 from app.models.token import TokenData
 from app.models.user import User, AnonymousUser, AuthUser
 from app.config import Config
 
-PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
 OAUTH2_SCHEME = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 
-def verify_password(plain_password, hashed_password):
-    return PWD_CONTEXT.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password):
-    return PWD_CONTEXT.hash(password)
-
-
 async def authenticate_user(email_id, password):
     user = await get_user(email_id, cls=AuthUser)
     if not user:
         return False
-    if not verify_password(password, user.password):
+    if not await check_password(password, user.password):
         return False
     user.is_authenticated = True
     return user
@@ -42,7 +37,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=30)
-    to_encode.update({"exp": expire})
+    # jti identifies the token for a logout, iat is compared with the cutoff of a logout everywhere
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, Config().SECRET_KEY, algorithm=Config.ALGORITHM)
     return encoded_jwt
 
@@ -59,21 +55,31 @@ async def get_current_user(request: Request, access_token: Optional[str] = Heade
         return AnonymousUser()
     try:
         payload = jwt.decode(token, Config.SECRET_KEY, algorithms=[Config.ALGORITHM])
+        # Claims of the token, for /logout
+        request.state.token_payload = payload
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
+        if await REVOKED_TOKENS.is_revoked(payload):
+            raise credentials_exception
     except ExpiredSignatureError:
         # raise CustomExpiredSignatureError(status_code=status.HTTP_400_BAD_REQUEST)
         return AnonymousUser()
     except JWTError:
         raise credentials_exception
 
+    user = USER_CACHE.get(token_data.username, token)
+    if user is not None:
+        return user
+
+    generation = USER_CACHE.generation(token_data.username)
     user = await get_user(email_id=token_data.username, cls=User)
 
     if user is None:
         raise credentials_exception
     user.is_authenticated = True
+    USER_CACHE.set(token_data.username, token, user, generation, token_expires_at=payload.get("exp"))
     return user
 
 
@@ -20,6 +20,80 @@ class Config:
     ACCESS_TOKEN_EXPIRE_MINUTES = 30
     SECRET_KEY = os.getenv("SECRET_KEY")
 
+    # In-memory inverted index used for keyword queries on /movies and /search
+    SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "false").lower() == "true"
+    # In-memory trigram index over movie names and directors backing /search?fuzzy=true
+    FUZZY_SEARCH_ENABLED = os.getenv("FUZZY_SEARCH_ENABLED", "false").lower() == "true"
+    # In-memory NumPy columns evaluating the /search filters without a keyword (needs numpy)
+    COLUMNAR_ENGINE_ENABLED = os.getenv("COLUMNAR_ENGINE_ENABLED", "false").lower() == "true"
+    # Keep the similar movie lists up to date on writes (also loads the columnar catalog)
+    SIMILAR_MOVIES_ENABLED = os.getenv("SIMILAR_MOVIES_ENABLED", "false").lower() == "true"
+    # In-memory prefix index over movie, director and genre names backing /suggest
+    SUGGEST_ENABLED = os.getenv("SUGGEST_ENABLED", "false").lower() == "true"
+    # The in-memory indexes above are built at startup, then updated by the writes of this process only. Writes
+    # of other workers, import_data.py or the manage_*.py scripts show up after a rebuild: every
+    # IN_MEMORY_INDEX_REFRESH_SECONDS the collections are checked and the indexes rebuilt if they changed
+    # (0 disables the check, the indexes then stay stale until a restart)
+    IN_MEMORY_INDEX_REFRESH_SECONDS = float(os.getenv("IN_MEMORY_INDEX_REFRESH_SECONDS", 60))
+
+    # Max number of filtered counts kept between writes, they expire after RESPONSE_CACHE_TTL too
+    COUNT_CACHE_SIZE = 1024
+
+    # Time limit of the queries with a regex keyword (match=regex), they fail with a 400 past it
+    REGEX_MAX_TIME_MS = int(os.getenv("REGEX_MAX_TIME_MS", 500))
+
+    # Cached GET responses, 0 disables the cache. Writes invalidate them right away in this process only:
+    # writes from other workers, import_data.py or the manage_*.py scripts show up once the TTL expires
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 2048))
+    RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 30))
+    # Fill the cache with the first pages at startup
+    RESPONSE_CACHE_PREWARM = os.getenv("RESPONSE_CACHE_PREWARM", "false").lower() == "true"
+
+    # Documents fetched per round trip by /movies/export
+    EXPORT_BATCH_SIZE = 1000
+    EXPORT_MAX_BATCH_SIZE = 10000
+
+    # Bulk endpoints: items per bulk_write and per request
+    BULK_CHUNK_SIZE = 1000
+    BULK_MAX_ITEMS = 50000
+
+    # Max number of uids per multi-get
+    BATCH_GET_MAX_IDS = 1000
+
+    # Movies kept in the director rollups, max size of a filmography
+    FILMOGRAPHY_SIZE = 10
+    # Movies kept in each genre leaderboard, max size of /genres/{id}/top
+    LEADERBOARD_SIZE = 20
+
+    # Neighbours kept per movie, movies compared on either side per genre by the batch job, and max
+    # number of lists recomputed after a write (the next batch job picks up the rest)
+    SIMILAR_MOVIES_SIZE = 10
+    SIMILAR_MOVIES_WINDOW = 10
+    SIMILAR_MOVIES_REFRESH_LIMIT = 50
+
+    # Max number of suggestions of /suggest (at most app.search.suggest.TOP_SIZE)
+    SUGGEST_MAX_SIZE = 20
+
+    # Users resolved from access tokens, 0 disables the cache. No endpoint deactivates or updates a user: a
+    # change made in the database keeps being served until the TTL expires, keep it short
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+    USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 30))
+
+    # bcrypt runs in a pool ("thread" or "process") of this many workers, past the queue limit
+    # authentication requests get a 429
+    PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+    PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 32))
+    # Hashes timed at startup to report the cost of the scheme, 0 disables the calibration
+    PASSWORD_HASH_CALIBRATION_SAMPLES = int(os.getenv("PASSWORD_HASH_CALIBRATION_SAMPLES", 8))
+
+    # Revoked tokens: expected number of live revocations (sizes the in-memory filter), how often the
+    # revocations of the other workers are picked up and how often the filter is rebuilt without the
+    # expired ones
+    REVOCATION_FILTER_CAPACITY = 100000
+    REVOCATION_REFRESH_SECONDS = 5
+    REVOCATION_REBUILD_SECONDS = 600
+
     TEST_DB_HOST = "localhost"
     TEST_DB_PORT = 27017
     TEST_DB_NAME = "test"
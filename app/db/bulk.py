@@ -0,0 +1,166 @@
+"""
+Bulk create / patch / delete: every chunk of items is sent as a single unordered bulk_write, a bad item
+only fails itself and every item gets its own result:
+    {"index": position in the request, "uid": ..., "status": "created" | "updated" | "deleted" |
+     "not_found" | "invalid" | "error", "detail": ...}
+"""
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple, Type
+
+from fastapi import HTTPException
+from fastapi import status
+from odmantic import Model
+from pydantic import ValidationError
+from pymongo import DeleteMany, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.config import Config
+
+# Never set from a request body
+READ_ONLY_FIELDS = ("id", "uid", "created_at", "modified_at")
+
+
+def check_size(items: list):
+    if len(items) > Config.BULK_MAX_ITEMS:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"At most {Config.BULK_MAX_ITEMS} items per request")
+
+
+def validate_changes(model: Type[Model], changes: dict) -> dict:
+    """
+    Validate a partial update against the model fields
+    :return: validated values, ready for a $set
+    :raise ValueError: unknown / read-only fields or invalid values
+    """
+    unknown = [name for name in changes if name not in model.__fields__ or name in READ_ONLY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown or read-only fields: {', '.join(unknown)}")
+    update = {}
+    for name, value in changes.items():
+        value, error = model.__fields__[name].validate(value, {}, loc=name)
+        if error is not None:
+            raise ValueError(str(ValidationError([error], model)))
+        update[name] = value
+    return update
+
+
+def _result(index: int, uid, item_status: str, detail: str = None) -> dict:
+    result = {"index": index, "uid": uid, "status": item_status}
+    if detail is not None:
+        result["detail"] = detail
+    return result
+
+
+def summary(results: List[dict]) -> dict:
+    return {"results": results, "counts": dict(Counter(result["status"] for result in results))}
+
+
+async def _execute(collection, requests: List[Tuple[int, str, object]], results: List[dict], done: str):
+    """
+    Send the requests in unordered bulk_writes of BULK_CHUNK_SIZE and fill in the results of their items
+    :param requests: (item index, uid, pymongo write request)
+    :param done: status of the items written
+    """
+    for start in range(0, len(requests), Config.BULK_CHUNK_SIZE):
+        chunk = requests[start:start + Config.BULK_CHUNK_SIZE]
+        failed: Dict[int, str] = {}
+        try:
+            result = await collection.bulk_write([request for _, _, request in chunk], ordered=False)
+            applied = result.inserted_count + result.matched_count
+        except BulkWriteError as exc:
+            failed = {error["index"]: error.get("errmsg") for error in exc.details.get("writeErrors", [])}
+            applied = exc.details.get("nInserted", 0) + exc.details.get("nMatched", 0)
+
+        missing = set()
+        if applied < len(chunk) - len(failed):
+            # Some updates matched nothing, one read tells which ones
+            uids = [uid for position, (_, uid, _) in enumerate(chunk) if position not in failed]
+            existing = {doc["uid"] async for doc in collection.find({"uid": {"$in": uids}}, {"uid": True})}
+            missing = set(uids) - existing
+
+        for position, (index, uid, _) in enumerate(chunk):
+            if position in failed:
+                results[index] = _result(index, uid, "error", failed[position])
+            elif uid in missing:
+                results[index] = _result(index, uid, "not_found")
+            else:
+                results[index] = _result(index, uid, done)
+
+
+async def bulk_create(database, model: Type[Model], items: list) -> Tuple[dict, List[Model]]:
+    """
+    Validate and insert the items
+    :return: summary, created instances
+    """
+    check_size(items)
+    results, requests, instances = [None] * len(items), [], {}
+    now = datetime.utcnow()
+    for index, item in enumerate(items):
+        try:
+            instance = model.parse_obj(item)
+        except ValidationError as exc:
+            results[index] = _result(index, item.get("uid") if isinstance(item, dict) else None, "invalid",
+                                     str(exc))
+            continue
+        if not instance.uid:
+            instance.uid = str(uuid.uuid4())
+        if not instance.created_at:
+            instance.created_at = now
+            instance.modified_at = now
+        instances[index] = instance
+        requests.append((index, instance.uid, InsertOne(instance.doc())))
+
+    await _execute(database[model.__collection__], requests, results, "created")
+    created = [instances[index] for index, _, _ in requests if results[index]["status"] == "created"]
+    return summary(results), created
+
+
+async def bulk_patch(database, model: Type[Model], items: list) -> dict:
+    """
+    Apply partial updates, each item is {"uid": ..., field: value, ...}
+    """
+    check_size(items)
+    results, requests = [None] * len(items), []
+    now = datetime.utcnow()
+    for index, item in enumerate(items):
+        uid = item.get("uid") if isinstance(item, dict) else None
+        if not isinstance(uid, str):
+            results[index] = _result(index, None, "invalid", "uid is missing")
+            continue
+        try:
+            update = validate_changes(model, {name: value for name, value in item.items() if name != "uid"})
+        except ValueError as exc:
+            results[index] = _result(index, uid, "invalid", str(exc))
+            continue
+        requests.append((index, uid, UpdateOne({"uid": uid}, {"$set": dict(update, modified_at=now)})))
+
+    await _execute(database[model.__collection__], requests, results, "updated")
+    return summary(results)
+
+
+async def bulk_delete(database, model: Type[Model], uids: List[str]) -> dict:
+    """
+    Delete the documents with these uids, one read and one DeleteMany per chunk
+    """
+    check_size(uids)
+    collection = database[model.__collection__]
+    results = []
+    for start in range(0, len(uids), Config.BULK_CHUNK_SIZE):
+        chunk = uids[start:start + Config.BULK_CHUNK_SIZE]
+        existing = {doc["uid"] async for doc in collection.find({"uid": {"$in": chunk}}, {"uid": True})}
+        error = None
+        if existing:
+            try:
+                await collection.bulk_write([DeleteMany({"uid": {"$in": list(existing)}})], ordered=False)
+            except BulkWriteError as exc:
+                error = str(exc)
+        for index, uid in enumerate(chunk, start=start):
+            if uid not in existing:
+                results.append(_result(index, uid, "not_found"))
+            elif error is not None:
+                results.append(_result(index, uid, "error", error))
+            else:
+                results.append(_result(index, uid, "deleted"))
+    return summary(results)
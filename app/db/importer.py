@@ -0,0 +1,350 @@
+"""
+Streaming bulk importer for movie dumps, a JSON array or NDJSON (one object per line)
+
+The file is parsed incrementally and written in unordered batches, while the next batch is being parsed
+the previous ones are in flight, so memory is bounded by batch_size * (in_flight + 1) documents.
+Genres and directors are upserted in bulk at the end, and the rollups rebuilt when anything was written.
+
+Imports are idempotent: a movie is identified by its natural key (name, director) and stores a hash of
+its content. Each batch reads the stored hashes of its keys in one query, unchanged rows are skipped
+without a write, changed rows are updated in place and new ones inserted, so re-running a feed costs
+about as much as its diff. A batch holding a key that an earlier batch is still writing waits for it,
+so the last row of a key wins across batches too, and the unique name_director index (over imported
+movies) turns an insert racing with another import into an update.
+
+The rows of a batch that fails (lost connection, timeout...) are counted as failed, --delete-missing then
+deletes nothing and the CLI exits with 1.
+
+CLI:
+    python import_data.py imdb.json
+    python import_data.py imdb.ndjson --batch-size 10000 --in-flight 4
+    python import_data.py imdb.ndjson --delete-missing   # also remove imported movies absent from the feed
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import IO, Callable, Iterable, Iterator, Optional, Set, Tuple
+
+from pymongo import DeleteMany, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from app.config import Config
+from app.db.rollups import rebuild_all
+from app.models.movie import Movie, Genre, Director
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1 << 16
+# Between two values of an array or two lines of NDJSON
+SEPARATORS = " \t\r\n,"
+
+DEFAULT_BATCH_SIZE = 5000
+DEFAULT_IN_FLIGHT = 2
+
+# Fields covered by the content hash, the natural key is (name, director)
+CONTENT_FIELDS = ("name", "imdb_score", "genre", "director", "popularity")
+
+DUPLICATE_KEY = 11000
+
+
+def iter_json_records(fp: IO[str], chunk_size: int = CHUNK_SIZE) -> Iterator:
+    """
+    Yield the values of a JSON array, or of a stream of JSON values (NDJSON), reading the file chunk by chunk
+    :param fp: text file
+    :param chunk_size: number of characters read at once
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+    in_array = None
+    while True:
+        while pos < len(buffer) and buffer[pos] in SEPARATORS:
+            pos += 1
+        if pos < len(buffer):
+            if in_array is None:
+                in_array = buffer[pos] == "["
+                pos += in_array
+                continue
+            if in_array and buffer[pos] == "]":
+                return
+            try:
+                value, pos = decoder.raw_decode(buffer, pos)
+                yield value
+                continue
+            except json.JSONDecodeError:
+                # The value is cut by the end of the chunk
+                if eof:
+                    raise
+        elif eof:
+            return
+        chunk = fp.read(chunk_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+def content_hash(document: dict) -> str:
+    return hashlib.sha1(json.dumps([document[field] for field in CONTENT_FIELDS],
+                                   separators=(",", ":")).encode()).hexdigest()
+
+
+def natural_key(document: dict) -> Tuple[str, str]:
+    return document["name"], document["director"]
+
+
+def key_digest(key: Tuple[str, str]) -> bytes:
+    """
+    Compact form of a natural key, for the set of keys seen during a run
+    """
+    return hashlib.blake2b("\0".join(key).encode(), digest_size=12).digest()
+
+
+def movie_document(row) -> dict:
+    """
+    Validate a row of the dump and turn it into the content of a movie document, with its content_hash
+    :param row: decoded JSON value
+    :raise ValueError: the row is not a valid movie
+    """
+    if not isinstance(row, dict):
+        raise ValueError(f"expected an object, got {type(row).__name__}")
+    name, director = row.get("name"), row.get("director")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("name is missing")
+    if not isinstance(director, str):
+        raise ValueError("director is missing")
+    genre = row.get("genre") or []
+    if isinstance(genre, str):
+        genre = genre.split(",")
+    try:
+        imdb_score = float(row["imdb_score"])
+        popularity = float(row["99popularity"] if "99popularity" in row else row["popularity"])
+    except (KeyError, TypeError, ValueError) as exc:
+        raise ValueError(f"invalid imdb_score or popularity: {exc!r}")
+    document = {"name": name,
+                "imdb_score": imdb_score,
+                "genre": [str(g).strip() for g in genre],
+                "director": director,
+                "popularity": popularity}
+    document["content_hash"] = content_hash(document)
+    return document
+
+
+async def upsert_names(collection, names: Iterable[str], now: datetime, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Create the genres / directors that do not exist yet, with unordered bulk upserts
+    :return: number of documents created
+    """
+    requests = [UpdateOne({"name": name},
+                          {"$setOnInsert": {"uid": str(uuid.uuid4()), "created_at": now, "modified_at": now}},
+                          upsert=True)
+                for name in sorted(names) if name]
+    created = 0
+    for start in range(0, len(requests), batch_size):
+        result = await collection.bulk_write(requests[start:start + batch_size], ordered=False)
+        created += result.upserted_count
+    return created
+
+
+async def delete_missing(collection, seen: Set[bytes], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Delete the imported movies (the ones with a content_hash) whose natural key was not seen
+    :return: number of documents deleted
+    """
+    deleted, doomed = 0, []
+    cursor = collection.find({"content_hash": {"$exists": True}}, {"name": True, "director": True})
+    async for document in cursor:
+        if key_digest(natural_key(document)) not in seen:
+            doomed.append(document["_id"])
+        if len(doomed) >= batch_size:
+            result = await collection.bulk_write([DeleteMany({"_id": {"$in": doomed}})])
+            deleted += result.deleted_count
+            doomed = []
+    if doomed:
+        result = await collection.bulk_write([DeleteMany({"_id": {"$in": doomed}})])
+        deleted += result.deleted_count
+    return deleted
+
+
+async def import_movies(database, fp: IO[str], batch_size: int = DEFAULT_BATCH_SIZE,
+                        in_flight: int = DEFAULT_IN_FLIGHT, delete: bool = False,
+                        progress: Optional[Callable[[dict], None]] = None) -> dict:
+    """
+    Synchronize the movies of a motor database with a dump
+    :param database: motor database
+    :param fp: text file, JSON array or NDJSON
+    :param batch_size: rows per round trip
+    :param in_flight: number of batches being written while the next one is parsed
+    :param delete: delete the imported movies that are not in the dump (keeps a set of the keys seen)
+    :param progress: called with the stats after each batch is sent
+    :return: {"rows", "inserted", "updated", "unchanged", "deleted", "duplicates", "rejected", "failed",
+              "genres", "directors", "seconds", "rows_per_second"}
+    """
+    collection = database[Movie.__collection__]
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "deleted": 0, "duplicates": 0,
+             "rejected": 0, "failed": 0, "genres": 0, "directors": 0}
+    genres, directors = set(), set()
+    seen = set() if delete else None
+    slots = asyncio.Semaphore(in_flight)
+    # Every batch is awaited at the end, so that an error of any of them is seen
+    tasks = []
+    # Key digest -> task of the last batch writing it
+    writing = {}
+    started = time.monotonic()
+
+    async def bulk_write(requests: list) -> list:
+        """
+        :return: the requests that hit a duplicate key
+        """
+        try:
+            result = await collection.bulk_write(requests, ordered=False)
+            stats["inserted"] += result.upserted_count
+            stats["updated"] += result.modified_count
+            return []
+        except BulkWriteError as exc:
+            errors = exc.details.get("writeErrors", [])
+            stats["inserted"] += exc.details.get("nUpserted", 0)
+            stats["updated"] += exc.details.get("nModified", 0)
+            failed = [error for error in errors if error.get("code") != DUPLICATE_KEY]
+            if failed:
+                stats["failed"] += len(failed)
+                logger.warning("%d documents of a batch were not written: %s", len(failed), failed[0].get("errmsg"))
+            return [requests[error["index"]] for error in errors if error.get("code") == DUPLICATE_KEY]
+
+    async def write(batch: dict, previous: set):
+        # Rows not written yet, counted as failed when the batch fails (a lost connection, a timeout...)
+        unwritten = len(batch)
+        try:
+            if previous:
+                await asyncio.wait(previous)
+            names = list({name for name, _ in batch})
+            stored = {}
+            async for document in collection.find({"name": {"$in": names}},
+                                                  {"name": True, "director": True, "content_hash": True}):
+                key = natural_key(document)
+                # An imported movie rather than one created through the API with the same key
+                if key not in stored or "content_hash" in document:
+                    stored[key] = document
+            now, requests = datetime.utcnow(), []
+            for key, document in batch.items():
+                current = stored.get(key)
+                if current is not None and current.get("content_hash") == document["content_hash"]:
+                    stats["unchanged"] += 1
+                elif current is not None:
+                    requests.append(UpdateOne({"_id": current["_id"]}, {"$set": dict(document, modified_at=now)}))
+                else:
+                    requests.append(UpdateOne({"name": key[0], "director": key[1]},
+                                              {"$set": dict(document, modified_at=now),
+                                               "$setOnInsert": {"uid": str(uuid.uuid4()), "created_at": now}},
+                                              upsert=True))
+            unwritten = len(requests)
+            duplicates = await bulk_write(requests) if requests else []
+            unwritten = len(duplicates)
+            if duplicates:
+                # Inserted by another import since the read, the same upserts now update them
+                stats["failed"] += len(await bulk_write(duplicates))
+            unwritten = 0
+        except PyMongoError as exc:
+            stats["failed"] += unwritten
+            logger.error("%d rows of a batch were not written: %r", unwritten, exc)
+        finally:
+            slots.release()
+
+    async def send(batch: dict):
+        await slots.acquire()
+        digests = [key_digest(key) for key in batch]
+        # The row of a later batch must be written last
+        previous = {writing[digest] for digest in digests if digest in writing}
+        task = asyncio.ensure_future(write(batch, previous))
+        for digest in digests:
+            writing[digest] = task
+        tasks.append(task)
+
+        def done(_):
+            for digest in digests:
+                if writing.get(digest) is task:
+                    del writing[digest]
+
+        task.add_done_callback(done)
+        # Let the batch start before parsing the next one
+        await asyncio.sleep(0)
+        stats["seconds"] = time.monotonic() - started
+        if progress is not None:
+            progress(stats)
+
+    batch = {}
+    for row in iter_json_records(fp):
+        stats["rows"] += 1
+        try:
+            document = movie_document(row)
+        except ValueError as exc:
+            stats["rejected"] += 1
+            logger.debug("Row %d rejected: %s", stats["rows"], exc)
+            continue
+        key = natural_key(document)
+        if key in batch:
+            # Last one wins, like in a later batch
+            stats["duplicates"] += 1
+        batch[key] = document
+        genres.update(document["genre"])
+        directors.add(document["director"])
+        if seen is not None:
+            seen.add(key_digest(key))
+        if len(batch) >= batch_size:
+            await send(batch)
+            batch = {}
+    if batch:
+        await send(batch)
+    await asyncio.gather(*tasks)
+
+    if seen is not None:
+        if stats["failed"]:
+            logger.warning("Some rows were not written, imported movies missing from the feed are kept")
+        else:
+            stats["deleted"] = await delete_missing(collection, seen, batch_size)
+
+    now = datetime.utcnow()
+    stats["genres"] = await upsert_names(database[Genre.__collection__], genres, now, batch_size)
+    stats["directors"] = await upsert_names(database[Director.__collection__], directors, now, batch_size)
+    if stats["inserted"] or stats["updated"] or stats["deleted"]:
+        # One aggregation pass rather than a recompute per written row
+        await rebuild_all(database)
+    stats["seconds"] = time.monotonic() - started
+    stats["rows_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+
+def print_progress(stats: dict):
+    rate = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    print(f"{stats['rows']} rows parsed, {stats['inserted']} inserted, {stats['updated']} updated, "
+          f"{stats['unchanged']} unchanged, {rate:.0f} rows/s", flush=True)
+
+
+async def main(argv=None):
+    from app.db import DB_MOTOR_ENGINE
+
+    parser = argparse.ArgumentParser(description="Load a movie dump (JSON array or NDJSON) into MongoDB")
+    parser.add_argument("path", help="dump to load")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="documents per insert")
+    parser.add_argument("--in-flight", type=int, default=DEFAULT_IN_FLIGHT,
+                        help="insert batches written while the next one is parsed")
+    parser.add_argument("--delete-missing", action="store_true",
+                        help="delete the imported movies that are not in the dump")
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args(argv)
+
+    with open(args.path, "r", encoding="utf-8") as fp:
+        stats = await import_movies(DB_MOTOR_ENGINE, fp, batch_size=args.batch_size, in_flight=args.in_flight,
+                                    delete=args.delete_missing, progress=None if args.quiet else print_progress)
+    print(f"{stats['rows']} rows in {stats['seconds']:.1f}s ({stats['rows_per_second']:.0f} rows/s): "
+          f"{stats['inserted']} inserted, {stats['updated']} updated, {stats['unchanged']} unchanged, "
+          f"{stats['deleted']} deleted, {stats['duplicates']} duplicates, {stats['rejected']} rejected, "
+          f"{stats['failed']} failed, "
+          f"{stats['genres']} new genres, {stats['directors']} new directors")
+    if stats["inserted"] or stats["updated"] or stats["deleted"]:
+        print(f"Running API workers pick up the changes in their in-memory indexes within "
+              f"{Config.IN_MEMORY_INDEX_REFRESH_SECONDS:.0f}s (IN_MEMORY_INDEX_REFRESH_SECONDS, at restart if 0), "
+              f"run manage_similar.py to recompute the similar movie lists")
+    return 1 if stats["failed"] else 0
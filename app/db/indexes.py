@@ -0,0 +1,206 @@
+"""
+Declarative index spec for every collection the routers query, applied idempotently at startup
+
+CLI:
+    python manage_indexes.py            # create missing indexes, report drift
+    python manage_indexes.py --check    # only report, exit code 1 on drift
+    python manage_indexes.py --fix      # also rebuild drifted indexes and drop unknown ones, deleting the
+                                        # documents that duplicate a key of a unique index first
+"""
+import argparse
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.db.keywords import CASE_INSENSITIVE
+from app.models.movie import Movie, Genre, Director
+from app.models.token import RevokedToken
+from app.models.user import UserDB
+from app.search.similar import SIMILAR_MOVIES
+
+logger = logging.getLogger(__name__)
+
+INDEX_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds", "default_language")
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    Movie.__collection__: [
+        # get/update/delete by id
+        IndexModel([("uid", ASCENDING)], name="uid", unique=True),
+        # /movies and /search sort (popularity desc, uid asc), also walks keyset cursors
+        IndexModel([("popularity", DESCENDING), ("uid", ASCENDING)], name="popularity_uid"),
+        # /search?genres=...: equality on genre (multikey), then the sort, then the rating range
+        IndexModel([("genre", ASCENDING), ("popularity", DESCENDING), ("uid", ASCENDING), ("imdb_score", ASCENDING)],
+                   name="genre_popularity_uid_imdb_score"),
+        # genre leaderboards by imdb_score (the popularity ones walk genre_popularity_uid_imdb_score)
+        IndexModel([("genre", ASCENDING), ("imdb_score", DESCENDING), ("uid", ASCENDING)],
+                   name="genre_imdb_score_uid"),
+        # /search rating range without genres
+        IndexModel([("imdb_score", ASCENDING)], name="imdb_score"),
+        # keyword word / phrase matches. No language: an english index drops stop words, so titles like "It" or
+        # "Up" would match nothing
+        IndexModel([("name", TEXT), ("director", TEXT)], name="name_text_director_text", default_language="none"),
+        # natural key of the importer, unique over the imported movies (movies created through the API are not)
+        IndexModel([("name", ASCENDING), ("director", ASCENDING)], name="name_director", unique=True,
+                   partialFilterExpression={"content_hash": {"$exists": True}}),
+        # keyword prefix range scans (match=prefix)
+        IndexModel([("name", ASCENDING)], name="name_ci", collation=CASE_INSENSITIVE),
+        # last write, checked by the workers to rebuild their in-memory indexes (keep_indexes_in_sync)
+        IndexModel([("modified_at", DESCENDING)], name="modified_at"),
+        # director rollups, recomputed per director in filmography order
+        IndexModel([("director", ASCENDING), ("popularity", DESCENDING), ("uid", ASCENDING)],
+                   name="director_popularity_uid"),
+    ],
+    Genre.__collection__: [
+        IndexModel([("uid", ASCENDING)], name="uid", unique=True),
+        # /genres sort (name, uid)
+        IndexModel([("name", ASCENDING), ("uid", ASCENDING)], name="name_uid"),
+        # keyword prefix matches, in the same order
+        IndexModel([("name", ASCENDING), ("uid", ASCENDING)], name="name_uid_ci", collation=CASE_INSENSITIVE),
+    ],
+    Director.__collection__: [
+        IndexModel([("uid", ASCENDING)], name="uid", unique=True),
+        # /directors sort (name, uid)
+        IndexModel([("name", ASCENDING), ("uid", ASCENDING)], name="name_uid"),
+        # keyword prefix matches, in the same order
+        IndexModel([("name", ASCENDING), ("uid", ASCENDING)], name="name_uid_ci", collation=CASE_INSENSITIVE),
+    ],
+    UserDB.__collection__: [
+        # register and login lookups
+        IndexModel([("email_id", ASCENDING)], name="email_id", unique=True),
+    ],
+    RevokedToken.__collection__: [
+        # confirms the filter hits
+        IndexModel([("jti", ASCENDING)], name="jti", sparse=True),
+        # incremental refresh
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at"),
+        # dropped once the tokens they cover have expired
+        IndexModel([("expires_at", ASCENDING)], name="expires_at", expireAfterSeconds=0),
+    ],
+    SIMILAR_MOVIES: [
+        # lists to recompute when a movie they contain is written
+        IndexModel([("uids", ASCENDING)], name="uids"),
+    ],
+}
+
+
+def _normalize(index: dict) -> tuple:
+    """
+    Comparable (key, options) form of an index, from an IndexModel document or index_information() entry
+    """
+    key = list(index["key"].items()) if hasattr(index["key"], "items") else list(index["key"])
+    if key and key[0][0] == "_fts":
+        key = (TEXT, tuple(sorted(index.get("weights", {}))))
+    elif any(direction == TEXT for _, direction in key):
+        key = (TEXT, tuple(sorted(field for field, direction in key if direction == TEXT)))
+    else:
+        key = tuple((field, direction if isinstance(direction, str) else int(direction)) for field, direction in key)
+    # expireAfterSeconds can be 0
+    options = tuple((option, index[option]) for option in INDEX_OPTIONS
+                    if index.get(option) is not None and index.get(option) is not False)
+    # The server fills in every collation setting, only the ones of the spec are compared
+    collation = index.get("collation")
+    if collation and collation.get("locale") != "simple":
+        options += (("collation", collation.get("locale"), collation.get("strength", 3)),)
+    return key, options
+
+
+def diff_indexes(spec: List[IndexModel], existing: dict) -> dict:
+    """
+    Compare the spec of a collection with its index_information()
+    :return: {"missing": [names], "drifted": [names], "extra": [names], "ok": [names]}
+    """
+    report = {"missing": [], "drifted": [], "extra": [], "ok": []}
+    wanted = {index.document["name"]: index.document for index in spec}
+    for name, document in wanted.items():
+        if name not in existing:
+            report["missing"].append(name)
+        elif _normalize(document) != _normalize(existing[name]):
+            report["drifted"].append(name)
+        else:
+            report["ok"].append(name)
+    report["extra"] = [name for name in existing if name != "_id_" and name not in wanted]
+    return report
+
+
+async def drop_duplicates(collection, index: IndexModel) -> int:
+    """
+    Delete the documents a unique index would reject, keeping the last modified one of each key
+    :param collection: motor collection
+    :param index: unique index
+    :return: number of documents deleted
+    """
+    document = index.document
+    pipeline = [{"$match": document.get("partialFilterExpression", {})},
+                {"$sort": {"modified_at": -1, "_id": -1}},
+                {"$group": {"_id": [f"${field}" for field in document["key"]], "ids": {"$push": "$_id"}}},
+                {"$match": {"ids.1": {"$exists": True}}}]
+    deleted = 0
+    async for group in collection.aggregate(pipeline, allowDiskUse=True):
+        result = await collection.delete_many({"_id": {"$in": group["ids"][1:]}})
+        deleted += result.deleted_count
+    return deleted
+
+
+async def ensure_indexes(database, create: bool = True, fix: bool = False) -> Dict[str, dict]:
+    """
+    Apply the index spec to a motor database
+    :param database: motor database
+    :param create: create the missing indexes
+    :param fix: rebuild drifted indexes and drop the ones that are not in the spec, deleting the documents
+                that duplicate a key of a unique index first (see drop_duplicates)
+    :return: per collection report, see diff_indexes; indexes built now are listed under "created" and the
+             ones that failed to build under "failed"
+    """
+    reports = {}
+    for collection_name, spec in INDEXES.items():
+        collection = database[collection_name]
+        report = diff_indexes(spec, await collection.index_information())
+        report["created"], report["failed"] = [], []
+        by_name = {index.document["name"]: index for index in spec}
+
+        to_drop = report["drifted"] + report["extra"] if fix else []
+        for name in to_drop:
+            await collection.drop_index(name)
+        to_create = (report["missing"] if create else []) + (report["drifted"] if fix else [])
+        for name in to_create:
+            if fix and by_name[name].document.get("unique"):
+                deleted = await drop_duplicates(collection, by_name[name])
+                if deleted:
+                    logger.warning("Deleted %d documents of %s duplicating a key of %s, rebuild what is derived "
+                                   "from them (manage_rollups.py, manage_similar.py)", deleted, collection_name, name)
+            try:
+                await collection.create_indexes([by_name[name]])
+                report["created"].append(name)
+            except OperationFailure as exc:
+                report["failed"].append(name)
+                logger.error("Cannot build index %s.%s: %s", collection_name, name, exc)
+        report["missing"] = [name for name in report["missing"] if name not in report["created"]]
+
+        for name in report["drifted"]:
+            logger.warning("Index %s.%s does not match its spec%s", collection_name, name,
+                           ", rebuilt" if fix else "")
+        for name in report["extra"]:
+            logger.warning("Index %s.%s is not in the spec%s", collection_name, name, ", dropped" if fix else "")
+        reports[collection_name] = report
+    return reports
+
+
+def has_drift(reports: Dict[str, dict]) -> bool:
+    return any(report["missing"] or report["drifted"] or report["extra"] or report["failed"]
+               for report in reports.values())
+
+
+async def main(argv=None):
+    from app.db import DB_MOTOR_ENGINE
+
+    parser = argparse.ArgumentParser(description="Build and verify the MongoDB indexes")
+    parser.add_argument("--check", action="store_true", help="only report, do not create anything")
+    parser.add_argument("--fix", action="store_true", help="rebuild drifted indexes and drop unknown ones")
+    args = parser.parse_args(argv)
+
+    reports = await ensure_indexes(DB_MOTOR_ENGINE, create=not args.check, fix=args.fix and not args.check)
+    for collection_name, report in reports.items():
+        print(collection_name, {state: names for state, names in report.items() if names})
+    return 1 if args.check and has_drift(reports) else 0
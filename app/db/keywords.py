@@ -0,0 +1,104 @@
+"""
+Keyword filters that read an index instead of running a user supplied regex over the whole collection
+
+The keyword is escaped in every match mode but "regex":
+- word: values having any of the words. With a text index on the field the candidates come from $text, then
+  the field itself must contain one of the words (a text index can cover other fields too). Without one (the
+  small genre and director collections) the values containing one of the words are scanned for.
+- phrase: values containing the keyword. With a text index the candidates are those of a $text phrase search,
+  without one the values containing the keyword are scanned for.
+- prefix: values starting with the keyword, a range scan [keyword, keyword + U+FFFF) of the CASE_INSENSITIVE
+  index (U+FFFF sorts after every character).
+- regex: the keyword is a case insensitive regex, only on request and with a time limit, see time_limited.
+
+Every match is case insensitive, none ignores accents: "amelie" does not match "Amélie".
+"""
+import re
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi import status
+from pymongo.errors import ExecutionTimeout
+
+from app.config import Config
+
+KEYWORD_MATCHES = ("word", "phrase", "prefix", "regex")
+# Collation of the indexes backing the case insensitive matches, queries must use the same one. Strength 2
+# compares letters and accents but not case
+CASE_INSENSITIVE = {"locale": "en", "strength": 2}
+
+
+def keyword_match(match: str, phrase_match: bool = False) -> str:
+    """
+    :param match: "match" query param, validated
+    :param phrase_match: former flag of the endpoints, the default is then phrase instead of word
+    """
+    if not match:
+        return "phrase" if phrase_match else "word"
+    if match not in KEYWORD_MATCHES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"match must be one of {', '.join(KEYWORD_MATCHES)}")
+    return match
+
+
+def _contains(field: str, patterns) -> dict:
+    return {field: {"$regex": "|".join(re.escape(pattern) for pattern in patterns), "$options": "i"}}
+
+
+def keyword_query(field: str, keyword: str, match: str, text_index: bool = False) -> Tuple[list, dict]:
+    """
+    Plan the filters of a keyword, see the module docstring
+    :param field: name of the field the keyword is matched against
+    :param keyword: user input, not blank
+    :param match: one of KEYWORD_MATCHES
+    :param text_index: the collection has a text index covering the field
+    :return: (query filters, options of the cursor: collation and max_time_ms)
+    """
+    if match == "regex":
+        try:
+            re.compile(keyword)
+        except re.error as exc:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid regex: {exc}")
+        return [{field: {"$regex": keyword, "$options": "i"}}], {"max_time_ms": Config.REGEX_MAX_TIME_MS}
+    if match == "prefix":
+        keyword = keyword.lstrip()
+        return [{field: {"$gte": keyword, "$lt": keyword + "\uffff"}}], {"collation": CASE_INSENSITIVE}
+    if not text_index:
+        if match == "phrase":
+            return [_contains(field, [" ".join(keyword.split())])], {}
+        return [_contains(field, keyword.split())], {}
+
+    if match == "phrase":
+        # Quotes would end the phrase
+        phrase = " ".join(keyword.replace('"', " ").split())
+        return [{"$text": {"$search": f'"{phrase}"'}}, _contains(field, [phrase])], {}
+    # Words only: a leading "-" negates a term in $text
+    words = re.findall(r"\w+", keyword)
+    if not words:
+        return [{field: {"$in": []}}], {}
+    return [{"$text": {"$search": " ".join(words)}}, _contains(field, words)], {}
+
+
+def command_options(options: Optional[dict]) -> dict:
+    """
+    Keyword arguments of aggregate() and count_documents() for the options of keyword_query (find() takes them
+    as they are)
+    """
+    options = dict(options or {})
+    if "max_time_ms" in options:
+        options["maxTimeMS"] = options.pop("max_time_ms")
+    return options
+
+
+@contextmanager
+def time_limited():
+    """
+    Turn a query that ran out of time (a regex keyword) into a 400
+    """
+    try:
+        yield
+    except ExecutionTimeout:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"The keyword regex took more than {Config.REGEX_MAX_TIME_MS} ms, use a more "
+                                   f"selective one or another match")
@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List
+
+
+class BatchLoader:
+    """
+    DataLoader-style batching: the single key lookups made during one event-loop tick, from any number of
+    coroutines, are resolved together by one call to the batch function.
+    Nothing is kept once a batch is resolved, so results are never stale.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+                 max_batch_size: int = 1000):
+        """
+        :param batch_fn: coroutine taking a list of keys and returning {key: value}, missing keys resolve to None
+        :param max_batch_size: a batch is sent right away once it has this many keys
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.pending: Dict[Hashable, asyncio.Future] = {}
+        self.stats = {"loads": 0, "batches": 0}
+
+    def load(self, key: Hashable) -> Awaitable:
+        """
+        :return: awaitable resolving to the value of the key
+        """
+        self.stats["loads"] += 1
+        future = self.pending.get(key)
+        if future is None:
+            loop = asyncio.get_event_loop()
+            if not self.pending:
+                loop.call_soon(self._dispatch)
+            future = self.pending[key] = loop.create_future()
+            if len(self.pending) >= self.max_batch_size:
+                self._dispatch()
+        return future
+
+    async def load_many(self, keys: Iterable[Hashable]) -> list:
+        return list(await asyncio.gather(*[self.load(key) for key in keys]))
+
+    def _dispatch(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        self.stats["batches"] += 1
+        asyncio.ensure_future(self._resolve(pending))
+
+    async def _resolve(self, pending: Dict[Hashable, asyncio.Future]):
+        try:
+            values = await self.batch_fn(list(pending))
+        except Exception as exc:
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for key, future in pending.items():
+            if not future.done():
+                future.set_result(values.get(key))
@@ -1,6 +1,18 @@
+import time
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Type
+
 from fastapi import HTTPException
+from fastapi import status
+from odmantic import Model
+from odmantic.query import and_
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
+from app.config import Config
 from app.db import DB_ENGINE
+from app.db.keywords import command_options, time_limited
+from app.db.records import Record, record_type
 from app.models.user import UserDB, User
 
 
@@ -16,3 +28,246 @@ async def get_user(email_id: str, cls=User):
         user = cls(**user)
 
     return user
+
+
+class CountCache:
+    """
+    Bounded cache of filtered counts, per model. Every write to a model bumps its generation and
+    drops its entries, so a count computed while a write was in flight is never stored.
+    Only writes of this process are seen that way, entries also expire after ttl seconds so that writes of other
+    workers, import_data.py or the manage_*.py scripts are counted after at most that long.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generations = {}
+
+    def generation(self, model: Type[Model]) -> int:
+        return self.generations.get(model.__collection__, 0)
+
+    def get(self, model: Type[Model], key: str) -> Optional[int]:
+        entry_key = (model.__collection__, key)
+        entry = self.entries.get(entry_key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[entry_key]
+            return None
+        self.entries.move_to_end(entry_key)
+        return value
+
+    def set(self, model: Type[Model], key: str, value: int, generation: int):
+        if generation != self.generation(model):
+            return
+        self.entries[(model.__collection__, key)] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end((model.__collection__, key))
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, model: Type[Model]):
+        collection = model.__collection__
+        self.generations[collection] = self.generation(model) + 1
+        for entry_key in [k for k in self.entries if k[0] == collection]:
+            del self.entries[entry_key]
+
+
+COUNT_CACHE = CountCache(max_size=Config.COUNT_CACHE_SIZE, ttl=Config.RESPONSE_CACHE_TTL)
+
+
+async def count_documents(model: Type[Model], *queries, enabled: bool = True,
+                          options: Optional[dict] = None) -> Optional[int]:
+    """
+    Count the documents of a model matching the queries
+    Unfiltered counts come from the collection metadata, filtered ones are cached until the next write or for
+    RESPONSE_CACHE_TTL seconds
+    :param model: odmantic model
+    :param queries: query filters
+    :param enabled: when False nothing is counted and None is returned
+    :param options: collation and max_time_ms of the query, see keyword_query
+    :return: number of matching documents
+    """
+    if not enabled:
+        return None
+    if not queries:
+        return await DB_ENGINE.get_collection(model).estimated_document_count()
+
+    key = repr((queries, options)) if options else repr(queries)
+    count = COUNT_CACHE.get(model, key)
+    if count is None:
+        generation = COUNT_CACHE.generation(model)
+        if options:
+            with time_limited():
+                count = await DB_ENGINE.get_collection(model).count_documents(and_(*queries),
+                                                                              **command_options(options))
+        else:
+            count = await DB_ENGINE.count(model, *queries)
+        COUNT_CACHE.set(model, key, count, generation)
+    return count
+
+
+FACETS = ("genre", "imdb_score")
+
+
+def facet_pipelines(facets) -> dict:
+    """
+    $facet sub-pipelines computing the requested facets over the filtered movies
+    genre counts every (trimmed) genre, imdb_score is a histogram with buckets of width 1
+    """
+    pipelines = {}
+    if "genre" in facets:
+        pipelines["genre"] = [{"$unwind": "$genre"},
+                              {"$group": {"_id": {"$trim": {"input": "$genre"}}, "count": {"$sum": 1}}},
+                              {"$sort": {"count": -1, "_id": 1}}]
+    if "imdb_score" in facets:
+        pipelines["imdb_score"] = [{"$group": {"_id": {"$floor": "$imdb_score"}, "count": {"$sum": 1}}},
+                                   {"$sort": {"_id": 1}}]
+    return pipelines
+
+
+def format_facets(raw: dict) -> dict:
+    """
+    :param raw: {facet: [{"_id": value or bucket, "count": n}]}
+    :return: {"genre": [{"value", "count"}], "imdb_score": [{"from", "to", "count"}]}
+    """
+    facets = {}
+    if "genre" in raw:
+        facets["genre"] = [{"value": row["_id"], "count": row["count"]} for row in raw["genre"]]
+    if "imdb_score" in raw:
+        facets["imdb_score"] = [{"from": row["_id"], "to": row["_id"] + 1, "count": row["count"]}
+                                for row in raw["imdb_score"]]
+    return facets
+
+
+def parse_fields(model: Type[Model], fields: str, required: Iterable[str] = ("uid",)) -> Optional[dict]:
+    """
+    Turn a comma separated "fields" query param into a projection
+    :param model: odmantic model the fields belong to
+    :param fields: eg: "name,imdb_score"
+    :param required: fields that are always included
+    :return: projection document, None when no fields are requested
+    """
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    if not names:
+        return None
+    unknown = [name for name in names if name not in model.__fields__]
+    if unknown:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown fields: {', '.join(unknown)}")
+    projection = {"_id": model.__primary_field__ in names}
+    for name in list(required) + names:
+        if name != model.__primary_field__:
+            projection[name] = True
+    return projection
+
+
+# Stored for the importer (see app.db.importer), never read by the API
+HIDDEN_FIELDS = {"content_hash": False}
+
+
+async def find_records(model: Type[Model], queries: list, projection: Optional[dict] = None,
+                       sort: Optional[dict] = None, skip: int = 0, limit: Optional[int] = None,
+                       options: Optional[dict] = None) -> List[Record]:
+    """
+    Same as DB_ENGINE.find, but reads straight from a motor cursor and returns records instead of
+    validated model instances
+    :param model: odmantic model
+    :param queries: query filters
+    :param projection: only these fields leave Mongo, see parse_fields (all but HIDDEN_FIELDS by default)
+    :param sort: raw sort document, eg: {"popularity": -1, "uid": 1}
+    :param skip: number of documents to skip
+    :param limit: maximum number of documents
+    :param options: collation and max_time_ms of the query, see keyword_query
+    """
+    record_cls = record_type(model)
+    cursor = DB_ENGINE.get_collection(model).find(and_(*queries) if queries else {}, projection or HIDDEN_FIELDS,
+                                                  sort=list(sort.items()) if sort else None,
+                                                  skip=skip, limit=limit or 0, **(options or {}))
+    with time_limited():
+        return [record_cls(doc) for doc in await cursor.to_list(length=None)]
+
+
+async def find_with_facets(model: Type[Model], queries: list, sort: dict, skip: int, limit: int, facets,
+                           after=None, with_count: bool = True, projection: Optional[dict] = None,
+                           options: Optional[dict] = None):
+    """
+    Fetch a page, the total and the facets of the filtered set in a single aggregation
+    :param model: odmantic model
+    :param queries: query filters
+    :param sort: raw sort document, eg: {"popularity": -1, "uid": 1}
+    :param skip: number of documents to skip
+    :param limit: page size
+    :param facets: facets to compute, see FACETS
+    :param after: keyset filter applied to the page only (not to the total and the facets)
+    :param with_count: compute the total
+    :param projection: only return these fields
+    :param options: collation and max_time_ms of the query, see keyword_query
+    :return: (records, count, facets)
+    """
+    page = [{"$match": after}] if after else []
+    page += [{"$sort": sort}] + ([{"$skip": skip}] if skip else []) + [{"$limit": limit}]
+    page += [{"$project": projection}] if projection else []
+    stages = {"data": page, **facet_pipelines(facets)}
+    if with_count:
+        stages["count"] = [{"$count": "count"}]
+
+    pipeline = [{"$match": and_(*queries) if queries else {}}, {"$facet": stages}]
+    with time_limited():
+        cursor = DB_ENGINE.get_collection(model).aggregate(pipeline, **command_options(options))
+        result = (await cursor.to_list(length=1))[0]
+
+    record_cls = record_type(model)
+    instances = [record_cls(doc) for doc in result["data"]]
+    count = (result["count"][0]["count"] if result["count"] else 0) if with_count else None
+    return instances, count, format_facets({name: result[name] for name in facet_pipelines(facets)})
+
+
+def _versioned(uid: str, versions: Optional[list]) -> dict:
+    query = {"uid": uid}
+    if versions is not None:
+        query["modified_at"] = {"$in": versions}
+    return query
+
+
+async def find_one_and_set(model: Type[Model], uid: str, changes: dict, versions: Optional[list] = None,
+                           projection: Optional[dict] = None,
+                           return_document: bool = ReturnDocument.AFTER) -> Optional[dict]:
+    """
+    Apply a $set to the document with this uid in a single atomic command
+    :param model: odmantic model
+    :param uid: UUID
+    :param changes: fields to set
+    :param versions: modified_at values the document may still have (If-Match), None to skip the check
+    :param projection: fields of the returned document
+    :param return_document: ReturnDocument.AFTER for the updated document, BEFORE for the document as it was
+    :return: updated (or previous) document, None when nothing matched
+    :raise HTTPException: 409 when the changes give an imported movie the natural key of another one
+    """
+    try:
+        return await DB_ENGINE.get_collection(model).find_one_and_update(_versioned(uid, versions),
+                                                                          {"$set": changes},
+                                                                          projection=projection,
+                                                                          return_document=return_document)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"Another {model.__name__.lower()} already has this unique key")
+
+
+async def find_one_and_delete(model: Type[Model], uid: str, versions: Optional[list] = None) -> Optional[dict]:
+    """
+    Delete the document with this uid in a single atomic command
+    :return: deleted document, None when nothing matched
+    """
+    return await DB_ENGINE.get_collection(model).find_one_and_delete(_versioned(uid, versions))
+
+
+async def write_failed(model: Type[Model], uid: str, versions: Optional[list], label: str):
+    """
+    Raise the error of a write that matched nothing: 412 when the document exists but its version did not
+    match, 404 otherwise. Only reached on failure, successful writes never read first.
+    """
+    if versions is not None and await DB_ENGINE.get_collection(model).count_documents({"uid": uid}, limit=1):
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail=f"{label} {uid} was modified, fetch it again")
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find {label} with ID - {uid}")
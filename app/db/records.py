@@ -0,0 +1,79 @@
+"""
+Read path that skips odmantic: raw BSON documents are mapped to __slots__ records and written out with a
+fast JSON encoder (orjson when it is installed)
+"""
+import json
+from datetime import datetime
+from typing import Dict, Type
+
+from bson import ObjectId
+from odmantic import Model
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_MISSING = object()
+
+
+class Record:
+    """
+    Lightweight read-only view of a document, only the fields present in the document are set
+    """
+    __slots__ = ()
+
+    def __init__(self, doc: dict):
+        for name in self.__slots__:
+            value = doc.get("_id" if name == "id" else name, _MISSING)
+            if value is not _MISSING:
+                setattr(self, name, value)
+
+    def to_dict(self) -> dict:
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name, _MISSING)
+            if value is not _MISSING:
+                data[name] = str(value) if name == "id" else value
+        return data
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()})"
+
+
+RECORD_TYPES: Dict[str, Type[Record]] = {}
+
+
+def record_type(model: Type[Model]) -> Type[Record]:
+    """
+    :return: Record subclass with a slot for every field of the model
+    """
+    record_cls = RECORD_TYPES.get(model.__collection__)
+    if record_cls is None:
+        record_cls = type(f"{model.__name__}Record", (Record,), {"__slots__": tuple(model.__fields__)})
+        RECORD_TYPES[model.__collection__] = record_cls
+    return record_cls
+
+
+def _default(obj):
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    """
+    Serialize a response body, records / odmantic models / ObjectId / datetime included
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
@@ -0,0 +1,209 @@
+"""
+Rollups of the movie collection, kept next to it so that the pages built on them are a single key lookup
+
+director_stats, one document per director name:
+    {"_id": director, "count", "sum_imdb_score", "max_imdb_score", "total_popularity",
+     "top": top FILMOGRAPHY_SIZE movies by popularity}
+
+genre_top, one document per genre name, the leaderboards of the genre:
+    {"_id": genre, "popularity": top LEADERBOARD_SIZE movies by popularity,
+     "imdb_score": top LEADERBOARD_SIZE movies by imdb_score}
+
+Inserts are applied as deltas ($inc / $max / a sorted, sliced $push). An update or a delete can take a
+movie out of a top list or lower a max, so the rollups of the keys it touches are recomputed instead, from
+the indexed director and genre fields: a leaderboard is two index walks limited to LEADERBOARD_SIZE,
+never a sort over the collection. Concurrent writes to the same key can leave a rollup slightly off until the
+next write to that key or a rebuild.
+
+CLI:
+    python manage_rollups.py            # rebuild every rollup from the movie collection
+"""
+import argparse
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+
+from app.config import Config
+from app.models.movie import Movie
+
+logger = logging.getLogger(__name__)
+
+DIRECTOR_STATS = "director_stats"
+GENRE_TOP = "genre_top"
+
+# Fields of the movies listed in a filmography
+SUMMARY_FIELDS = ("uid", "name", "imdb_score", "popularity", "genre")
+TOP_SORT = {"popularity": -1, "uid": 1}
+# Orders of the genre leaderboards
+LEADERBOARDS = {"popularity": TOP_SORT, "imdb_score": {"imdb_score": -1, "uid": 1}}
+
+# Keys recomputed per round trip
+REBUILD_CHUNK_SIZE = 1000
+
+
+def _value(movie, field: str):
+    return movie.get(field) if isinstance(movie, dict) else getattr(movie, field, None)
+
+
+def movie_summary(movie) -> dict:
+    return {field: _value(movie, field) for field in SUMMARY_FIELDS}
+
+
+def directors_of(movies: Iterable) -> Set[str]:
+    return {_value(movie, "director") for movie in movies if _value(movie, "director") is not None}
+
+
+def genres_of(movies: Iterable) -> Set[str]:
+    return {genre for movie in movies for genre in _value(movie, "genre") or ()}
+
+
+def _director_pipeline(names: Optional[List[str]] = None) -> list:
+    pipeline = [{"$match": {"director": {"$in": names}}}] if names is not None else []
+    return pipeline + [
+        {"$sort": {"director": 1, **TOP_SORT}},
+        {"$group": {"_id": "$director",
+                    "count": {"$sum": 1},
+                    "sum_imdb_score": {"$sum": "$imdb_score"},
+                    "max_imdb_score": {"$max": "$imdb_score"},
+                    "total_popularity": {"$sum": "$popularity"},
+                    "top": {"$push": {field: f"${field}" for field in SUMMARY_FIELDS}}}},
+        {"$project": {"count": 1, "sum_imdb_score": 1, "max_imdb_score": 1, "total_popularity": 1,
+                      "top": {"$slice": ["$top", Config.FILMOGRAPHY_SIZE]}}},
+    ]
+
+
+async def add_to_director_stats(database, movies: Iterable):
+    """
+    Apply new movies to the rollups of their directors, one upsert per director
+    """
+    by_director = defaultdict(list)
+    for movie in movies:
+        by_director[_value(movie, "director")].append(movie)
+    requests = []
+    for director, added in by_director.items():
+        if director is None:
+            continue
+        requests.append(UpdateOne(
+            {"_id": director},
+            {"$inc": {"count": len(added),
+                      "sum_imdb_score": sum(_value(movie, "imdb_score") for movie in added),
+                      "total_popularity": sum(_value(movie, "popularity") for movie in added)},
+             "$max": {"max_imdb_score": max(_value(movie, "imdb_score") for movie in added)},
+             "$push": {"top": {"$each": [movie_summary(movie) for movie in added],
+                               "$sort": TOP_SORT,
+                               "$slice": Config.FILMOGRAPHY_SIZE}}},
+            upsert=True))
+    if requests:
+        await database[DIRECTOR_STATS].bulk_write(requests, ordered=False)
+
+
+async def rebuild_director_stats(database, names: Optional[Iterable[str]] = None) -> int:
+    """
+    Recompute director rollups from the movie collection
+    :param names: directors to recompute, all of them when None (the collection is replaced with $out)
+    :return: number of rollups written
+    """
+    movies = database[Movie.__collection__]
+    if names is None:
+        await movies.aggregate(_director_pipeline() + [{"$out": DIRECTOR_STATS}], allowDiskUse=True).to_list(None)
+        return await database[DIRECTOR_STATS].estimated_document_count()
+
+    names, written = sorted(names), 0
+    for start in range(0, len(names), REBUILD_CHUNK_SIZE):
+        chunk = names[start:start + REBUILD_CHUNK_SIZE]
+        rollups = {doc["_id"]: doc async for doc in movies.aggregate(_director_pipeline(chunk))}
+        # A director without movies left has no rollup
+        requests = [ReplaceOne({"_id": name}, rollups[name], upsert=True) if name in rollups
+                    else DeleteOne({"_id": name}) for name in chunk]
+        if requests:
+            await database[DIRECTOR_STATS].bulk_write(requests, ordered=False)
+        written += len(rollups)
+    return written
+
+
+async def add_to_genre_top(database, movies: Iterable):
+    """
+    Merge new movies into the leaderboards of their genres, one upsert per genre
+    """
+    by_genre = defaultdict(list)
+    for movie in movies:
+        for genre in set(_value(movie, "genre") or ()):
+            by_genre[genre].append(movie_summary(movie))
+    requests = [UpdateOne({"_id": genre},
+                          {"$push": {board: {"$each": added, "$sort": sort, "$slice": Config.LEADERBOARD_SIZE}
+                                     for board, sort in LEADERBOARDS.items()}},
+                          upsert=True)
+                for genre, added in by_genre.items()]
+    if requests:
+        await database[GENRE_TOP].bulk_write(requests, ordered=False)
+
+
+async def _leaderboards(movies, genre: str) -> Dict[str, list]:
+    projection = {"_id": False, **{field: True for field in SUMMARY_FIELDS}}
+    boards = await asyncio.gather(*[movies.find({"genre": genre}, projection).sort(list(sort.items()))
+                                    .limit(Config.LEADERBOARD_SIZE).to_list(length=Config.LEADERBOARD_SIZE)
+                                    for sort in LEADERBOARDS.values()])
+    return dict(zip(LEADERBOARDS, boards))
+
+
+async def rebuild_genre_top(database, names: Optional[Iterable[str]] = None) -> int:
+    """
+    Recompute genre leaderboards from the movie collection
+    :param names: genres to recompute, all of them when None (leaderboards of genres without movies are dropped)
+    :return: number of leaderboards written
+    """
+    movies = database[Movie.__collection__]
+    rebuild_all_genres = names is None
+    names = sorted(await movies.distinct("genre") if rebuild_all_genres else names)
+    written = 0
+    for start in range(0, len(names), REBUILD_CHUNK_SIZE):
+        chunk = names[start:start + REBUILD_CHUNK_SIZE]
+        boards = await asyncio.gather(*[_leaderboards(movies, genre) for genre in chunk])
+        requests = [ReplaceOne({"_id": genre}, board, upsert=True) if board["popularity"]
+                    else DeleteOne({"_id": genre}) for genre, board in zip(chunk, boards)]
+        if requests:
+            await database[GENRE_TOP].bulk_write(requests, ordered=False)
+        written += sum(1 for board in boards if board["popularity"])
+    if rebuild_all_genres:
+        await database[GENRE_TOP].delete_many({"_id": {"$nin": names}})
+    return written
+
+
+def director_view(director: dict, stats: Optional[dict], size: int) -> Dict:
+    """
+    Director page from a director document and its rollup
+    :param size: number of movies of the filmography
+    """
+    stats = stats or {}
+    count = stats.get("count", 0)
+    return {"uid": director.get("uid"),
+            "name": director.get("name"),
+            "created_at": director.get("created_at"),
+            "modified_at": director.get("modified_at"),
+            "movie_count": count,
+            "mean_imdb_score": stats["sum_imdb_score"] / count if count else None,
+            "max_imdb_score": stats.get("max_imdb_score") if count else None,
+            "total_popularity": stats.get("total_popularity", 0.0),
+            "filmography": stats.get("top", [])[:size]}
+
+
+async def rebuild_all(database) -> Dict[str, int]:
+    """
+    Rebuild every rollup
+    :return: {rollup: number of documents}
+    """
+    return {DIRECTOR_STATS: await rebuild_director_stats(database),
+            GENRE_TOP: await rebuild_genre_top(database)}
+
+
+async def main(argv=None):
+    from app.db import DB_MOTOR_ENGINE
+
+    parser = argparse.ArgumentParser(description="Rebuild the rollups of the movie collection")
+    parser.parse_args(argv)
+    for name, count in (await rebuild_all(DB_MOTOR_ENGINE)).items():
+        print(f"{name}: {count} documents")
+    return 0
@@ -0,0 +1,221 @@
+import functools
+import hashlib
+import inspect
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Dict, Optional, Type
+
+from fastapi import HTTPException, Request, Response
+from fastapi import status
+from odmantic import Model
+
+from app.config import Config
+from app.db.records import dumps
+
+# Handler arguments that never change the response body
+IGNORED_ARGS = ("request", "current_user")
+
+VALIDATOR_HEADERS = ("etag", "last-modified")
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of serialized JSON responses, grouped by the model they are read from so that a
+    write to a model only drops the responses built from it.
+    Invalidation is per process: a write from another worker, import_data.py or the manage_*.py scripts
+    is only seen once the entries expire, the TTL is the only bound on that staleness (and on the ETags,
+    see cached_response).
+    Each model also has a generation, bumped on every write, so that a response read while the model was
+    being written to is not stored.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.generations = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "not_modified": 0}
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.stats["misses"] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return value
+
+    def generation(self, model: Type[Model]) -> int:
+        return self.generations.get(model.__collection__, 0)
+
+    def set(self, key, value, generation: int = None):
+        """
+        :param generation: generation of the model when the response was built, a response built while
+                           the model was being written to is not stored
+        """
+        if generation is not None and generation != self.generations.get(key[0], 0):
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, model: Type[Model]):
+        collection = model.__collection__
+        self.generations[collection] = self.generation(model) + 1
+        for key in [key for key in self.entries if key[0] == collection]:
+            del self.entries[key]
+            self.stats["invalidations"] += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def info(self) -> Dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {**self.stats,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hit_ratio": self.stats["hits"] / lookups if lookups else 0.0}
+
+
+def entity_tag(*parts) -> str:
+    return '"' + hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest() + '"'
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def new_version() -> datetime:
+    """
+    modified_at of a write, truncated to the millisecond precision of BSON dates so that the ETag built
+    from it matches the stored value
+    """
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def item_tag(modified_at: datetime, *parts) -> str:
+    """
+    ETag of a single document: its version (modified_at in ms), followed by a hash of the representation
+    parts if any. If-Match can be turned back into a version without reading the document.
+    """
+    version = (modified_at.replace(tzinfo=None) - EPOCH) // timedelta(milliseconds=1)
+    if parts:
+        return f'"{version}-{hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest()[:16]}"'
+    return f'"{version}"'
+
+
+def if_match_versions(request: Optional[Request]) -> Optional[list]:
+    """
+    modified_at values accepted by the If-Match header of a write
+    :return: None when there is no precondition
+    :raise HTTPException: 412 when none of the tags is a version
+    """
+    if_match = request.headers.get("if-match") if request is not None else None
+    if if_match is None or if_match.strip() == "*":
+        return None
+    versions = []
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        # If-Match uses the strong comparison, weak tags never match
+        if tag.startswith('"'):
+            try:
+                versions.append(EPOCH + timedelta(milliseconds=int(tag.strip('"').split("-")[0])))
+            except ValueError:
+                pass
+    if not versions:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail="If-Match does not match")
+    return versions
+
+
+def validators(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {"ETag": etag}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def is_not_modified(request: Optional[Request], headers: Dict[str, str]) -> bool:
+    """
+    Evaluate If-None-Match (which takes precedence) or If-Modified-Since against the response validators
+    """
+    if request is None:
+        return False
+    headers = {name.lower(): value for name, value in headers.items()}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        etag = headers.get("etag")
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return etag is not None and ("*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag
+                                                            for tag in tags])
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None and "last-modified" in headers:
+        try:
+            return parsedate_to_datetime(headers["last-modified"]) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def cached_response(cache: ResponseCache, model: Type[Model]):
+    """
+    Cache the JSON body of a GET handler, keyed on the handler and its (validated) arguments
+    Hits are returned as-is, without touching the database or the serializer
+
+    Responses carry an ETag and conditional requests are answered with 304. The handler can return a
+    Response carrying its own validators, otherwise the ETag is a hash of the body: it changes whenever
+    the body does, whichever process wrote the data, once the cached entry is refreshed.
+    :param cache: ResponseCache instance
+    :param model: model the response is read from, its writes invalidate the cached responses
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            request = bound.arguments.get("request")
+            params = tuple(sorted((name, value) for name, value in bound.arguments.items()
+                                  if name not in IGNORED_ARGS))
+            key = (model.__collection__, func.__name__, params)
+
+            generation = cache.generation(model)
+            entry = cache.get(key) if cache.max_size > 0 else None
+            if entry is None:
+                result = await func(*args, **kwargs)
+                if isinstance(result, Response):
+                    if result.status_code != status.HTTP_200_OK:
+                        return result
+                    entry = (result.body, {name: value for name, value in result.headers.items()
+                                           if name in VALIDATOR_HEADERS})
+                else:
+                    entry = (dumps(result), {})
+                if "etag" not in entry[1]:
+                    entry[1]["etag"] = entity_tag(hashlib.sha1(entry[0]).hexdigest())
+                if cache.max_size > 0:
+                    cache.set(key, entry, generation)
+
+            body, headers = entry
+            if is_not_modified(request, headers):
+                cache.stats["not_modified"] += 1
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            return Response(content=body, media_type="application/json", headers=headers)
+        return wrapper
+    return decorator
+
+
+RESPONSE_CACHE = ResponseCache(max_size=Config.RESPONSE_CACHE_SIZE, ttl=Config.RESPONSE_CACHE_TTL)
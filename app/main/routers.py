@@ -1,17 +1,35 @@
+import asyncio
 import os
 import random
-import re
 import uuid
 from datetime import datetime
 from typing import List, Optional
 
 import pymongo
-from fastapi import Request, Depends, HTTPException
+from fastapi import Request, Response, Depends, HTTPException, Query, Body
 from fastapi import APIRouter
 from fastapi import status
+from fastapi.responses import StreamingResponse
 
+from app.auth.cache import USER_CACHE
 from app.auth.utils import get_current_active_user
-from app.db import MONGO_CLIENT, DB_ENGINE
+from app.db import MONGO_CLIENT, DB_ENGINE, DB_MOTOR_ENGINE
+from app.db.bulk import bulk_create, bulk_delete, bulk_patch, validate_changes
+from app.db.indexes import ensure_indexes
+from app.db.keywords import keyword_match, keyword_query
+from app.db.query import FACETS, HIDDEN_FIELDS, count_documents, find_records, find_with_facets, parse_fields
+from app.db.query import find_one_and_delete, find_one_and_set, write_failed
+from app.db.rollups import DIRECTOR_STATS, GENRE_TOP, LEADERBOARDS, director_view
+from app.db.records import dumps, record_type
+from app.main.cache import RESPONSE_CACHE, cached_response, if_match_versions, item_tag, new_version, validators
+from app.main.utils import find_movies_by_uids, movie_deleted, movies_changed, use_search_index
+from app.main.utils import find_movie_page, index_facets, keyset_query, next_cursor, page_of_hits
+from app.main.utils import EXPORT_FORMATS, search_queries, stream_export, movies_deleted, movies_updated
+from app.main.utils import MOVIE_LOADER, batch_get_movies, movies_created, previous_movies
+from app.main.utils import search_catalog, use_columnar_catalog
+from app.main.utils import names_written, similar_movies, written_uids, use_fuzzy_index
+from app.main.utils import build_in_memory_indexes, collections_version, in_memory_indexes_enabled, keep_indexes_in_sync
+from app.search import FUZZY_INDEX, MOVIE_INDEX, SUGGEST_INDEX
 from app.models.user import User, AuthUser
 from app.models.movie import Movie, Director, Genre
 
@@ -20,15 +38,44 @@ from app.config import Config
 main_router = APIRouter()
 
 
+BACKGROUND_TASKS = []
+
+
 @main_router.on_event("startup")
-def startup():
+async def startup():
     DB_MOTOR_ENGINE = MONGO_CLIENT[Config.MONGODB_DB_NAME]
-    DB_MOTOR_ENGINE.movie.create_index([("name", pymongo.TEXT), ("director", pymongo.TEXT)])
+    await ensure_indexes(DB_MOTOR_ENGINE)
+    if in_memory_indexes_enabled():
+        version = await collections_version()
+        await build_in_memory_indexes()
+        if Config.IN_MEMORY_INDEX_REFRESH_SECONDS > 0:
+            BACKGROUND_TASKS.append(asyncio.ensure_future(
+                keep_indexes_in_sync(Config.IN_MEMORY_INDEX_REFRESH_SECONDS, version)))
+    if Config.RESPONSE_CACHE_PREWARM:
+        await prewarm_response_cache()
+
+
+async def prewarm_response_cache():
+    """
+    Serve the first page of every list endpoint once so that it is cached before the first request
+    """
+    await asyncio.gather(list_movies(request=None),
+                         search_movies(request=None),
+                         list_genres(request=None),
+                         list_directors(request=None))
+
+
+def versioned(content, modified_at: datetime) -> Response:
+    """
+    JSON response of a write, its ETag can be sent as If-Match by the next write
+    """
+    return Response(content=dumps(content), media_type="application/json", headers={"ETag": item_tag(modified_at)})
 
 
 @main_router.on_event("shutdown")
 def shutdown():
-    pass
+    while BACKGROUND_TASKS:
+        BACKGROUND_TASKS.pop().cancel()
 
 
 @main_router.get("/")
@@ -39,57 +86,203 @@ async def index(current_user: AuthUser = Depends(get_current_active_user)):
         return f"Welcome to IMDB-mimic !!"
 
 
+@main_router.get("/cache/stats")
+async def response_cache_stats():
+    return {**RESPONSE_CACHE.info(), "users": USER_CACHE.info()}
+
+
 @main_router.get("/movies")
-async def list_movies(request: Request, keyword: str = "", size: int = 10, page: int =  1):
+@cached_response(RESPONSE_CACHE, Movie)
+async def list_movies(request: Request, keyword: str = "", size: int = 10, page: int =  1, cursor: str = "",
+                      with_count: bool = True, fields: str = "", ids: str = "", match: str = ""):
     """
     List all movies sorted based on popularity and filtered by keyword if given
-    Also accepts "size" and "page" query params for pagination
+    "match" is how the keyword is matched against the name: "phrase" (default), "word", "prefix" or "regex",
+    see app.db.keywords
+    Also accepts "size" and "page" query params for pagination, or "cursor" (the "next_cursor" of the
+    previous page) to fetch the next page without skipping over the previous ones
+    "with_count=false" skips counting the total, "count" is then null
+    "fields=name,imdb_score" only returns these fields (plus uid and popularity, the sort key)
+    "ids=a,b,c" fetches these movies instead, see /movies/batch-get
     :param request:
     :return: list of movies
     """
+    if ids:
+        return await batch_get_movies(ids.split(","), parse_fields(Movie, fields))
 
     try:
         size = int(size)
         page = int(page)
     except:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
-
-    if keyword:
-        keyword = re.compile(keyword, re.IGNORECASE)
-        movies = await DB_ENGINE.find(Movie,
-                                      Movie.name.match(keyword),
-                                      sort=Movie.popularity.desc(),
-                                      skip=(page-1)*size,
-                                      limit=size)
-    else:
-        movies = await DB_ENGINE.find(Movie,
-                                      sort=Movie.popularity.desc(),
-                                      skip=(page-1)*size,
-                                      limit=size)
-
-    count = await DB_ENGINE.count(Movie,
-                                  Movie.name.match(keyword))
+    projection = parse_fields(Movie, fields, required=("uid", "popularity"))
+    match = keyword_match(match, phrase_match=True)
+
+    if use_search_index(keyword, match):
+        hits = MOVIE_INDEX.search(keyword, phrase=match == "phrase")
+        uids, next_page_cursor = page_of_hits(hits, size, page, cursor)
+        return {
+            "data": await find_movies_by_uids(uids, projection),
+            "count": len(hits) if with_count else None,
+            "size": size,
+            "page": page,
+            "next_cursor": next_page_cursor
+        }
+
+    queries, options = [], {}
+    if keyword.strip():
+        queries, options = keyword_query("name", keyword, match, text_index=True)
+    page_queries = queries + [keyset_query(Movie.popularity, Movie.uid, cursor, descending=True)] if cursor else queries
+
+    movies, count = await asyncio.gather(find_movie_page(page_queries,
+                                                         skip=0 if cursor else (page-1)*size,
+                                                         limit=size,
+                                                         projection=projection,
+                                                         options=options),
+                                         count_documents(Movie, *queries, enabled=with_count, options=options))
 
     resp = {
         "data": movies,
         "count": count,
         "size": size,
-        "page": page
+        "page": page,
+        "next_cursor": next_cursor(movies, "popularity", size)
     }
     return resp
 
 
+@main_router.get("/movies/export")
+async def export_movies(keyword: str = "", genres: str = "", min_rating: float = 0.0, max_rating: float = 10.0,
+                        phrase_match: bool = False, export_format: str = Query("ndjson", alias="format"),
+                        batch_size: int = Config.EXPORT_BATCH_SIZE, fields: str = "", match: str = ""):
+    """
+    Stream every movie matching the /search filters as NDJSON or CSV
+    Reads a single cursor batch by batch, only one batch is held in memory and the next one is only
+    fetched once the client has consumed the previous one
+    :param export_format: "ndjson" or "csv"
+    :param batch_size: number of documents fetched per round trip
+    :param fields: only export these fields (plus uid)
+    :return: streamed file
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"format must be among {', '.join(EXPORT_FORMATS)}")
+    if not 0 < batch_size <= Config.EXPORT_MAX_BATCH_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"batch_size must be between 1 and {Config.EXPORT_MAX_BATCH_SIZE}")
+    genres = [genre for genre in genres.split(",") if genre.strip()]
+    projection = parse_fields(Movie, fields) or {"_id": False, **HIDDEN_FIELDS}
+
+    queries, options = search_queries(keyword, genres, min_rating, max_rating, keyword_match(match, phrase_match))
+    return StreamingResponse(stream_export(Movie, queries, projection, export_format, batch_size, options),
+                             media_type=EXPORT_FORMATS[export_format],
+                             headers={"Content-Disposition": f'attachment; filename="movies.{export_format}"'})
+
+
+@main_router.post("/movies/bulk")
+async def bulk_add_movies(items: List[dict], current_user: User = Depends(get_current_active_user)):
+    """
+    Create movies in unordered bulk inserts, invalid or duplicate items do not stop the others
+    :param items: Movie objects
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    resp, created = await bulk_create(DB_MOTOR_ENGINE, Movie, items)
+    await movies_created(created)
+    return resp
+
+
+@main_router.patch("/movies/bulk")
+async def bulk_update_movies(items: List[dict], current_user: User = Depends(get_current_active_user)):
+    """
+    Partially update movies, each item is {"uid": ..., field: value}
+    :param items: changes
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    previous = await previous_movies([item["uid"] for item in items if isinstance(item, dict) and "uid" in item])
+    resp = await bulk_patch(DB_MOTOR_ENGINE, Movie, items)
+    await movies_updated([result["uid"] for result in resp["results"] if result["status"] == "updated"], previous)
+    return resp
+
+
+@main_router.delete("/movies/bulk")
+async def bulk_delete_movies(uids: List[str] = Body(...), current_user: User = Depends(get_current_active_user)):
+    """
+    Delete movies by uid
+    :param uids: movie ids
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    previous = await previous_movies(uids)
+    resp = await bulk_delete(DB_MOTOR_ENGINE, Movie, uids)
+    await movies_deleted([result["uid"] for result in resp["results"] if result["status"] == "deleted"], previous)
+    return resp
+
+
+@main_router.post("/movies/batch-get")
+async def batch_get(ids: List[str] = Body(..., embed=True), fields: str = ""):
+    """
+    Fetch many movies by id with a single query, for lists too long for GET /movies?ids=
+    :param ids: movie ids
+    :param fields: only return these fields (plus uid)
+    :return: {"data": movies in the requested order, "missing": ids that are not found}
+    """
+    resp = await batch_get_movies(ids, parse_fields(Movie, fields))
+    return Response(content=dumps(resp), media_type="application/json")
+
+
+@main_router.get("/movies/{movie_id}/similar")
+async def get_similar_movies(movie_id, size: int = Config.SIMILAR_MOVIES_SIZE):
+    """
+    Movies similar to this one (genres, director, imdb_score and popularity), from its precomputed list
+    :param movie_id: UUID
+    :param size: number of movies, at most SIMILAR_MOVIES_SIZE
+    :return: {"uid", "data": movies with their "similarity" in [0, 1], most similar first}
+    """
+    if not 0 <= size <= Config.SIMILAR_MOVIES_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"size must be between 0 and {Config.SIMILAR_MOVIES_SIZE}")
+    movies = await similar_movies(movie_id, size)
+    if movies is None:
+        # No list yet (new movie, lists never built) or no such movie
+        if not await DB_ENGINE.get_collection(Movie).count_documents({"uid": movie_id}, limit=1):
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"Cannot find movie with ID - {movie_id}")
+        movies = []
+    return {"uid": movie_id, "data": movies}
+
+
 @main_router.get("/movies/{movie_id}", response_model=Movie)
-async def get_movie_by_id(movie_id):
-    try:
-        movie_obj = await DB_ENGINE.find_one(Movie, Movie.uid == movie_id)
-        if movie_obj:
-            return movie_obj
-        else:
-            raise
-    except:
+@cached_response(RESPONSE_CACHE, Movie)
+async def get_movie_by_id(movie_id, request: Request, fields: str = ""):
+    """
+    Get a movie by id, with ETag / Last-Modified validators derived from its modified_at
+    Answers If-None-Match / If-Modified-Since with 304 when the movie did not change
+    :param movie_id: UUID
+    :param request:
+    :param fields: only return these fields (plus uid), eg: "name,imdb_score"
+    :return: movie object
+    """
+    projection = parse_fields(Movie, fields)
+    if projection:
+        movies = await find_records(Movie, [Movie.uid == movie_id], {**projection, "modified_at": True}, limit=1)
+        movie_obj = movies[0] if movies else None
+    else:
+        movie_obj = await MOVIE_LOADER.load(movie_id)
+    if movie_obj is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find movie with ID - {movie_id}")
 
+    movie = movie_obj.to_dict()
+    if projection and "modified_at" not in projection:
+        modified_at = movie.pop("modified_at", None)
+    else:
+        modified_at = movie.get("modified_at")
+    if modified_at is None:
+        return movie
+    return Response(content=dumps(movie), media_type="application/json",
+                    headers=validators(item_tag(modified_at, *sorted(projection or {})), modified_at))
+
 
 
 @main_router.post("/movies")
@@ -106,56 +299,100 @@ async def add_movies(new_movies: List[Movie], current_user: User = Depends(get_c
     except:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    await movies_created(new_movies)
     return new_movies
 
 
 @main_router.put("/movies/{movie_id}")
-async def update_movie(movie_id, updated_movie: Movie, current_user: User = Depends(get_current_active_user)):
+async def update_movie(movie_id, request: Request, updated_movie: Movie,
+                       current_user: User = Depends(get_current_active_user)):
     """
-    Update movie object based on movie id
+    Update movie object based on movie id, in a single atomic command
+    Send the ETag of the movie as If-Match to only update it if nobody modified it since
     :param movie_id: UUID
+    :param request:
     :param updated_movie: updated object of Movie
     :param current_user: Dependency Injection
-    :return:
+    :return: movie id, with the new ETag
+    """
+    modified_at = new_version()
+    changes = {"name": updated_movie.name,
+               "imdb_score": updated_movie.imdb_score,
+               "genre": updated_movie.genre,
+               "director": updated_movie.director,
+               "popularity": updated_movie.popularity,
+               "modified_at": modified_at}
+    versions = if_match_versions(request)
+    previous = await find_one_and_set(Movie, movie_id, changes, versions, return_document=pymongo.ReturnDocument.BEFORE)
+    if previous is None:
+        await write_failed(Movie, movie_id, versions, "movie")
+    await movies_changed([record_type(Movie)(previous)], [record_type(Movie)(dict(previous, **changes))])
+    return versioned(movie_id, modified_at)
+
+
+@main_router.patch("/movies/{movie_id}")
+async def patch_movie(movie_id, request: Request, changes: dict = Body(...),
+                      current_user: User = Depends(get_current_active_user)):
+    """
+    Partially update a movie: only the given fields are sent, as a single $set
+    Send the ETag of the movie as If-Match to only update it if nobody modified it since
+    :param movie_id: UUID
+    :param request:
+    :param changes: fields to update, eg: {"name": "..."}
+    :param current_user: Dependency Injection
+    :return: updated movie, with the new ETag
     """
     try:
-        movie_obj = await DB_ENGINE.find_one(Movie, Movie.uid == movie_id)
-        if movie_obj is None: raise
-    except:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find movie with Id {movie_id}")
-    movie_obj.name=updated_movie.name
-    movie_obj.imdb_score=updated_movie.imdb_score
-    movie_obj.genre = updated_movie.genre
-    movie_obj.director = updated_movie.director
-    movie_obj.popularity = updated_movie.popularity
-    movie_obj.modified_at = datetime.utcnow()
-    await DB_ENGINE.save(movie_obj)
-    return movie_id
+        changes = validate_changes(Movie, changes)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    modified_at = new_version()
+    versions = if_match_versions(request)
+    changes = dict(changes, modified_at=modified_at)
+    previous = await find_one_and_set(Movie, movie_id, changes, versions, return_document=pymongo.ReturnDocument.BEFORE)
+    if previous is None:
+        await write_failed(Movie, movie_id, versions, "movie")
+    movie = record_type(Movie)(dict(previous, **changes))
+    await movies_changed([record_type(Movie)(previous)], [movie])
+    return versioned(movie, modified_at)
 
 
 @main_router.delete("/movies/{movie_id}", response_model=Movie)
-async def delete_movie(movie_id, current_user: User = Depends(get_current_active_user)):
+async def delete_movie(movie_id, request: Request, current_user: User = Depends(get_current_active_user)):
     """
-    Delete movie object based on movie id
+    Delete movie object based on movie id, in a single atomic command
+    Send the ETag of the movie as If-Match to only delete it if nobody modified it since
     :param movie_id: UUID
+    :param request:
     :param current_user: Dependency Injection
-    :return:
+    :return: deleted movie
     """
-    try:
-        movie_obj = await DB_ENGINE.find_one(Movie, Movie.uid == movie_id)
-    except:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find movie with id {movie_id}")
-
-    await DB_ENGINE.delete(movie_obj)
+    versions = if_match_versions(request)
+    movie_doc = await find_one_and_delete(Movie, movie_id, versions)
+    if movie_doc is None:
+        await write_failed(Movie, movie_id, versions, "movie")
+    movie_obj = Movie.parse_doc(movie_doc)
+    await movie_deleted(movie_obj)
     return movie_obj
 
 
 @main_router.get("/search")
+@cached_response(RESPONSE_CACHE, Movie)
 async def search_movies(request: Request, keyword: str = "", genres: str ="", min_rating:float = 0.0,
-                        max_rating:float = 10.0, phrase_match:bool = False, size:int = 10, page:int = 1):
+                        max_rating:float = 10.0, phrase_match:bool = False, size:int = 10, page:int = 1,
+                        cursor: str = "", with_count: bool = True, facets: str = "", fields: str = "",
+                        fuzzy: bool = False, match: str = ""):
     """
     Advanced search for movies sorted based on popularity and filtered by keyword if given
-    Also accepts "size" and "page" query params for pagination
+    "match" is how the keyword is matched against the name: "word" (default, any of the words), "phrase" (same
+    as phrase_match=true), "prefix" or "regex", see app.db.keywords
+    "fuzzy=true" tolerates typos in the keyword, movies are then sorted by edit distance to the keyword, then
+    popularity (needs FUZZY_SEARCH_ENABLED, a keyword too common for the trigram index is searched as usual)
+    Also accepts "size" and "page" query params for pagination, or "cursor" for keyset pagination
+    "with_count=false" skips counting the total, "count" is then null
+    "facets=genre,imdb_score" adds per genre counts and an imdb_score histogram of the filtered movies,
+    computed in the same round trip as the page
+    "fields=name,imdb_score" only returns these fields (plus uid and popularity, the sort key)
     :param request:
     :return: list of movies
     """
@@ -167,56 +404,124 @@ async def search_movies(request: Request, keyword: str = "", genres: str ="", mi
         min_rating = float(min_rating)
         max_rating = float(max_rating)
         if phrase_match:
-            if phrase_match == "true":
+            if phrase_match is True or phrase_match == "true":
                 phrase_match = True
             else:
                 phrase_match = False
         else:
             phrase_match = False
+        facets = [facet.strip() for facet in facets.split(",") if facet.strip()]
     except:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
-
-    if phrase_match:
-        keyword = re.compile(keyword, re.IGNORECASE)
-    else:
-        # # Regex: (?:word1) | (?:word2) | (?:word3)
-        keyword = re.compile("|".join([f"(?:{x})" for x in keyword.split() if x.strip()]), re.IGNORECASE)
-        print(keyword)
-
-    queries = [
-        Movie.name.match(keyword) if keyword else None,
-        Movie.genre.in_(genres) if len(genres) > 0 else None,
-        Movie.imdb_score.gte(min_rating),
-        Movie.imdb_score.lte(max_rating)
-    ]
-
-    queries = [q for q in queries if q is not None]
-    print(queries)
-
-    movies = await DB_ENGINE.find(Movie,
-                                  *queries,
-                                  sort=Movie.popularity.desc(),
-                                  skip=(page-1)*size,
-                                  limit=size)
-
-    count = await DB_ENGINE.count(Movie,
-                                  *queries)
+    if any(facet not in FACETS for facet in facets):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"facets must be among {', '.join(FACETS)}")
+    projection = parse_fields(Movie, fields, required=("uid", "popularity"))
+    match = keyword_match(match, phrase_match)
+
+    hits, docs = None, None
+    if fuzzy and use_fuzzy_index(keyword):
+        hits, docs = FUZZY_INDEX.search(keyword, genres=genres, min_rating=min_rating,
+                                        max_rating=max_rating), FUZZY_INDEX.docs
+    if hits is None and use_search_index(keyword, match):
+        hits, docs = MOVIE_INDEX.search(keyword, phrase=match == "phrase", genres=genres,
+                                        min_rating=min_rating, max_rating=max_rating), MOVIE_INDEX.docs
+    if hits is not None:
+        uids, next_page_cursor = page_of_hits(hits, size, page, cursor)
+        resp = {
+            "data": await find_movies_by_uids(uids, projection),
+            "count": len(hits) if with_count else None,
+            "size": size,
+            "page": page,
+            "next_cursor": next_page_cursor
+        }
+        if facets:
+            resp["facets"] = index_facets(hits, facets, docs)
+        return resp
+
+    if use_columnar_catalog(keyword):
+        uids, count, facet_counts = search_catalog(genres, min_rating, max_rating,
+                                                   skip=0 if cursor else (page-1)*size, limit=size,
+                                                   cursor=cursor, facets=facets)
+        movies = await find_movies_by_uids(uids, projection)
+        resp = {
+            "data": movies,
+            "count": count if with_count else None,
+            "size": size,
+            "page": page,
+            "next_cursor": next_cursor(movies, "popularity", size)
+        }
+        if facets:
+            resp["facets"] = facet_counts
+        return resp
+
+    queries, options = search_queries(keyword, genres, min_rating, max_rating, match)
+
+    if facets:
+        movies, count, facet_counts = await find_with_facets(
+            Movie, queries,
+            sort={"popularity": -1, "uid": 1},
+            skip=0 if cursor else (page-1)*size,
+            limit=size,
+            facets=facets,
+            after=keyset_query(Movie.popularity, Movie.uid, cursor, descending=True) if cursor else None,
+            with_count=with_count,
+            projection=projection,
+            options=options)
+        return {
+            "data": movies,
+            "count": count,
+            "size": size,
+            "page": page,
+            "next_cursor": next_cursor(movies, "popularity", size),
+            "facets": facet_counts
+        }
+
+    page_queries = queries + [keyset_query(Movie.popularity, Movie.uid, cursor, descending=True)] if cursor else queries
+    movies, count = await asyncio.gather(find_movie_page(page_queries,
+                                                         skip=0 if cursor else (page-1)*size,
+                                                         limit=size,
+                                                         projection=projection,
+                                                         options=options),
+                                         count_documents(Movie, *queries, enabled=with_count, options=options))
 
     resp = {
         "data": movies,
         "count": count,
         "size": size,
-        "page": page
+        "page": page,
+        "next_cursor": next_cursor(movies, "popularity", size)
     }
     return resp
 
 
+@main_router.get("/suggest")
+async def suggest(q: str = "", size: int = 10):
+    """
+    Typeahead over movie, director and genre names, answered from the in-memory prefix index
+    A suggestion matches when one of the first words of its name starts with q
+    :param q: what was typed so far
+    :param size: number of suggestions, at most SUGGEST_MAX_SIZE
+    :return: {"q", "data": [{"kind", "uid", "name", "popularity"}]} most popular first
+    """
+    if not 0 <= size <= Config.SUGGEST_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"size must be between 0 and {Config.SUGGEST_MAX_SIZE}")
+    if not Config.SUGGEST_ENABLED or not SUGGEST_INDEX.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Suggestions are not available")
+    return {"q": q, "data": SUGGEST_INDEX.suggest(q, size)}
+
+
 
 @main_router.get("/genres")
-async def list_genres(request: Request, keyword: str = "", size: int = 10, page: int =  1):
+@cached_response(RESPONSE_CACHE, Genre)
+async def list_genres(request: Request, keyword: str = "", size: int = 10, page: int =  1, cursor: str = "",
+                      with_count: bool = True, match: str = ""):
     """
     List all genres sorted chronologically and filtered by keyword if given
-    Also accepts "size" and "page" query params for pagination
+    "match" is how the keyword is matched against the name: "phrase" (default, the name contains the keyword),
+    "word" (the name contains one of the words), "prefix" or "regex", see app.db.keywords
+    Also accepts "size" and "page" query params for pagination, or "cursor" for keyset pagination
+    "with_count=false" skips counting the total, "count" is then null
     :param request:
     :return: list of genres
     """
@@ -227,31 +532,55 @@ async def list_genres(request: Request, keyword: str = "", size: int = 10, page:
     except:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
 
-    if keyword:
-        keyword = re.compile(keyword, re.IGNORECASE)
-        genres = await DB_ENGINE.find(Genre,
-                                      Genre.name.match(keyword),
-                                      sort=Genre.name,
-                                      skip=(page-1)*size,
-                                      limit=size)
-    else:
-        genres = await DB_ENGINE.find(Genre,
-                                      sort=Genre.name,
-                                      skip=(page-1)*size,
-                                      limit=size)
+    match = keyword_match(match, phrase_match=True)
+    queries, options = [], {}
+    if keyword.strip():
+        queries, options = keyword_query("name", keyword, match)
+    page_queries = queries + [keyset_query(Genre.name, Genre.uid, cursor)] if cursor else queries
 
-    count = await DB_ENGINE.count(Genre,
-                                  Genre.name.match(keyword))
+    genres, count = await asyncio.gather(find_records(Genre,
+                                                      page_queries,
+                                                      sort={"name": 1, "uid": 1},
+                                                      skip=0 if cursor else (page-1)*size,
+                                                      limit=size,
+                                                      options=options),
+                                         count_documents(Genre, *queries, enabled=with_count, options=options))
 
     resp = {
         "data": genres,
         "count": count,
         "size": size,
-        "page": page
+        "page": page,
+        "next_cursor": next_cursor(genres, "name", size)
     }
     return resp
 
 
+@main_router.get("/genres/{genre_id}/top")
+async def get_genre_top(genre_id, by: str = "popularity", size: int = 10):
+    """
+    Top movies of a genre, read from its materialized leaderboard in the same round trip as the genre
+    :param genre_id: UUID
+    :param by: "popularity" or "imdb_score"
+    :param size: number of movies, at most LEADERBOARD_SIZE
+    :return: {"uid", "name", "by", "data": movies}
+    """
+    if by not in LEADERBOARDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"by must be one of {', '.join(LEADERBOARDS)}")
+    if not 0 <= size <= Config.LEADERBOARD_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"size must be between 0 and {Config.LEADERBOARD_SIZE}")
+    pipeline = [{"$match": {"uid": genre_id}},
+                {"$limit": 1},
+                {"$lookup": {"from": GENRE_TOP, "localField": "name", "foreignField": "_id", "as": "top"}}]
+    docs = await DB_ENGINE.get_collection(Genre).aggregate(pipeline).to_list(length=1)
+    if not docs:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find genre with ID - {genre_id}")
+    boards = docs[0]["top"][0] if docs[0]["top"] else {}
+    return {"uid": docs[0]["uid"], "name": docs[0]["name"], "by": by, "data": boards.get(by, [])[:size]}
+
+
 @main_router.post("/genres")
 async def add_genres(new_genres: List[Genre], current_user: User = Depends(get_current_active_user)):
     if not isinstance(new_genres, list):
@@ -266,53 +595,127 @@ async def add_genres(new_genres: List[Genre], current_user: User = Depends(get_c
     except:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    await names_written(Genre, [genre.uid for genre in new_genres])
     return new_genres
 
 
+@main_router.post("/genres/bulk")
+async def bulk_add_genres(items: List[dict], current_user: User = Depends(get_current_active_user)):
+    """
+    Create genres in unordered bulk inserts, invalid or duplicate items do not stop the others
+    :param items: Genre objects
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    resp, created = await bulk_create(DB_MOTOR_ENGINE, Genre, items)
+    await names_written(Genre, written_uids(resp))
+    return resp
+
+
+@main_router.patch("/genres/bulk")
+async def bulk_update_genres(items: List[dict], current_user: User = Depends(get_current_active_user)):
+    """
+    Partially update genres, each item is {"uid": ..., field: value}
+    :param items: changes
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    resp = await bulk_patch(DB_MOTOR_ENGINE, Genre, items)
+    await names_written(Genre, written_uids(resp))
+    return resp
+
+
+@main_router.delete("/genres/bulk")
+async def bulk_delete_genres(uids: List[str] = Body(...), current_user: User = Depends(get_current_active_user)):
+    """
+    Delete genres by uid
+    :param uids: genre ids
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    resp = await bulk_delete(DB_MOTOR_ENGINE, Genre, uids)
+    await names_written(Genre, written_uids(resp))
+    return resp
+
+
 @main_router.put("/genres/{genre_id}")
-async def update_genre(genre_id, updated_genre: Genre, current_user: User = Depends(get_current_active_user)):
+async def update_genre(genre_id, request: Request, updated_genre: Genre,
+                       current_user: User = Depends(get_current_active_user)):
     """
-    Update genre object based on genre id
+    Update genre object based on genre id, in a single atomic command
+    Send the ETag of the genre as If-Match to only update it if nobody modified it since
     :param genre_id: UUID
+    :param request:
     :param updated_genre: updated object of Genre
     :param current_user: Dependency Injection
-    :return:
+    :return: genre id, with the new ETag
+    """
+    modified_at = new_version()
+    changes = {"name": updated_genre.name, "modified_at": modified_at}
+    versions = if_match_versions(request)
+    genre_doc = await find_one_and_set(Genre, genre_id, changes, versions)
+    if genre_doc is None:
+        await write_failed(Genre, genre_id, versions, "genre")
+    await names_written(Genre, [genre_id])
+    return versioned(genre_id, modified_at)
+
+
+@main_router.patch("/genres/{genre_id}")
+async def patch_genre(genre_id, request: Request, changes: dict = Body(...),
+                      current_user: User = Depends(get_current_active_user)):
+    """
+    Partially update a genre: only the given fields are sent, as a single $set
+    Send the ETag of the genre as If-Match to only update it if nobody modified it since
+    :param genre_id: UUID
+    :param request:
+    :param changes: fields to update, eg: {"name": "..."}
+    :param current_user: Dependency Injection
+    :return: updated genre, with the new ETag
     """
     try:
-        genre_obj = await DB_ENGINE.find_one(Genre, Genre.uid == genre_id)
-        if genre_obj is None: raise
-    except:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find genre with ID - {genre_id}")
-    genre_obj.name = updated_genre.name
-    genre_obj.modified_at = datetime.utcnow()
-    await DB_ENGINE.save(genre_obj)
-    return genre_obj.uid
+        changes = validate_changes(Genre, changes)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    modified_at = new_version()
+    versions = if_match_versions(request)
+    genre_doc = await find_one_and_set(Genre, genre_id, dict(changes, modified_at=modified_at), versions)
+    if genre_doc is None:
+        await write_failed(Genre, genre_id, versions, "genre")
+    await names_written(Genre, [genre_id])
+    return versioned(record_type(Genre)(genre_doc), modified_at)
 
 
 @main_router.delete("/genres/{genre_id}", response_model=Genre)
-async def delete_genre(genre_id, current_user: User = Depends(get_current_active_user)):
+async def delete_genre(genre_id, request: Request, current_user: User = Depends(get_current_active_user)):
     """
-    Delete genre object based on genre id
+    Delete genre object based on genre id, in a single atomic command
+    Send the ETag of the genre as If-Match to only delete it if nobody modified it since
     :param genre_id: UUID
+    :param request:
     :param current_user: Dependency Injection
-    :return:
+    :return: deleted genre
     """
-    try:
-        genre_obj = await DB_ENGINE.find_one(Genre, Genre.uid == genre_id)
-        if genre_obj is None: raise
-    except:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find genre with ID - {genre_id}")
-    await DB_ENGINE.delete(genre_obj)
+    versions = if_match_versions(request)
+    genre_doc = await find_one_and_delete(Genre, genre_id, versions)
+    if genre_doc is None:
+        await write_failed(Genre, genre_id, versions, "genre")
+    genre_obj = Genre.parse_doc(genre_doc)
+    await names_written(Genre, [genre_id])
     return genre_obj
 
 
 
 
 @main_router.get("/directors")
-async def list_directors(request: Request, keyword: str = "", size: int = 10, page: int =  1):
+@cached_response(RESPONSE_CACHE, Director)
+async def list_directors(request: Request, keyword: str = "", size: int = 10, page: int =  1, cursor: str = "",
+                         with_count: bool = True, match: str = ""):
     """
     List all directors sorted chronologically and filtered by keyword if given
-    Also accepts "size" and "page" query params for pagination
+    "match" is how the keyword is matched against the name: "phrase" (default, the name contains the keyword),
+    "word" (the name contains one of the words), "prefix" or "regex", see app.db.keywords
+    Also accepts "size" and "page" query params for pagination, or "cursor" for keyset pagination
+    "with_count=false" skips counting the total, "count" is then null
     :param request:
     :return: list of directors
     """
@@ -323,30 +726,52 @@ async def list_directors(request: Request, keyword: str = "", size: int = 10, pa
     except:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
 
-    if keyword:
-        keyword = re.compile(keyword, re.IGNORECASE)
-        directors = await DB_ENGINE.find(Director,
-                                      Director.name.match(keyword),
-                                      sort=Director.name,
-                                      skip=(page-1)*size,
-                                      limit=size)
-    else:
-        directors = await DB_ENGINE.find(Director,
-                                      sort=Director.name,
-                                      skip=(page-1)*size,
-                                      limit=size)
+    match = keyword_match(match, phrase_match=True)
+    queries, options = [], {}
+    if keyword.strip():
+        queries, options = keyword_query("name", keyword, match)
+    page_queries = queries + [keyset_query(Director.name, Director.uid, cursor)] if cursor else queries
 
-    count = await DB_ENGINE.count(Director,
-                                  Director.name.match(keyword))
+    directors, count = await asyncio.gather(find_records(Director,
+                                                         page_queries,
+                                                         sort={"name": 1, "uid": 1},
+                                                         skip=0 if cursor else (page-1)*size,
+                                                         limit=size,
+                                                         options=options),
+                                            count_documents(Director, *queries, enabled=with_count, options=options))
 
     resp = {
         "data": directors,
         "count": count,
         "size": size,
-        "page": page
+        "page": page,
+        "next_cursor": next_cursor(directors, "name", size)
     }
     return resp
 
+
+@main_router.get("/directors/{director_id}")
+async def get_director_by_id(director_id, size: int = Config.FILMOGRAPHY_SIZE):
+    """
+    Get a director with the aggregates of their movies, read from the director_stats rollup in the same
+    round trip: movie count, mean / max imdb_score, total popularity and the most popular movies
+    :param director_id: UUID
+    :param size: number of movies of the filmography, at most FILMOGRAPHY_SIZE
+    :return: director page
+    """
+    if not 0 <= size <= Config.FILMOGRAPHY_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"size must be between 0 and {Config.FILMOGRAPHY_SIZE}")
+    pipeline = [{"$match": {"uid": director_id}},
+                {"$limit": 1},
+                {"$lookup": {"from": DIRECTOR_STATS, "localField": "name", "foreignField": "_id", "as": "stats"}}]
+    docs = await DB_ENGINE.get_collection(Director).aggregate(pipeline).to_list(length=1)
+    if not docs:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail=f"Cannot find director with ID - {director_id}")
+    return director_view(docs[0], docs[0]["stats"][0] if docs[0]["stats"] else None, size)
+
+
 @main_router.post("/directors")
 async def add_directors(new_directors: List[Director], current_user: User = Depends(get_current_active_user)):
     if not isinstance(new_directors, list):
@@ -362,41 +787,110 @@ async def add_directors(new_directors: List[Director], current_user: User = Depe
     except:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    await names_written(Director, [director.uid for director in new_directors])
     return new_directors
 
 
+@main_router.post("/directors/bulk")
+async def bulk_add_directors(items: List[dict], current_user: User = Depends(get_current_active_user)):
+    """
+    Create directors in unordered bulk inserts, invalid or duplicate items do not stop the others
+    :param items: Director objects
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    resp, created = await bulk_create(DB_MOTOR_ENGINE, Director, items)
+    await names_written(Director, written_uids(resp))
+    return resp
+
+
+@main_router.patch("/directors/bulk")
+async def bulk_update_directors(items: List[dict], current_user: User = Depends(get_current_active_user)):
+    """
+    Partially update directors, each item is {"uid": ..., field: value}
+    :param items: changes
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    resp = await bulk_patch(DB_MOTOR_ENGINE, Director, items)
+    await names_written(Director, written_uids(resp))
+    return resp
+
+
+@main_router.delete("/directors/bulk")
+async def bulk_delete_directors(uids: List[str] = Body(...), current_user: User = Depends(get_current_active_user)):
+    """
+    Delete directors by uid
+    :param uids: director ids
+    :param current_user: Dependency Injection
+    :return: per item results and counts
+    """
+    resp = await bulk_delete(DB_MOTOR_ENGINE, Director, uids)
+    await names_written(Director, written_uids(resp))
+    return resp
+
+
 @main_router.put("/directors/{director_id}")
-async def update_director(director_id, updated_director: Director, current_user: User = Depends(get_current_active_user)):
+async def update_director(director_id, request: Request, updated_director: Director,
+                       current_user: User = Depends(get_current_active_user)):
     """
-    Update director object based on director id
-    :param genre_id: UUID
-    :param updated_genre: updated object of Director
+    Update director object based on director id, in a single atomic command
+    Send the ETag of the director as If-Match to only update it if nobody modified it since
+    :param director_id: UUID
+    :param request:
+    :param updated_director: updated object of Director
     :param current_user: Dependency Injection
-    :return:
+    :return: director id, with the new ETag
+    """
+    modified_at = new_version()
+    changes = {"name": updated_director.name, "modified_at": modified_at}
+    versions = if_match_versions(request)
+    director_doc = await find_one_and_set(Director, director_id, changes, versions)
+    if director_doc is None:
+        await write_failed(Director, director_id, versions, "director")
+    await names_written(Director, [director_id])
+    return versioned(director_id, modified_at)
+
+
+@main_router.patch("/directors/{director_id}")
+async def patch_director(director_id, request: Request, changes: dict = Body(...),
+                      current_user: User = Depends(get_current_active_user)):
+    """
+    Partially update a director: only the given fields are sent, as a single $set
+    Send the ETag of the director as If-Match to only update it if nobody modified it since
+    :param director_id: UUID
+    :param request:
+    :param changes: fields to update, eg: {"name": "..."}
+    :param current_user: Dependency Injection
+    :return: updated director, with the new ETag
     """
     try:
-        director_obj = await DB_ENGINE.find_one(Director, Director.uid == director_id)
-        if director_obj is None: raise
-    except:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find director with ID - {director_id}")
-    director_obj.name = updated_director.name
-    director_obj.modified_at = datetime.utcnow()
-    await DB_ENGINE.save(director_obj)
-    return director_obj.uid
+        changes = validate_changes(Director, changes)
+    except ValueError as exc:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
+    modified_at = new_version()
+    versions = if_match_versions(request)
+    director_doc = await find_one_and_set(Director, director_id, dict(changes, modified_at=modified_at), versions)
+    if director_doc is None:
+        await write_failed(Director, director_id, versions, "director")
+    await names_written(Director, [director_id])
+    return versioned(record_type(Director)(director_doc), modified_at)
 
 
 @main_router.delete("/directors/{director_id}", response_model=Director)
-async def delete_director(director_id, current_user: User = Depends(get_current_active_user)):
+async def delete_director(director_id, request: Request, current_user: User = Depends(get_current_active_user)):
     """
-    Delete director object based on director id
+    Delete director object based on director id, in a single atomic command
+    Send the ETag of the director as If-Match to only delete it if nobody modified it since
     :param director_id: UUID
+    :param request:
     :param current_user: Dependency Injection
-    :return:
+    :return: deleted director
     """
-    try:
-        director_obj = await DB_ENGINE.find_one(Director, Director.uid == director_id)
-        if director_obj is None: raise
-    except:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Cannot find director with ID - {director_id}")
-    await DB_ENGINE.delete(director_obj)
+    versions = if_match_versions(request)
+    director_doc = await find_one_and_delete(Director, director_id, versions)
+    if director_doc is None:
+        await write_failed(Director, director_id, versions, "director")
+    director_obj = Director.parse_doc(director_doc)
+    await names_written(Director, [director_id])
     return director_obj
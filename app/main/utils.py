@@ -0,0 +1,519 @@
+import asyncio
+import base64
+import binascii
+import csv
+import io
+import json
+import logging
+import math
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi import status
+from odmantic.query import QueryExpression, and_, or_
+
+from app.config import Config
+from app.db import DB_MOTOR_ENGINE
+from app.db.keywords import keyword_query
+from app.db.loader import BatchLoader
+from app.db.query import COUNT_CACHE, find_records, format_facets
+from app.db.records import dumps, record_type
+from app.db.rollups import add_to_director_stats, add_to_genre_top, directors_of, genres_of
+from app.db.rollups import rebuild_director_stats, rebuild_genre_top
+from app.main.cache import RESPONSE_CACHE
+from app.models.movie import Director, Genre, Movie
+from app.search import CATALOG, FUZZY_INDEX, MOVIE_INDEX, SUGGEST_INDEX
+from app.search.similar import SIMILAR_MOVIES, refresh_similar
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+SEARCH_INDEX_PROJECTION = {"_id": 0, "uid": 1, "name": 1, "director": 1, "popularity": 1, "imdb_score": 1, "genre": 1}
+ROLLUP_KEY_PROJECTION = {"_id": 0, "uid": 1, "director": 1, "genre": 1}
+NAME_PROJECTION = {"_id": 0, "uid": 1, "name": 1}
+SUGGEST_KINDS = {Director: "director", Genre: "genre"}
+
+
+async def build_search_index():
+    """
+    (Re)build the in-memory inverted index from the movie collection
+    """
+    MOVIE_INDEX.clear()
+    async for doc in DB_MOTOR_ENGINE[Movie.__collection__].find({}, SEARCH_INDEX_PROJECTION):
+        MOVIE_INDEX.add(doc)
+    MOVIE_INDEX.ready = True
+
+
+async def build_fuzzy_index():
+    """
+    (Re)build the in-memory trigram index from the movie collection
+    """
+    FUZZY_INDEX.clear()
+    async for doc in DB_MOTOR_ENGINE[Movie.__collection__].find({}, SEARCH_INDEX_PROJECTION):
+        FUZZY_INDEX.add(doc)
+    FUZZY_INDEX.ready = True
+
+
+async def build_columnar_catalog(batch_size: int = 10000):
+    """
+    (Re)build the columnar catalog from the movie collection, batch_size movies at a time
+    """
+    CATALOG.clear()
+    batch = []
+    async for doc in DB_MOTOR_ENGINE[Movie.__collection__].find({}, SEARCH_INDEX_PROJECTION):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            CATALOG.add_all(batch)
+            batch = []
+    CATALOG.add_all(batch)
+    CATALOG.ready = CATALOG.available
+
+
+async def build_suggest_index():
+    """
+    (Re)build the /suggest prefix index from the movie, director and genre collections
+    """
+    SUGGEST_INDEX.clear()
+    async for doc in DB_MOTOR_ENGINE[Movie.__collection__].find({}, SEARCH_INDEX_PROJECTION):
+        SUGGEST_INDEX.load("movie", [doc])
+    for model, kind in SUGGEST_KINDS.items():
+        async for doc in DB_MOTOR_ENGINE[model.__collection__].find({}, NAME_PROJECTION):
+            SUGGEST_INDEX.load(kind, [doc])
+    SUGGEST_INDEX.finish()
+
+
+def in_memory_indexes_enabled() -> bool:
+    return (Config.SEARCH_INDEX_ENABLED or Config.FUZZY_SEARCH_ENABLED or catalog_enabled() or
+            Config.SUGGEST_ENABLED)
+
+
+async def build_in_memory_indexes():
+    """
+    (Re)build every enabled in-memory index, each one falls back to Mongo while it is being built
+    """
+    if Config.SEARCH_INDEX_ENABLED:
+        await build_search_index()
+    if Config.FUZZY_SEARCH_ENABLED:
+        await build_fuzzy_index()
+    if catalog_enabled():
+        await build_columnar_catalog()
+    if Config.SUGGEST_ENABLED:
+        await build_suggest_index()
+
+
+async def collections_version() -> tuple:
+    """
+    Changes with every write to the collections the in-memory indexes are built from, whichever process made
+    it: their number of documents and last modified_at
+    """
+    version = []
+    for model in (Movie, Director, Genre):
+        collection = DB_MOTOR_ENGINE[model.__collection__]
+        last = await collection.find_one({}, {"_id": 0, "modified_at": 1}, sort=[("modified_at", -1)])
+        version.append((await collection.estimated_document_count(), (last or {}).get("modified_at")))
+    return tuple(version)
+
+
+async def keep_indexes_in_sync(interval: float, version: tuple):
+    """
+    Rebuild the in-memory indexes when their collections were written by another worker, import_data.py or a
+    manage_*.py script. Writes of this process are applied to them right away
+    :param interval: seconds between two checks
+    :param version: collections_version() when the indexes were built
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            current = await collections_version()
+            if current != version:
+                # Taken before the rebuild, a write made meanwhile triggers the next one
+                version = current
+                await build_in_memory_indexes()
+        except Exception:
+            logger.exception("Cannot rebuild the in-memory indexes")
+
+
+def search_queries(keyword: str, genres: List[str], min_rating: float, max_rating: float,
+                   match: str) -> Tuple[list, dict]:
+    """
+    Mongo filters of /search, also used by /movies/export
+    :param match: how the keyword is matched, one of KEYWORD_MATCHES
+    :return: (query filters, options of the cursor), see keyword_query
+    """
+    queries, options = [], {}
+    if keyword.strip():
+        queries, options = keyword_query("name", keyword, match, text_index=True)
+    if genres:
+        queries.append(Movie.genre.in_(genres))
+    queries.append(Movie.imdb_score.gte(min_rating))
+    queries.append(Movie.imdb_score.lte(max_rating))
+    return queries, options
+
+
+async def stream_export(model, queries: list, projection: dict, export_format: str, batch_size: int,
+                        options: Optional[dict] = None):
+    """
+    Yield the documents matching the queries as NDJSON or CSV, one chunk per cursor batch
+    :param model: odmantic model
+    :param queries: query filters
+    :param projection: fields to export
+    :param export_format: one of EXPORT_FORMATS
+    :param batch_size: number of documents fetched per round trip
+    :param options: collation and max_time_ms of the query, see keyword_query (the time limit covers the
+        whole export)
+    """
+    cursor = DB_MOTOR_ENGINE[model.__collection__].find(and_(*queries) if queries else {}, projection,
+                                                        batch_size=batch_size, **(options or {}))
+    columns = [name for name in model.__fields__
+               if name != model.__primary_field__ and projection.get(name, not any(projection.values()))]
+    if projection.get("_id"):
+        columns.append(model.__primary_field__)
+
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        yield buffer.getvalue()
+
+    while True:
+        docs = await cursor.to_list(length=batch_size)
+        if not docs:
+            break
+        if export_format == "csv":
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction="ignore")
+            for doc in docs:
+                writer.writerow(csv_row(doc))
+            yield buffer.getvalue()
+        else:
+            yield b"".join(dumps(ndjson_row(doc)) + b"\n" for doc in docs)
+
+
+def ndjson_row(doc: dict) -> dict:
+    if "_id" in doc:
+        doc["id"] = doc.pop("_id")
+    return doc
+
+
+def csv_row(doc: dict) -> dict:
+    doc = ndjson_row(doc)
+    for name, value in doc.items():
+        if isinstance(value, list):
+            doc[name] = "|".join(str(item).strip() for item in value)
+        elif hasattr(value, "isoformat"):
+            doc[name] = value.isoformat()
+    return doc
+
+
+def find_movie_page(queries: list, skip: int, limit: int, projection: Optional[dict] = None,
+                    options: Optional[dict] = None):
+    """
+    :return: awaitable for a page of movie records sorted by (popularity desc, uid)
+    """
+    return find_records(Movie, queries, projection, sort={"popularity": -1, "uid": 1}, skip=skip, limit=limit,
+                        options=options)
+
+
+def use_search_index(keyword, match: str = "word") -> bool:
+    """
+    The search index matches words and phrases, prefix and regex keywords go to Mongo
+    """
+    return bool(keyword) and match in ("word", "phrase") and Config.SEARCH_INDEX_ENABLED and MOVIE_INDEX.ready
+
+
+def use_fuzzy_index(keyword) -> bool:
+    return bool(keyword.strip()) and Config.FUZZY_SEARCH_ENABLED and FUZZY_INDEX.ready
+
+
+def catalog_enabled() -> bool:
+    """
+    The columnar catalog backs /search and the similar movie lists
+    """
+    return Config.COLUMNAR_ENGINE_ENABLED or Config.SIMILAR_MOVIES_ENABLED
+
+
+def use_columnar_catalog(keyword) -> bool:
+    return not keyword.strip() and Config.COLUMNAR_ENGINE_ENABLED and CATALOG.ready and CATALOG.supported
+
+
+def search_catalog(genres: List[str], min_rating: float, max_rating: float, skip: int, limit: int,
+                   cursor: str = "", facets=()) -> Tuple[List[str], int, dict]:
+    """
+    /search without a keyword, against the columnar catalog
+    :return: (uids of the page, count, facets)
+    """
+    after = decode_cursor(cursor) if cursor else None
+    if after is not None and (not isinstance(after[0], (int, float)) or not isinstance(after[1], str)):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    uids, count, raw_facets = CATALOG.search(genres, min_rating, max_rating, skip=skip, limit=limit, after=after,
+                                             facets=facets)
+    return uids, count, format_facets(raw_facets)
+
+
+async def find_movies_by_uids(uids: List[str], projection: Optional[dict] = None) -> list:
+    """
+    Fetch movies by uid, keeping the order of the given uids
+    :param uids: list of movie uids
+    :param projection: only fetch these fields
+    :return: list of movie records (uids that are not found are skipped)
+    """
+    if not uids:
+        return []
+    movies = await find_records(Movie, [Movie.uid.in_(uids)], projection)
+    by_uid = {movie.uid: movie for movie in movies}
+    return [by_uid[uid] for uid in uids if uid in by_uid]
+
+
+async def batch_get_movies(uids: List[str], projection: Optional[dict] = None) -> dict:
+    """
+    Resolve many movies by uid with a single $in query
+    :param uids: list of movie uids
+    :param projection: only fetch these fields
+    :return: {"data": movies in the requested order, "missing": uids that are not found}
+    """
+    uids = list(dict.fromkeys(uid for uid in uids if uid))
+    if len(uids) > Config.BATCH_GET_MAX_IDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"At most {Config.BATCH_GET_MAX_IDS} ids per request")
+    movies = await find_movies_by_uids(uids, projection)
+    found = {movie.uid for movie in movies}
+    return {"data": movies, "missing": [uid for uid in uids if uid not in found]}
+
+
+async def similar_movies(uid: str, size: int) -> Optional[list]:
+    """
+    Read the similar movie list of a movie and the movies it lists, in one aggregate
+    :return: movies with their "similarity", most similar first, None when the movie has no list
+    """
+    pipeline = [{"$match": {"_id": uid}},
+                {"$project": {"uids": {"$slice": ["$uids", size]}, "scores": {"$slice": ["$scores", size]}}},
+                {"$lookup": {"from": Movie.__collection__, "localField": "uids", "foreignField": "uid",
+                             "as": "movies"}}]
+    docs = await DB_MOTOR_ENGINE[SIMILAR_MOVIES].aggregate(pipeline).to_list(length=1)
+    if not docs:
+        return None
+    by_uid = {movie["uid"]: movie for movie in docs[0]["movies"]}
+    record_cls = record_type(Movie)
+    return [dict(record_cls(by_uid[uid]).to_dict(), similarity=score)
+            for uid, score in zip(docs[0]["uids"], docs[0]["scores"]) if uid in by_uid]
+
+
+async def _movies_by_uid(uids: List[str]) -> dict:
+    return {movie.uid: movie for movie in await find_records(Movie, [Movie.uid.in_(uids)])}
+
+
+# Single movie lookups by uid made concurrently (eg: a client firing one GET /movies/{id} per movie of
+# a watchlist) are sent as one $in query
+MOVIE_LOADER = BatchLoader(_movies_by_uid)
+
+
+def encode_cursor(*key) -> str:
+    """
+    Encode the sort key of the last item of a page into an opaque cursor token
+    """
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int = 2) -> list:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        key = None
+    if not isinstance(key, list) or len(key) != length:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return key
+
+
+def keyset_query(sort_field, uid_field, cursor: str, descending: bool = False) -> QueryExpression:
+    """
+    Filter matching the documents that come after the cursor for the sort (sort_field, uid_field asc)
+    :param sort_field: model field the page is sorted on, eg: Movie.popularity
+    :param uid_field: unique tie-breaker field, eg: Movie.uid
+    :param cursor: "next_cursor" of the previous page
+    :param descending: whether sort_field is sorted in descending order
+    """
+    value, uid = decode_cursor(cursor)
+    after = (sort_field < value) if descending else (sort_field > value)
+    return or_(after, and_(sort_field == value, uid_field > uid))
+
+
+def next_cursor(objs: list, sort_attr: str, size: int) -> Optional[str]:
+    """
+    :return: cursor pointing after the last object, None when this is the last page
+    """
+    if len(objs) < size or not objs:
+        return None
+    last = objs[-1]
+    return encode_cursor(getattr(last, sort_attr), last.uid)
+
+
+def page_of_hits(hits: list, size: int, page: int, cursor: str) -> Tuple[List[str], Optional[str]]:
+    """
+    Slice a page out of ranked search index hits; the cursor holds the offset of the next page
+    :return: (uids of the page, next cursor)
+    """
+    offset = decode_cursor(cursor, length=1)[0] if cursor else (page-1)*size
+    if not isinstance(offset, int) or offset < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    uids = [uid for uid, _ in hits[offset:offset+size]]
+    return uids, encode_cursor(offset+size) if offset+size < len(hits) else None
+
+
+def model_written(model):
+    """
+    Drop everything derived from a model's collection after it is written to
+    """
+    COUNT_CACHE.invalidate(model)
+    RESPONSE_CACHE.invalidate(model)
+
+
+async def names_written(model, uids: List[str]):
+    """
+    model_written for directors and genres, which also keeps their /suggest entries in sync
+    :param uids: uids of the documents created, updated or deleted
+    """
+    model_written(model)
+    uids = [uid for uid in uids if uid]
+    if not uids or not Config.SUGGEST_ENABLED or not SUGGEST_INDEX.ready:
+        return
+    docs = await find_records(model, [model.uid.in_(uids)], NAME_PROJECTION)
+    SUGGEST_INDEX.add_names(SUGGEST_KINDS[model], docs)
+    for uid in set(uids) - {doc.uid for doc in docs}:
+        SUGGEST_INDEX.remove(SUGGEST_KINDS[model], uid)
+
+
+def written_uids(resp: dict) -> List[str]:
+    """
+    :return: uids of the items a bulk endpoint wrote
+    """
+    return [result["uid"] for result in resp["results"] if result["status"] in ("created", "updated", "deleted")]
+
+
+def index_facets(hits: list, facets, docs: Optional[dict] = None) -> dict:
+    """
+    Same facets as find_with_facets, computed from the search index for ranked hits
+    :param docs: indexed movies by uid, with their genre and imdb_score (those of the search index by default)
+    """
+    docs = MOVIE_INDEX.docs if docs is None else docs
+    raw = {}
+    if "genre" in facets:
+        counter = Counter(genre for uid, _ in hits for genre in docs[uid].genre)
+        raw["genre"] = [{"_id": genre, "count": count}
+                        for genre, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))]
+    if "imdb_score" in facets:
+        counter = Counter(math.floor(docs[uid].imdb_score) for uid, _ in hits)
+        raw["imdb_score"] = [{"_id": bucket, "count": count} for bucket, count in sorted(counter.items())]
+    return format_facets(raw)
+
+
+def movies_saved(movies: List[Movie]):
+    """
+    Keep the in-memory structures in sync after movies are added or updated
+    """
+    model_written(Movie)
+    _index_movies(movies)
+
+
+def _index_movies(movies: list):
+    if Config.SEARCH_INDEX_ENABLED:
+        MOVIE_INDEX.add_all(movies)
+    if Config.FUZZY_SEARCH_ENABLED:
+        FUZZY_INDEX.add_all(movies)
+    if catalog_enabled():
+        CATALOG.add_all(movies)
+    if Config.SUGGEST_ENABLED and SUGGEST_INDEX.ready:
+        SUGGEST_INDEX.add_movies(movies)
+
+
+async def movies_created(movies: List[Movie]):
+    """
+    movies_saved for new movies, which are also added to the rollups
+    """
+    movies_saved(movies)
+    await _update_rollups(added=movies)
+    await _update_similar(written=[movie.uid for movie in movies])
+
+
+async def movies_changed(previous: list, movies: List[Movie]):
+    """
+    movies_saved for updated movies
+    :param previous: the movies as they were before the update, with at least their director and genres
+    """
+    movies_saved(movies)
+    await _update_rollups(changed=list(previous) + list(movies))
+    await _update_similar(written=[movie.uid for movie in movies])
+
+
+async def movies_updated(uids: List[str], previous: list = ()):
+    """
+    Same as movies_changed when only the uids of the updated movies are known
+    """
+    model_written(Movie)
+    if uids:
+        movies = await find_records(Movie, [Movie.uid.in_(uids)], SEARCH_INDEX_PROJECTION)
+        _index_movies(movies)
+        await _update_rollups(changed=list(previous) + movies)
+        await _update_similar(written=uids)
+
+
+async def previous_movies(uids: List[str]) -> list:
+    """
+    Read the fields the rollups are keyed on before movies are updated or deleted in bulk
+    """
+    return await find_records(Movie, [Movie.uid.in_(uids)], ROLLUP_KEY_PROJECTION) if uids else []
+
+
+async def movie_deleted(movie: Movie):
+    """
+    Keep the in-memory structures and the rollups in sync after a movie is deleted
+    """
+    await movies_deleted([movie.uid], [movie])
+
+
+async def movies_deleted(uids: List[str], previous: list = ()):
+    """
+    :param previous: the deleted movies, with at least their director and genres
+    """
+    model_written(Movie)
+    for uid in uids:
+        if Config.SEARCH_INDEX_ENABLED:
+            MOVIE_INDEX.remove(uid)
+        if Config.FUZZY_SEARCH_ENABLED:
+            FUZZY_INDEX.remove(uid)
+        if catalog_enabled():
+            CATALOG.remove(uid)
+        if Config.SUGGEST_ENABLED and SUGGEST_INDEX.ready:
+            SUGGEST_INDEX.remove("movie", uid)
+    await _update_rollups(changed=previous)
+    await _update_similar(deleted=uids)
+
+
+async def _update_rollups(added: list = (), changed: list = ()):
+    """
+    The movies are already written: a rollup that cannot be updated is logged and left for a rebuild
+    """
+    try:
+        if added:
+            await add_to_director_stats(DB_MOTOR_ENGINE, added)
+            await add_to_genre_top(DB_MOTOR_ENGINE, added)
+        directors, genres = directors_of(changed), genres_of(changed)
+        if directors:
+            await rebuild_director_stats(DB_MOTOR_ENGINE, directors)
+        if genres:
+            await rebuild_genre_top(DB_MOTOR_ENGINE, genres)
+    except Exception:
+        logger.exception("Cannot update the movie rollups, run manage_rollups.py to rebuild them")
+
+
+async def _update_similar(written: List[str] = (), deleted: List[str] = ()):
+    """
+    Recompute the similar movie lists affected by a write, once the catalog is up to date
+    """
+    if not Config.SIMILAR_MOVIES_ENABLED or not CATALOG.ready or not (written or deleted):
+        return
+    try:
+        await refresh_similar(DB_MOTOR_ENGINE, CATALOG, written, deleted)
+    except Exception:
+        logger.exception("Cannot update the similar movies, run manage_similar.py to rebuild them")
@@ -1,5 +1,7 @@
+from datetime import datetime
 from typing import Optional
 
+from odmantic import Model
 from pydantic import BaseModel
 
 
@@ -10,3 +12,13 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: Optional[str] = None
+
+
+class RevokedToken(Model):
+    __collection__ = "revoked_token"
+
+    jti: Optional[str]              # a single token
+    sub: Optional[str]
+    cutoff: Optional[float]         # or every token of sub issued before this timestamp
+    expires_at: datetime            # once every token it covers has expired
+    revoked_at: datetime
@@ -0,0 +1,4 @@
+from .columnar import CATALOG, ColumnarCatalog
+from .fuzzy import FUZZY_INDEX, TrigramIndex
+from .index import MOVIE_INDEX, InvertedIndex, tokenize
+from .suggest import SUGGEST_INDEX, PrefixIndex
@@ -0,0 +1,234 @@
+"""
+Columnar in-memory snapshot of the movie catalog, evaluating the /search filters without a round trip
+
+Every movie has a slot in a set of NumPy columns: imdb_score, popularity, a genre bitmask (one bit per
+distinct genre string, at most MAX_GENRES) and an interned director code. A search is a few vectorized
+comparisons over the columns, and the page is picked with a partial sort (argpartition) of the
+matching popularities, so only the top skip + limit rows are ever fully sorted.
+
+Slots of deleted movies are reused, the columns grow by doubling. NumPy is optional: without it the
+engine is never ready and /search keeps using Mongo.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Width of the genre bitmask
+MAX_GENRES = 64
+
+
+def _get(obj, field):
+    if isinstance(obj, dict):
+        return obj.get(field)
+    return getattr(obj, field, None)
+
+
+class ColumnarCatalog:
+    """
+    See the module docstring. Results are ordered like the Mongo path: popularity desc, then uid.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.clear(capacity)
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def clear(self, capacity: int = 1024):
+        self.ready = False
+        # False once the catalog has more than MAX_GENRES genres, searches then go to Mongo
+        self.supported = True
+        self.size = 0
+        self.slots: Dict[str, int] = {}
+        self.free: List[int] = []
+        self.uids: List[Optional[str]] = []
+        self.genres: Dict[str, int] = {}
+        self.directors: Dict[str, int] = {}
+        self.director_names: List[str] = []
+        if np is None:
+            return
+        self.imdb_score = np.zeros(capacity, dtype=np.float64)
+        self.popularity = np.zeros(capacity, dtype=np.float64)
+        self.genre_bits = np.zeros(capacity, dtype=np.uint64)
+        self.director = np.full(capacity, -1, dtype=np.int32)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, uid):
+        return uid in self.slots
+
+    def _grow(self, needed: int):
+        capacity = len(self.alive)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ("imdb_score", "popularity", "genre_bits", "director", "alive"):
+            column = getattr(self, name)
+            grown = np.full(capacity, -1 if name == "director" else 0, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def _genre_mask(self, genres: Iterable[str]) -> int:
+        mask = 0
+        for genre in genres or ():
+            bit = self.genres.get(genre)
+            if bit is None:
+                if len(self.genres) >= MAX_GENRES:
+                    if self.supported:
+                        logger.warning("More than %d genres, /search falls back to Mongo", MAX_GENRES)
+                    self.supported = False
+                    continue
+                bit = self.genres[genre] = len(self.genres)
+            mask |= 1 << bit
+        return mask
+
+    def _director_code(self, director: Optional[str]) -> int:
+        if director is None:
+            return -1
+        code = self.directors.get(director)
+        if code is None:
+            code = self.directors[director] = len(self.director_names)
+            self.director_names.append(director)
+        return code
+
+    def add(self, movie):
+        self.add_all([movie])
+
+    def add_all(self, movies: Iterable):
+        """
+        Add (or update) movies, new ones are written to the columns with one slice assignment per column
+        :param movies: Movie instances, records or raw documents
+        """
+        if np is None:
+            return
+        rows = []
+        for movie in movies:
+            uid = _get(movie, "uid")
+            if uid is None:
+                continue
+            row = (_get(movie, "imdb_score") or 0.0, _get(movie, "popularity") or 0.0,
+                   self._genre_mask(_get(movie, "genre")), self._director_code(_get(movie, "director")))
+            slot = self.slots.get(uid)
+            if slot is None and self.free:
+                slot = self.slots[uid] = self.free.pop()
+                self.uids[slot] = uid
+            if slot is None:
+                rows.append((uid,) + row)
+            else:
+                self._set(slot, *row)
+        if not rows:
+            return
+
+        start, end = self.size, self.size + len(rows)
+        self._grow(end)
+        uids, imdb_scores, popularities, genre_bits, directors = zip(*rows)
+        self.imdb_score[start:end] = imdb_scores
+        self.popularity[start:end] = popularities
+        self.genre_bits[start:end] = np.array(genre_bits, dtype=np.uint64)
+        self.director[start:end] = directors
+        self.alive[start:end] = True
+        self.uids.extend(uids)
+        self.slots.update(zip(uids, range(start, end)))
+        self.size = end
+
+    def _set(self, slot: int, imdb_score: float, popularity: float, genre_bits: int, director: int):
+        self.imdb_score[slot] = imdb_score
+        self.popularity[slot] = popularity
+        self.genre_bits[slot] = genre_bits
+        self.director[slot] = director
+        self.alive[slot] = True
+
+    def remove(self, uid: str):
+        slot = self.slots.pop(uid, None)
+        if slot is None:
+            return
+        self.alive[slot] = False
+        self.uids[slot] = None
+        self.free.append(slot)
+
+    def mask(self, genres: Optional[List[str]] = None, min_rating: Optional[float] = None,
+             max_rating: Optional[float] = None, director: Optional[str] = None):
+        """
+        :return: boolean array over the slots of the movies matching every filter
+        """
+        mask = self.alive[:self.size].copy()
+        if min_rating is not None:
+            mask &= self.imdb_score[:self.size] >= min_rating
+        if max_rating is not None:
+            mask &= self.imdb_score[:self.size] <= max_rating
+        if genres:
+            wanted = sum(1 << self.genres[genre] for genre in set(genres) if genre in self.genres)
+            mask &= (self.genre_bits[:self.size] & np.uint64(wanted)) != 0
+        if director is not None:
+            mask &= self.director[:self.size] == self.directors.get(director, -2)
+        return mask
+
+    def top(self, mask, skip: int, limit: int, after: Optional[Tuple[float, str]] = None) -> List[str]:
+        """
+        Page of the masked movies sorted by (popularity desc, uid)
+        :param after: (popularity, uid) of the last movie of the previous page, for keyset pagination
+        :return: uids of the page
+        """
+        k = skip + limit
+        if k <= 0:
+            return []
+        popularity = self.popularity[:self.size]
+        if after is not None:
+            value, uid = after
+            candidates = np.flatnonzero(mask & (popularity < value))
+            ties = [slot for slot in np.flatnonzero(mask & (popularity == value)) if self.uids[slot] > uid]
+            if ties:
+                candidates = np.concatenate([candidates, np.array(ties, dtype=candidates.dtype)])
+        else:
+            candidates = np.flatnonzero(mask)
+        values = popularity[candidates]
+        if len(candidates) > k:
+            # Everything at least as popular as the k-th movie, ties included
+            threshold = -np.partition(-values, k - 1)[k - 1]
+            keep = values >= threshold
+            candidates, values = candidates[keep], values[keep]
+        ranked = sorted(zip((-values).tolist(), (self.uids[slot] for slot in candidates.tolist())))
+        return [uid for _, uid in ranked[skip:k]]
+
+    def facets(self, mask, facets) -> dict:
+        """
+        Same raw facets as query.facet_pipelines, for query.format_facets
+        """
+        raw = {}
+        if "genre" in facets:
+            bits = self.genre_bits[:self.size][mask]
+            counts: Dict[str, int] = {}
+            for genre, bit in self.genres.items():
+                count = int(np.count_nonzero(bits & np.uint64(1 << bit)))
+                if count:
+                    counts[genre.strip()] = counts.get(genre.strip(), 0) + count
+            raw["genre"] = [{"_id": genre, "count": count}
+                            for genre, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+        if "imdb_score" in facets:
+            buckets, counts = np.unique(np.floor(self.imdb_score[:self.size][mask]), return_counts=True)
+            raw["imdb_score"] = [{"_id": float(bucket), "count": int(count)}
+                                 for bucket, count in zip(buckets.tolist(), counts.tolist())]
+        return raw
+
+    def search(self, genres: Optional[List[str]] = None, min_rating: Optional[float] = None,
+               max_rating: Optional[float] = None, skip: int = 0, limit: int = 10,
+               after: Optional[Tuple[float, str]] = None, facets=()) -> Tuple[List[str], int, dict]:
+        """
+        Evaluate the /search filters
+        :return: (uids of the page, number of matching movies, raw facets)
+        """
+        mask = self.mask(genres, min_rating, max_rating)
+        return self.top(mask, skip, limit, after), int(np.count_nonzero(mask)), self.facets(mask, facets)
+
+
+CATALOG = ColumnarCatalog()
@@ -0,0 +1,304 @@
+"""
+Character trigram index over movie names and directors, backing the typo tolerant /search?fuzzy=true
+
+Names and directors are folded like the /suggest keys, and every distinct folded text is split into the trigrams
+of its words padded with two spaces in front and one behind ("oz" gives "  o", " oz" and "oz "). A posting list
+holds the ids of the texts having a trigram, in increasing order: texts get increasing ids, so a list only grows
+at its end, and a text is taken out of its lists by bisection.
+
+A text is a candidate when it shares at least MIN_OVERLAP of the query trigrams found in the index (a trigram no
+text has comes from a typo). With t query trigrams and n of them needed, a candidate is in at least one of the
+t - n + 1 shortest posting lists: only those are read, the overlap is then completed from the other lists, by set
+intersection or bisection, dropping the texts that cannot reach n anymore. When the shortest lists hold more than
+MAX_CANDIDATES ids the required overlap is raised, and a query whose rarest trigram is in more than MAX_CANDIDATES
+texts is not selective enough to be answered here (search returns None).
+
+The RERANK_SIZE candidates most similar to the query (shared trigrams over distinct trigrams) are ranked by edit
+distance, summed over the query words (each one against its closest word of the text), then by the difference in
+number of words and by popularity.
+"""
+import bisect
+import math
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .suggest import fold
+
+# Share of the query trigrams a candidate must have, ids read from the posting lists per query, candidates
+# ranked by edit distance
+MIN_OVERLAP = 0.5
+MAX_CANDIDATES = 20000
+RERANK_SIZE = 100
+# A posting list is intersected with the candidates as a set below this many ids per candidate, bisected above
+INTERSECT_RATIO = 16
+
+
+def _get(obj, field):
+    if isinstance(obj, dict):
+        return obj.get(field)
+    return getattr(obj, field, None)
+
+
+def _contains(postings: array, text_id: int) -> bool:
+    index = bisect.bisect_left(postings, text_id)
+    return index < len(postings) and postings[index] == text_id
+
+
+def trigrams(folded: str) -> Set[str]:
+    grams = set()
+    for word in folded.split():
+        padded = f"  {word} "
+        grams.update(padded[start:start + 3] for start in range(len(padded) - 2))
+    return grams
+
+
+def edit_distance(a: str, b: str, bound: int) -> int:
+    """
+    Levenshtein distance, or bound when it is at least bound
+    """
+    return Pattern(a).distance(b, bound)
+
+
+class Pattern:
+    """
+    Word the edit distance of other words is computed to, with the bit-parallel algorithm of Myers (one pass over
+    the other word, the columns of the dynamic programming matrix are bit vectors)
+    """
+    __slots__ = ("word", "masks", "last")
+
+    def __init__(self, word: str):
+        self.word = word
+        self.masks: Dict[str, int] = {}
+        for position, char in enumerate(word):
+            self.masks[char] = self.masks.get(char, 0) | 1 << position
+        self.last = 1 << (len(word) - 1) if word else 0
+
+    def distance(self, other: str, bound: int) -> int:
+        if self.word == other:
+            return 0
+        if abs(len(self.word) - len(other)) >= bound:
+            return bound
+        if not self.word or not other:
+            return min(len(self.word) + len(other), bound)
+        full = (self.last << 1) - 1
+        positive, negative, score = full, 0, len(self.word)
+        for char in other:
+            equal = self.masks.get(char, 0)
+            vertical = equal | negative
+            horizontal = (((equal & positive) + positive) ^ positive) | equal
+            positive_h = negative | ~(horizontal | positive) & full
+            negative_h = positive & horizontal
+            if positive_h & self.last:
+                score += 1
+            elif negative_h & self.last:
+                score -= 1
+            positive_h = (positive_h << 1 | 1) & full
+            negative_h = (negative_h << 1) & full
+            positive = negative_h | ~(vertical | positive_h) & full
+            negative = positive_h & vertical
+        return min(score, bound)
+
+
+def word_distance(query_words: List[Pattern], text: str) -> int:
+    """
+    :return: sum over the query words of their edit distance to the closest word of the text
+    """
+    words = text.split()
+    total = 0
+    for query_word in query_words:
+        best = len(query_word.word)
+        for word in words:
+            best = query_word.distance(word, best)
+            if not best:
+                break
+        total += best
+    return total
+
+
+class FuzzyMovie:
+    __slots__ = ("uid", "texts", "popularity", "imdb_score", "genre")
+
+    def __init__(self, uid, texts, popularity, imdb_score, genre):
+        self.uid = uid
+        self.texts = texts
+        self.popularity = popularity
+        self.imdb_score = imdb_score
+        self.genre = genre
+
+
+class TrigramIndex:
+    """
+    See the module docstring. Movies with the same name, or the same director, share the indexed text.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ready = False
+        self.postings: Dict[str, array] = {}
+        self.ids: Dict[str, int] = {}
+        self.texts: Dict[int, str] = {}
+        self.sizes: Dict[int, int] = {}
+        self.owners: Dict[int, Set[str]] = {}
+        self.docs: Dict[str, FuzzyMovie] = {}
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, uid):
+        return uid in self.docs
+
+    def _acquire(self, folded: str, uid: str) -> int:
+        text_id = self.ids.get(folded)
+        if text_id is None:
+            text_id, self.next_id = self.next_id, self.next_id + 1
+            self.ids[folded], self.texts[text_id], self.owners[text_id] = text_id, folded, set()
+            grams = trigrams(folded)
+            self.sizes[text_id] = len(grams)
+            for gram in grams:
+                postings = self.postings.get(gram)
+                if postings is None:
+                    postings = self.postings[gram] = array("i")
+                postings.append(text_id)
+        self.owners[text_id].add(uid)
+        return text_id
+
+    def _release(self, text_id: int, uid: str):
+        owners = self.owners[text_id]
+        owners.discard(uid)
+        if owners:
+            return
+        folded = self.texts.pop(text_id)
+        del self.ids[folded], self.owners[text_id], self.sizes[text_id]
+        for gram in trigrams(folded):
+            postings = self.postings[gram]
+            del postings[bisect.bisect_left(postings, text_id)]
+            if not postings:
+                del self.postings[gram]
+
+    def add(self, movie):
+        """
+        Index a movie (or re-index it if the uid is already known)
+        :param movie: Movie instance or raw document with uid, name, director, popularity, imdb_score and genre
+        """
+        uid = _get(movie, "uid")
+        if uid is None:
+            return
+        texts = tuple(dict.fromkeys(folded for folded in (fold(_get(movie, "name")), fold(_get(movie, "director")))
+                                    if folded))
+        previous = self.docs.get(uid)
+        # Acquire before releasing, a text the movie keeps keeps its id
+        self.docs[uid] = FuzzyMovie(uid=uid,
+                                    texts=tuple(self._acquire(folded, uid) for folded in texts),
+                                    popularity=_get(movie, "popularity") or 0.0,
+                                    imdb_score=_get(movie, "imdb_score") or 0.0,
+                                    genre=frozenset(g.strip() for g in (_get(movie, "genre") or [])))
+        if previous is not None:
+            for text_id in set(previous.texts) - set(self.docs[uid].texts):
+                self._release(text_id, uid)
+
+    def add_all(self, movies: Iterable):
+        for movie in movies:
+            self.add(movie)
+
+    def remove(self, uid: str):
+        doc = self.docs.pop(uid, None)
+        if doc is None:
+            return
+        for text_id in doc.texts:
+            self._release(text_id, uid)
+
+    def _matches(self, doc: FuzzyMovie, genres: Optional[Set[str]], min_rating: Optional[float],
+                 max_rating: Optional[float]) -> bool:
+        if genres is not None and not (doc.genre & genres):
+            return False
+        if min_rating is not None and doc.imdb_score < min_rating:
+            return False
+        return max_rating is None or doc.imdb_score <= max_rating
+
+    def _candidates(self, grams: Set[str]) -> Optional[Dict[int, int]]:
+        """
+        :return: {text id: number of query trigrams it has} for the texts sharing enough of them,
+            None when even the rarest query trigram is too common
+        """
+        # A trigram no text has is a typo, it does not count in the overlap
+        lists = sorted((self.postings[gram] for gram in grams if gram in self.postings), key=len)
+        if not lists:
+            return {}
+        if len(lists[0]) > MAX_CANDIDATES:
+            return None
+        needed = max(1, math.ceil(len(lists) * MIN_OVERLAP))
+        read = len(lists) - needed + 1
+        while read > 1 and sum(len(postings) for postings in lists[:read]) > MAX_CANDIDATES:
+            read -= 1
+        needed = len(lists) - read + 1
+
+        counts = Counter()
+        for postings in lists[:read]:
+            counts.update(postings)
+        remaining = len(lists) - read
+        for postings in lists[read:]:
+            # Drop the texts that cannot reach the needed overlap anymore, few are left after a list or two
+            if needed - remaining > 1:
+                counts = {text_id: count for text_id, count in counts.items() if count + remaining >= needed}
+            if not counts:
+                break
+            if len(postings) < INTERSECT_RATIO * len(counts):
+                found = counts.keys() & postings
+            else:
+                found = [text_id for text_id in counts if _contains(postings, text_id)]
+            for text_id in found:
+                counts[text_id] += 1
+            remaining -= 1
+        return {text_id: count for text_id, count in counts.items() if count >= needed}
+
+    def search(self, query: str, genres: Optional[List[str]] = None, min_rating: Optional[float] = None,
+               max_rating: Optional[float] = None) -> Optional[List[Tuple[str, int]]]:
+        """
+        Search the index, tolerating typos
+        :param query: free text
+        :param genres: keep only movies having at least one of these genres
+        :param min_rating: lower bound (inclusive) on imdb_score
+        :param max_rating: upper bound (inclusive) on imdb_score
+        :return: [(uid, edit distance)] ranked by edit distance, then popularity,
+            None when the query is too common to be answered from the index
+        """
+        folded = fold(query)
+        grams = trigrams(folded)
+        if not grams:
+            return []
+        candidates = self._candidates(grams)
+        if candidates is None:
+            return None
+        genres = set(genres) if genres else None
+
+        def similarity(text_id):
+            return candidates[text_id] / (len(grams) + self.sizes[text_id] - candidates[text_id]), -text_id
+
+        # Texts by similarity, until RERANK_SIZE of them have movies matching the filters
+        owners: Dict[int, List[FuzzyMovie]] = {}
+        for text_id in sorted(candidates, key=similarity, reverse=True):
+            docs = [doc for doc in map(self.docs.__getitem__, self.owners[text_id])
+                    if self._matches(doc, genres, min_rating, max_rating)]
+            if docs:
+                owners[text_id] = docs
+                if len(owners) >= RERANK_SIZE:
+                    break
+
+        query_words = [Pattern(word) for word in folded.split()]
+        best: Dict[str, Tuple[int, int, FuzzyMovie]] = {}
+        for text_id, docs in owners.items():
+            text = self.texts[text_id]
+            # Between texts as close to the query, the one without extra words wins
+            key = (word_distance(query_words, text), abs(text.count(" ") + 1 - len(query_words)))
+            for doc in docs:
+                if doc.uid not in best or key < best[doc.uid][:2]:
+                    best[doc.uid] = key + (doc,)
+        ranked = sorted(best.values(), key=lambda item: (item[0], item[1], -item[2].popularity, item[2].uid))
+        return [(doc.uid, distance) for distance, _, doc in ranked]
+
+
+FUZZY_INDEX = TrigramIndex()
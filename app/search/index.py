@@ -0,0 +1,186 @@
+import math
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Positions of the director tokens are shifted by this gap so that a phrase can never
+# match across the end of the name and the start of the director.
+FIELD_GAP = 1000
+
+
+def tokenize(text: str) -> List[str]:
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+class IndexedMovie:
+    __slots__ = ("uid", "length", "terms", "popularity", "imdb_score", "genre")
+
+    def __init__(self, uid, length, terms, popularity, imdb_score, genre):
+        self.uid = uid
+        self.length = length
+        self.terms = terms
+        self.popularity = popularity
+        self.imdb_score = imdb_score
+        self.genre = genre
+
+
+class InvertedIndex:
+    """
+    In-memory positional inverted index over movie names and directors.
+
+    Posting lists map a term to {uid: [positions]}, so a query only touches the
+    documents that contain its terms. Results are ranked with BM25 and ties are
+    broken by popularity.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, List[int]]] = defaultdict(dict)
+        self.docs: Dict[str, IndexedMovie] = {}
+        self.total_length = 0
+        self.ready = False
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __contains__(self, uid):
+        return uid in self.docs
+
+    @property
+    def avg_length(self) -> float:
+        return self.total_length / len(self.docs) if self.docs else 0.0
+
+    def clear(self):
+        self.postings.clear()
+        self.docs.clear()
+        self.total_length = 0
+        self.ready = False
+
+    def add(self, movie):
+        """
+        Index a movie (or re-index it if the uid is already known)
+        :param movie: Movie instance or raw document with uid, name and director
+        """
+        uid = _get(movie, "uid")
+        if uid is None:
+            return
+        if uid in self.docs:
+            self.remove(uid)
+
+        positions: Dict[str, List[int]] = defaultdict(list)
+        name_tokens = tokenize(_get(movie, "name"))
+        for pos, term in enumerate(name_tokens):
+            positions[term].append(pos)
+        director_tokens = tokenize(_get(movie, "director"))
+        for pos, term in enumerate(director_tokens, start=len(name_tokens) + FIELD_GAP):
+            positions[term].append(pos)
+
+        for term, term_positions in positions.items():
+            self.postings[term][uid] = term_positions
+
+        length = len(name_tokens) + len(director_tokens)
+        self.docs[uid] = IndexedMovie(uid=uid,
+                                      length=length,
+                                      terms=tuple(positions),
+                                      popularity=_get(movie, "popularity") or 0.0,
+                                      imdb_score=_get(movie, "imdb_score") or 0.0,
+                                      genre=frozenset(g.strip() for g in (_get(movie, "genre") or [])))
+        self.total_length += length
+
+    def add_all(self, movies: Iterable):
+        for movie in movies:
+            self.add(movie)
+
+    def remove(self, uid: str):
+        doc = self.docs.pop(uid, None)
+        if doc is None:
+            return
+        for term in doc.terms:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(uid, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= doc.length
+
+    def _candidates(self, terms: List[str], phrase: bool) -> Dict[str, Dict[str, List[int]]]:
+        """
+        :return: {uid: {term: positions}} for every document matching the query
+        """
+        lists = [(term, self.postings.get(term, {})) for term in dict.fromkeys(terms)]
+        matches: Dict[str, Dict[str, List[int]]] = defaultdict(dict)
+        if phrase:
+            lists.sort(key=lambda item: len(item[1]))
+            if not lists or not lists[0][1]:
+                return {}
+            for uid in lists[0][1]:
+                if all(uid in postings for _, postings in lists[1:]) and self._has_phrase(uid, terms):
+                    for term, postings in lists:
+                        matches[uid][term] = postings[uid]
+        else:
+            for term, postings in lists:
+                for uid, term_positions in postings.items():
+                    matches[uid][term] = term_positions
+        return matches
+
+    def _has_phrase(self, uid: str, terms: List[str]) -> bool:
+        position_sets = [set(self.postings[term][uid]) for term in terms]
+        return any(all(start + offset in position_sets[offset] for offset in range(1, len(terms)))
+                   for start in position_sets[0])
+
+    def _bm25(self, doc: IndexedMovie, term_positions: Dict[str, List[int]]) -> float:
+        n_docs = len(self.docs)
+        avg_length = self.avg_length or 1.0
+        score = 0.0
+        for term, positions in term_positions.items():
+            df = len(self.postings[term])
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            tf = len(positions)
+            norm = self.k1 * (1 - self.b + self.b * doc.length / avg_length)
+            score += idf * tf * (self.k1 + 1) / (tf + norm)
+        return score
+
+    def search(self, query: str, phrase: bool = False, genres: Optional[List[str]] = None,
+               min_rating: Optional[float] = None, max_rating: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Search the index
+        :param query: free text, tokenized the same way as the indexed fields
+        :param phrase: require the query terms to appear next to each other, in order
+        :param genres: keep only movies having at least one of these genres
+        :param min_rating: lower bound (inclusive) on imdb_score
+        :param max_rating: upper bound (inclusive) on imdb_score
+        :return: [(uid, score)] ranked by BM25 score, then popularity
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        genres = set(genres) if genres else None
+
+        results = []
+        for uid, term_positions in self._candidates(terms, phrase).items():
+            doc = self.docs[uid]
+            if genres is not None and not (doc.genre & genres):
+                continue
+            if min_rating is not None and doc.imdb_score < min_rating:
+                continue
+            if max_rating is not None and doc.imdb_score > max_rating:
+                continue
+            results.append((uid, self._bm25(doc, term_positions), doc.popularity))
+
+        results.sort(key=lambda r: (-r[1], -r[2], r[0]))
+        return [(uid, score) for uid, score, _ in results]
+
+
+def _get(obj, field):
+    if isinstance(obj, dict):
+        return obj.get(field)
+    return getattr(obj, field, None)
+
+
+MOVIE_INDEX = InvertedIndex()
@@ -0,0 +1,294 @@
+"""
+"Similar movies": the top SIMILAR_MOVIES_SIZE neighbours of every movie, precomputed from the columnar catalog
+
+Similarity of two movies is a weighted sum, in [0, 1], of:
+    genre       Jaccard index of their genre bitmasks
+    director    1 when they share the director
+    score       1 - |imdb_score difference| / 10
+    popularity  1 / (1 + |log1p(popularity) difference|)
+
+The batch job never compares every pair. Neighbours are taken from sliding windows: for every genre,
+its movies are sorted by imdb_score and by popularity, and each movie is compared with the
+SIMILAR_MOVIES_WINDOW movies on either side. Each director's movies are also compared with one another. A running top-k per movie is
+merged window offset by window offset, so memory stays at O(movies * k).
+
+After a write, only the affected rows are recomputed, exactly, against every movie that shares a genre
+or the director. Those rows are the written movies, the rows listing them and their new neighbours.
+
+Lists are stored in the similar_movies collection as {"_id": uid, "uids": [...], "scores": [...]}.
+
+CLI:
+    python manage_similar.py            # recompute every list
+"""
+import argparse
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo import DeleteOne, ReplaceOne
+
+from app.config import Config
+from app.search.columnar import ColumnarCatalog, np
+
+logger = logging.getLogger(__name__)
+
+SIMILAR_MOVIES = "similar_movies"
+
+WEIGHTS = {"genre": 0.4, "director": 0.25, "score": 0.2, "popularity": 0.15}
+
+# Lists written per bulk_write
+WRITE_BATCH_SIZE = 1000
+
+
+def _popcount(bits):
+    """
+    Number of bits set in each value of a uint64 array
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits)
+    bits = bits - ((bits >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    bits = (bits & np.uint64(0x3333333333333333)) + ((bits >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    bits = (bits + (bits >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (bits * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def features(catalog: ColumnarCatalog) -> Dict:
+    """
+    Per slot inputs of the similarity, computed once per batch job or refresh. Every column is a copy, so a
+    refresh reads them off the event loop while handlers keep writing to the catalog
+    """
+    size = catalog.size
+    # float32 halves the memory traffic, plenty for a ranking
+    return {"genre_bits": catalog.genre_bits[:size].copy(),
+            "genre_count": _popcount(catalog.genre_bits[:size]).astype(np.float32),
+            "director": catalog.director[:size].copy(),
+            "imdb_score": catalog.imdb_score[:size].astype(np.float32),
+            "log_popularity": np.log1p(np.maximum(catalog.popularity[:size], 0.0)).astype(np.float32),
+            "alive": catalog.alive[:size].copy(),
+            "uids": catalog.uids[:size]}
+
+
+def _shared_genres(genre_bits, rows, others):
+    if np.ndim(rows) == 0:
+        # One row against many: test its few bits instead of counting the bits of every intersection
+        shared = np.zeros(len(genre_bits[others]), dtype=np.float32)
+        row_bits = int(genre_bits[rows])
+        for bit in range(row_bits.bit_length()):
+            if row_bits >> bit & 1:
+                shared += (genre_bits[others] >> np.uint64(bit)) & np.uint64(1)
+        return shared
+    return _popcount(genre_bits[rows] & genre_bits[others]).astype(np.float32)
+
+
+def similarity(columns: Dict, rows, others):
+    """
+    Similarity of rows[i] and others[i]
+    :param columns: see features()
+    :param rows: array of slots, or a single slot compared with every one of others
+    :param others: array of slots, or slice(None) for every slot
+    """
+    shared = _shared_genres(columns["genre_bits"], rows, others)
+    union = columns["genre_count"][rows] + columns["genre_count"][others] - shared
+    genre = shared / np.maximum(union, np.float32(1.0))
+    director = (columns["director"][rows] == columns["director"][others]) & (columns["director"][rows] >= 0)
+    score = np.maximum(np.float32(1.0) - np.abs(columns["imdb_score"][rows] - columns["imdb_score"][others]) /
+                       np.float32(10.0), np.float32(0.0))
+    popularity = np.float32(1.0) / (np.float32(1.0) +
+                                    np.abs(columns["log_popularity"][rows] - columns["log_popularity"][others]))
+    return (np.float32(WEIGHTS["genre"]) * genre + np.float32(WEIGHTS["director"]) * director +
+            np.float32(WEIGHTS["score"]) * score + np.float32(WEIGHTS["popularity"]) * popularity)
+
+
+class _TopK:
+    """
+    Running top-k neighbours of every slot
+    """
+
+    def __init__(self, size: int, k: int):
+        self.slots = np.full((size, k), -1, dtype=np.int64)
+        self.scores = np.full((size, k), -np.inf)
+
+    def merge(self, columns: Dict, rows, others):
+        """
+        Offer others[i] as a neighbour of rows[i], rows must not repeat a slot
+        """
+        if not len(rows):
+            return
+        scores = similarity(columns, rows, others)
+        known = (self.slots[rows] == others[:, None]).any(axis=1)
+        worst = self.scores[rows].argmin(axis=1)
+        better = (scores > self.scores[rows, worst]) & ~known
+        rows, worst = rows[better], worst[better]
+        self.slots[rows, worst] = others[better]
+        self.scores[rows, worst] = scores[better]
+
+    def merge_pairs(self, columns: Dict, a, b):
+        self.merge(columns, a, b)
+        self.merge(columns, b, a)
+
+
+def batch_neighbours(catalog: ColumnarCatalog, k: int, window: int) -> Tuple:
+    """
+    Windowed top-k neighbours of every movie of the catalog, see the module docstring
+    :return: (slots, scores), two (catalog.size, k) arrays sorted by decreasing score, -1 / -inf padded
+    """
+    size = catalog.size
+    alive = catalog.alive[:size]
+    top, columns = _TopK(size, k), features(catalog)
+    for bit in catalog.genres.values():
+        members = np.flatnonzero(alive & ((catalog.genre_bits[:size] & np.uint64(1 << bit)) != 0))
+        for column in (catalog.imdb_score, catalog.popularity):
+            order = members[np.argsort(column[members], kind="stable")]
+            for offset in range(1, min(window, len(order) - 1) + 1):
+                top.merge_pairs(columns, order[:-offset], order[offset:])
+
+    slots = np.flatnonzero(alive & (catalog.director[:size] >= 0))
+    order = slots[np.lexsort((-catalog.popularity[slots], catalog.director[slots]))]
+    for offset in range(1, min(window, len(order) - 1) + 1):
+        a, b = order[:-offset], order[offset:]
+        same = catalog.director[a] == catalog.director[b]
+        top.merge_pairs(columns, a[same], b[same])
+
+    ranking = np.argsort(-top.scores, axis=1, kind="stable")
+    return np.take_along_axis(top.slots, ranking, axis=1), np.take_along_axis(top.scores, ranking, axis=1)
+
+
+def row_neighbours(columns: Dict, slot: int, k: int) -> Tuple:
+    """
+    Exact top-k neighbours of one movie, among the movies sharing a genre or the director
+    :param columns: see features()
+    :return: (slots, scores) sorted by decreasing score
+    """
+    genre_bits, director = columns["genre_bits"], columns["director"]
+    # Scored against every slot with the row's values broadcast, cheaper than gathering the candidates
+    scores = similarity(columns, slot, slice(None))
+    related = (genre_bits & genre_bits[slot]) != 0
+    if director[slot] >= 0:
+        related |= director == director[slot]
+    related &= columns["alive"]
+    related[slot] = False
+    scores[~related] = -np.inf
+    k = min(k, int(np.count_nonzero(related)))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    best = np.argpartition(-scores, k - 1)[:k]
+    ranking = np.argsort(-scores[best], kind="stable")
+    return best[ranking], scores[best][ranking]
+
+
+def similar_document(uids: List[Optional[str]], slot: int, slots, scores) -> dict:
+    """
+    :param uids: uid of every slot, catalog.uids or the one of features()
+    """
+    found = slots >= 0
+    return {"_id": uids[slot],
+            "uids": [uids[neighbour] for neighbour in slots[found].tolist()],
+            "scores": [round(score, 4) for score in scores[found].tolist()]}
+
+
+async def rebuild_similar(database, catalog: ColumnarCatalog, k: Optional[int] = None,
+                          window: Optional[int] = None) -> int:
+    """
+    Recompute every list into a new collection, swapped with the current one once complete
+    :return: number of lists written
+    """
+    from app.db.indexes import INDEXES
+
+    k = k or Config.SIMILAR_MOVIES_SIZE
+    slots, scores = batch_neighbours(catalog, k, window or Config.SIMILAR_MOVIES_WINDOW)
+    staging = database[f"{SIMILAR_MOVIES}_staging"]
+    await staging.drop()
+    await staging.create_indexes(INDEXES[SIMILAR_MOVIES])
+    live = np.flatnonzero(catalog.alive[:catalog.size]).tolist()
+    for start in range(0, len(live), WRITE_BATCH_SIZE):
+        await staging.insert_many([similar_document(catalog.uids, slot, slots[slot], scores[slot])
+                                   for slot in live[start:start + WRITE_BATCH_SIZE]], ordered=False)
+    if live:
+        await staging.rename(SIMILAR_MOVIES, dropTarget=True)
+    else:
+        await database[SIMILAR_MOVIES].delete_many({})
+    return len(live)
+
+
+def _recompute(columns: Dict, queue: deque, written: Set[str]) -> Dict[str, dict]:
+    """
+    Recompute the lists of the queued uids, and of the new neighbours of the written ones, up to
+    SIMILAR_MOVIES_REFRESH_LIMIT lists
+    :param columns: see features(), a snapshot of the catalog
+    """
+    computed: Dict[str, dict] = {}
+    uids = columns["uids"]
+    slots = {uid: slot for slot, uid in enumerate(uids) if uid is not None}
+    while queue and len(computed) < Config.SIMILAR_MOVIES_REFRESH_LIMIT:
+        uid = queue.popleft()
+        slot = slots.get(uid)
+        if uid in computed or slot is None:
+            continue
+        computed[uid] = similar_document(uids, slot, *row_neighbours(columns, slot, Config.SIMILAR_MOVIES_SIZE))
+        if uid in written:
+            # A written movie may now belong in the lists of its neighbours
+            queue.extend(computed[uid]["uids"])
+    if queue:
+        logger.info("%d similar movie lists left for the next rebuild", len(queue))
+    return computed
+
+
+async def refresh_similar(database, catalog: ColumnarCatalog, written: Iterable[str] = (),
+                          deleted: Iterable[str] = ()) -> int:
+    """
+    Recompute the lists affected by writes, the catalog being already up to date
+    :param written: uids of the movies added or updated
+    :param deleted: uids of the movies deleted
+    :return: number of lists written
+    """
+    if not catalog.supported:
+        # The genre bits are incomplete past MAX_GENRES genres
+        logger.info("Similar movie lists are not refreshed, the catalog has too many genres")
+        return 0
+    written, deleted = list(written), list(deleted)
+    collection = database[SIMILAR_MOVIES]
+    queue = deque(written)
+    listing = collection.find({"uids": {"$in": written + deleted}}, {"_id": True})
+    async for doc in listing.limit(Config.SIMILAR_MOVIES_REFRESH_LIMIT):
+        queue.append(doc["_id"])
+
+    # Off the event loop, a row costs a few vectorized passes over the catalog. The columns are copied here,
+    # the catalog itself is only ever written on the loop
+    columns = features(catalog)
+    computed = await asyncio.get_event_loop().run_in_executor(None, _recompute, columns, queue, set(written))
+
+    requests: List = [ReplaceOne({"_id": uid}, doc, upsert=True) for uid, doc in computed.items()]
+    requests += [DeleteOne({"_id": uid}) for uid in deleted]
+    if requests:
+        await collection.bulk_write(requests, ordered=False)
+    return len(computed)
+
+
+async def main(argv=None):
+    from app.db import DB_MOTOR_ENGINE
+    from app.models.movie import Movie
+
+    parser = argparse.ArgumentParser(description="Recompute the similar movies of every movie")
+    parser.add_argument("--size", type=int, default=Config.SIMILAR_MOVIES_SIZE, help="neighbours per movie")
+    parser.add_argument("--window", type=int, default=Config.SIMILAR_MOVIES_WINDOW,
+                        help="movies compared on either side, per genre and sort order")
+    args = parser.parse_args(argv)
+    if np is None:
+        print("numpy is not installed")
+        return 1
+
+    catalog, batch = ColumnarCatalog(), []
+    projection = {"_id": 0, "uid": 1, "director": 1, "popularity": 1, "imdb_score": 1, "genre": 1}
+    async for doc in DB_MOTOR_ENGINE[Movie.__collection__].find({}, projection):
+        batch.append(doc)
+        if len(batch) >= WRITE_BATCH_SIZE * 10:
+            catalog.add_all(batch)
+            batch = []
+    catalog.add_all(batch)
+    if not catalog.supported:
+        print("too many genres for the columnar catalog")
+        return 1
+    written = await rebuild_similar(DB_MOTOR_ENGINE, catalog, args.size, args.window)
+    print(f"{SIMILAR_MOVIES}: {written} lists")
+    return 0
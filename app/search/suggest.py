@@ -0,0 +1,404 @@
+"""
+Prefix index over movie, director and genre names, backing the /suggest typeahead
+
+Names are folded (lowercased, accents stripped, punctuation collapsed to single spaces) and indexed under the
+folded text starting at each of their first MAX_WORDS words, so that "wars" suggests "Star Wars". The keys are
+kept in a sorted array cut into blocks of at most 2 * BLOCK_SIZE keys: the keys starting with a prefix are a
+contiguous range found by bisection, and a write only shifts the keys of one block.
+
+Suggestions are ranked by popularity: the popularity of a movie, the highest popularity among the movies of a
+director or a genre. A short prefix matches a large range, so the best CACHE_SIZE entries of every prefix matching
+more than SCAN_LIMIT keys are computed when the index is built (and the first time they are asked for, for the
+prefixes that grew past it since). Writes keep these lists up to date, smaller ranges are ranked on the fly.
+
+The popularity of a director or a genre only grows between two builds: updating or deleting one of its movies
+does not lower it.
+"""
+import bisect
+import heapq
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+KINDS = ("movie", "director", "genre")
+
+# Words of a name a suggestion can start at, and length of the keys (longer queries are checked on the name)
+MAX_WORDS = 4
+MAX_KEY_LENGTH = 32
+BLOCK_SIZE = 1024
+# Max number of suggestions per query, entries kept per cached prefix (the slack absorbs deletes)
+TOP_SIZE = 20
+CACHE_SIZE = 2 * TOP_SIZE
+SCAN_LIMIT = 128
+
+# Sorts after every character of a key
+_END = "\U0010ffff"
+
+
+def _get(obj, field):
+    if isinstance(obj, dict):
+        return obj.get(field)
+    return getattr(obj, field, None)
+
+
+def fold(text: Optional[str]) -> str:
+    """
+    :return: lowercased words of the text without accents, separated by single spaces
+    """
+    if not text:
+        return ""
+    if not text.isascii():
+        text = "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+    return " ".join(TOKEN_RE.findall(text.lower()))
+
+
+def keys_of(name: Optional[str]) -> List[str]:
+    """
+    :return: keys a name is indexed under, one per word it can be suggested from
+    """
+    folded, keys, start = fold(name), [], 0
+    for _ in range(MAX_WORDS):
+        if start >= len(folded):
+            break
+        keys.append(folded[start:start + MAX_KEY_LENGTH])
+        start = folded.find(" ", start) + 1
+        if not start:
+            break
+    return list(dict.fromkeys(keys))
+
+
+class Suggestion:
+    __slots__ = ("kind", "uid", "name", "popularity", "rank")
+
+    def __init__(self, kind, uid, name, popularity):
+        self.kind = kind
+        self.uid = uid
+        self.name = name
+        self.set_popularity(popularity)
+
+    def set_popularity(self, popularity: float):
+        self.popularity = popularity
+        self.rank = (-popularity, self.name, self.kind, self.uid)
+
+    def to_dict(self) -> dict:
+        return {"kind": self.kind, "uid": self.uid, "name": self.name, "popularity": self.popularity}
+
+
+class SortedKeys:
+    """
+    (key, ref) pairs in key order, stored in blocks with the last key of every block in maxes
+    """
+
+    def __init__(self, pairs: List[Tuple[str, int]] = ()):
+        """
+        :param pairs: (key, ref) pairs, sorted
+        """
+        self.keys = [[key for key, _ in pairs[start:start + BLOCK_SIZE]] for start in range(0, len(pairs), BLOCK_SIZE)]
+        self.refs = [[ref for _, ref in pairs[start:start + BLOCK_SIZE]] for start in range(0, len(pairs), BLOCK_SIZE)]
+        self.maxes = [keys[-1] for keys in self.keys]
+        self.length = len(pairs)
+
+    def __len__(self):
+        return self.length
+
+    def insert(self, key: str, ref: int):
+        self.length += 1
+        if not self.maxes:
+            self.keys, self.refs, self.maxes = [[key]], [[ref]], [key]
+            return
+        block = min(bisect.bisect_left(self.maxes, key), len(self.maxes) - 1)
+        keys, refs = self.keys[block], self.refs[block]
+        position = bisect.bisect_right(keys, key)
+        keys.insert(position, key)
+        refs.insert(position, ref)
+        self.maxes[block] = keys[-1]
+        if len(keys) > 2 * BLOCK_SIZE:
+            self.keys.insert(block + 1, keys[BLOCK_SIZE:])
+            self.refs.insert(block + 1, refs[BLOCK_SIZE:])
+            del keys[BLOCK_SIZE:], refs[BLOCK_SIZE:]
+            self.maxes[block:block + 1] = [keys[-1], self.keys[block + 1][-1]]
+
+    def remove(self, key: str, ref: int) -> bool:
+        block = bisect.bisect_left(self.maxes, key)
+        while block < len(self.maxes):
+            keys, refs = self.keys[block], self.refs[block]
+            position = bisect.bisect_left(keys, key)
+            while position < len(keys) and keys[position] == key:
+                if refs[position] == ref:
+                    del keys[position], refs[position]
+                    self.length -= 1
+                    if keys:
+                        self.maxes[block] = keys[-1]
+                    else:
+                        del self.keys[block], self.refs[block], self.maxes[block]
+                    return True
+                position += 1
+            if position < len(keys):
+                return False
+            block += 1
+        return False
+
+    def refs_with_prefix(self, prefix: str) -> Iterator[int]:
+        """
+        Yield the refs of the keys starting with prefix, in key order
+        """
+        block = bisect.bisect_left(self.maxes, prefix)
+        while block < len(self.maxes):
+            keys = self.keys[block]
+            start = bisect.bisect_left(keys, prefix)
+            end = bisect.bisect_left(keys, prefix + _END, start)
+            yield from self.refs[block][start:end]
+            if end < len(keys):
+                return
+            block += 1
+
+
+class CachedTop:
+    """
+    Best entries of a prefix in rank order, all of them when complete
+    """
+    __slots__ = ("refs", "complete")
+
+    def __init__(self, refs: List[int], complete: bool):
+        self.refs = refs
+        self.complete = complete
+
+
+class PrefixIndex:
+    """
+    See the module docstring. Entries are identified by (kind, uid), directors and genres are also
+    looked up by name, as that is how movies refer to them.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ready = False
+        self.keys = SortedKeys()
+        self.entries: Dict[int, Suggestion] = {}
+        self.refs: Dict[Tuple[str, str], int] = {}
+        self.named: Dict[Tuple[str, str], List[int]] = {}
+        # Highest popularity of the movies of every director and genre name
+        self.popularity: Dict[Tuple[str, str], float] = {}
+        self.top: Dict[str, CachedTop] = {}
+        self.pending: Dict[int, List[str]] = {}
+        self.next_ref = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, item):
+        return item in self.refs
+
+    def _rank(self, ref: int) -> tuple:
+        return self.entries[ref].rank
+
+    def _new_entry(self, kind: str, uid: str, name: str, popularity: float) -> int:
+        ref, self.next_ref = self.next_ref, self.next_ref + 1
+        self.entries[ref] = Suggestion(kind, uid, name, popularity)
+        self.refs[(kind, uid)] = ref
+        if kind != "movie":
+            self.named.setdefault((kind, name), []).append(ref)
+        return ref
+
+    def _raise_popularity(self, movie):
+        popularity = _get(movie, "popularity") or 0.0
+        names = [("genre", genre.strip()) for genre in _get(movie, "genre") or ()]
+        if _get(movie, "director") is not None:
+            names.append(("director", _get(movie, "director")))
+        for key in names:
+            if popularity <= self.popularity.get(key, 0.0):
+                continue
+            self.popularity[key] = popularity
+            for ref in self.named.get(key, ()):
+                if self.ready:
+                    self._set_popularity(ref, popularity)
+                else:
+                    self.entries[ref].set_popularity(popularity)
+
+    # Bulk load: load() the documents, then finish() sorts the keys and fills the cached prefixes
+
+    def load(self, kind: str, docs: Iterable):
+        """
+        :param kind: one of KINDS
+        :param docs: documents or records with uid and name (and popularity, director and genre for movies)
+        """
+        for doc in docs:
+            uid, name = _get(doc, "uid"), _get(doc, "name")
+            if uid is None or (kind, uid) in self.refs:
+                continue
+            if kind == "movie":
+                self._raise_popularity(doc)
+                popularity = _get(doc, "popularity") or 0.0
+            else:
+                name = (name or "").strip()
+                popularity = self.popularity.get((kind, name), 0.0)
+            self.pending[self._new_entry(kind, uid, name, popularity)] = keys_of(name)
+
+    def finish(self):
+        pairs = sorted((key, ref) for ref, keys in self.pending.items() for key in keys)
+        self.keys = SortedKeys(pairs)
+        keys, refs = [key for key, _ in pairs], [ref for _, ref in pairs]
+        del pairs
+        # A prefix matching more than SCAN_LIMIT keys is a prefix of two keys SCAN_LIMIT apart, sampling every
+        # SCAN_LIMIT // 2 keys finds every prefix matching more than 1.5 * SCAN_LIMIT of them
+        heavy = set()
+        for start in range(0, len(keys) - SCAN_LIMIT, SCAN_LIMIT // 2):
+            common = os.path.commonprefix([keys[start], keys[start + SCAN_LIMIT]])
+            heavy.update(common[:length] for length in range(1, len(common) + 1))
+        # Heavy prefixes are filled from the longest: the top of a prefix merges the tops of its heavy children
+        # with the keys of its range outside of them, so that every key is only read once
+        ranked = sorted(self.pending, key=self._rank)
+        position = dict(zip(ranked, range(len(ranked))))
+        spans, children = {}, defaultdict(list)
+        for prefix in heavy:
+            start = bisect.bisect_left(keys, prefix)
+            spans[prefix] = (start, bisect.bisect_left(keys, prefix + _END, start))
+            if len(prefix) > 1:
+                children[prefix[:-1]].append(prefix)
+        tops = {}
+        for prefix in sorted(heavy, key=len, reverse=True):
+            start, end = spans[prefix]
+            positions, complete = set(), True
+            for child in sorted(children.get(prefix, ())):
+                child_start, child_end = spans[child]
+                positions.update(map(position.__getitem__, refs[start:child_start]))
+                positions.update(tops[child].refs)
+                complete = complete and tops[child].complete
+                start = child_end
+            positions.update(map(position.__getitem__, refs[start:end]))
+            tops[prefix] = CachedTop(sorted(positions)[:CACHE_SIZE], complete and len(positions) <= CACHE_SIZE)
+        for prefix, top in tops.items():
+            self.top[prefix] = CachedTop([ranked[index] for index in top.refs], top.complete)
+        self.pending = {}
+        self.ready = True
+
+    # Writes
+
+    def add_movies(self, movies: Iterable):
+        """
+        Add (or update) movies, and raise the popularity of their directors and genres
+        """
+        for movie in movies:
+            if _get(movie, "uid") is None:
+                continue
+            self._raise_popularity(movie)
+            self._put("movie", _get(movie, "uid"), _get(movie, "name") or "", _get(movie, "popularity") or 0.0)
+
+    def add_names(self, kind: str, docs: Iterable):
+        """
+        Add (or rename) directors or genres
+        """
+        for doc in docs:
+            if _get(doc, "uid") is None:
+                continue
+            name = (_get(doc, "name") or "").strip()
+            self._put(kind, _get(doc, "uid"), name, self.popularity.get((kind, name), 0.0))
+
+    def remove(self, kind: str, uid: str):
+        ref = self.refs.pop((kind, uid), None)
+        if ref is None:
+            return
+        keys = keys_of(self.entries[ref].name)
+        self._forget(ref, keys)
+        entry = self.entries.pop(ref)
+        if kind != "movie":
+            named = self.named[(kind, entry.name)]
+            named.remove(ref)
+            if not named:
+                del self.named[(kind, entry.name)]
+        for key in keys:
+            self.keys.remove(key, ref)
+
+    def _put(self, kind: str, uid: str, name: str, popularity: float):
+        ref = self.refs.get((kind, uid))
+        if ref is not None and self.entries[ref].name == name:
+            if self.entries[ref].popularity != popularity:
+                self._set_popularity(ref, popularity)
+            return
+        self.remove(kind, uid)
+        ref = self._new_entry(kind, uid, name, popularity)
+        keys = keys_of(name)
+        for key in keys:
+            self.keys.insert(key, ref)
+        self._offer(ref, keys)
+
+    def _set_popularity(self, ref: int, popularity: float):
+        keys = keys_of(self.entries[ref].name)
+        self._forget(ref, keys)
+        self.entries[ref].set_popularity(popularity)
+        self._offer(ref, keys)
+
+    def _cached(self, keys: List[str]) -> List[CachedTop]:
+        prefixes = {key[:length] for key in keys for length in range(1, len(key) + 1)}
+        return [self.top[prefix] for prefix in prefixes if prefix in self.top]
+
+    def _offer(self, ref: int, keys: List[str]):
+        """
+        Insert an entry in the cached prefixes it belongs to
+        """
+        rank = self._rank(ref)
+        for top in self._cached(keys):
+            # An incomplete list is the exact top of its prefix, it can only take entries ranked above its last one
+            if not top.complete and (not top.refs or rank > self._rank(top.refs[-1])):
+                continue
+            ranks = [self._rank(other) for other in top.refs]
+            top.refs.insert(bisect.bisect_left(ranks, rank), ref)
+            if len(top.refs) > CACHE_SIZE:
+                top.refs.pop()
+                top.complete = False
+
+    def _forget(self, ref: int, keys: List[str]):
+        """
+        Take an entry out of the cached prefixes, a list left with too few entries is dropped
+        """
+        for prefix in {key[:length] for key in keys for length in range(1, len(key) + 1)}:
+            top = self.top.get(prefix)
+            if top is None or ref not in top.refs:
+                continue
+            top.refs.remove(ref)
+            if not top.complete and len(top.refs) < TOP_SIZE:
+                del self.top[prefix]
+
+    # Reads
+
+    def _fill(self, prefix: str) -> CachedTop:
+        refs = set(self.keys.refs_with_prefix(prefix))
+        top = self.top[prefix] = CachedTop(heapq.nsmallest(CACHE_SIZE, refs, key=self._rank),
+                                           len(refs) <= CACHE_SIZE)
+        return top
+
+    def suggest(self, query: str, size: int = 10) -> List[dict]:
+        """
+        :param query: what was typed so far, the last word can be incomplete
+        :param size: number of suggestions, at most TOP_SIZE
+        :return: suggestions, most popular first
+        """
+        prefix, size = fold(query), min(size, TOP_SIZE)
+        if not prefix or size <= 0:
+            return []
+        if len(prefix) > MAX_KEY_LENGTH:
+            # Longer than the keys: check the candidates on their names
+            wanted = " " + prefix
+            refs = [ref for ref in set(self.keys.refs_with_prefix(prefix[:MAX_KEY_LENGTH]))
+                    if (" " + fold(self.entries[ref].name)).find(wanted) != -1]
+            refs = heapq.nsmallest(size, refs, key=self._rank)
+        else:
+            top = self.top.get(prefix)
+            if top is None or not (top.complete or len(top.refs) >= size):
+                candidates = list(islice(self.keys.refs_with_prefix(prefix), SCAN_LIMIT + 1))
+                if len(candidates) <= SCAN_LIMIT:
+                    ranks = heapq.nsmallest(size, [self.entries[ref].rank for ref in set(candidates)])
+                    return [self.entries[self.refs[(kind, uid)]].to_dict() for _, _, kind, uid in ranks]
+                top = self._fill(prefix)
+            refs = top.refs[:size]
+        return [self.entries[ref].to_dict() for ref in refs]
+
+
+SUGGEST_INDEX = PrefixIndex()
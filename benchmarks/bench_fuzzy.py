@@ -0,0 +1,95 @@
+"""
+/search?fuzzy=true in process: build time of the trigram index, then latency of misspelled titles (one or two
+random edits) and how often the intended movie is in the first 10 hits, on a synthetic catalog.
+
+    python benchmarks/bench_fuzzy.py --rows 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.search.fuzzy import TrigramIndex  # noqa: E402
+
+CONSONANTS = "bcdfghjklmnprstvwz"
+VOWELS = "aeiouy"
+
+
+def pseudo_word(rng: random.Random) -> str:
+    return "".join(rng.choice(CONSONANTS) + rng.choice(VOWELS) + rng.choice(["", "", "n", "r", "s", "l"])
+                   for _ in range(rng.randint(1, 3)))
+
+
+def synthetic_movies(rows: int, rng: random.Random):
+    vocabulary = [pseudo_word(rng) for _ in range(50000)]
+    for i in range(rows):
+        yield {"uid": f"m{i:09d}",
+               "name": " ".join(rng.choice(vocabulary).title() for _ in range(rng.randint(1, 4))),
+               "popularity": round(rng.paretovariate(2.0) * 10, 2),
+               "imdb_score": round(rng.uniform(1.0, 10.0), 1),
+               "genre": ["Drama"],
+               "director": f"{rng.choice(vocabulary).title()} {rng.choice(vocabulary).title()}"}
+
+
+def misspell(text: str, rng: random.Random) -> str:
+    for _ in range(rng.randint(1, 2)):
+        position = rng.randrange(len(text))
+        edit = rng.choice(["insert", "delete", "replace", "swap"])
+        letter = rng.choice(string.ascii_lowercase)
+        if edit == "insert":
+            text = text[:position] + letter + text[position:]
+        elif edit == "delete" and len(text) > 1:
+            text = text[:position] + text[position + 1:]
+        elif edit == "replace":
+            text = text[:position] + letter + text[position + 1:]
+        elif position + 1 < len(text):
+            text = text[:position] + text[position + 1] + text[position] + text[position + 2:]
+    return text
+
+
+def percentiles(durations: list) -> str:
+    durations = sorted(durations)
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+    return f"p50 {statistics.median(durations) * 1000:7.2f} ms  p99 {p99 * 1000:7.2f} ms"
+
+
+def bench(rows: int, queries: int, rng: random.Random):
+    movies = list(synthetic_movies(rows, rng))
+    index = TrigramIndex()
+    start = time.perf_counter()
+    index.add_all(movies)
+    print(f"  build: {time.perf_counter() - start:.1f}s, {len(index.texts)} texts, {len(index.postings)} trigrams")
+
+    durations, found, fallbacks = [], 0, 0
+    for movie in rng.sample(movies, queries):
+        query = misspell(movie["name"], rng)
+        start = time.perf_counter()
+        hits = index.search(query)
+        durations.append(time.perf_counter() - start)
+        if hits is None:
+            fallbacks += 1
+            continue
+        # Another movie with the same name is as good a hit
+        found += movie["name"] in {movies[int(uid[1:])]["name"] for uid, _ in hits[:10]}
+    print(f"  search: {percentiles(durations)}  recall@10 {found / queries:.1%}  not selective {fallbacks}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    for rows in args.rows:
+        print(f"{rows} movies")
+        bench(rows, args.queries, rng)
+
+
+if __name__ == '__main__':
+    main()
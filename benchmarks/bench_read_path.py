@@ -0,0 +1,83 @@
+"""
+Per-request CPU and memory of the GET read path, without the network round trip to Mongo:
+odmantic instances + jsonable_encoder (the old path) against records + dumps (the current one).
+
+    python benchmarks/bench_read_path.py [--size 10] [--requests 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.records import dumps, record_type  # noqa: E402
+from app.models.movie import Movie  # noqa: E402
+
+
+def raw_documents(size: int) -> list:
+    now = datetime.utcnow()
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)  # BSON dates have millisecond precision
+    return [{"_id": ObjectId(),
+             "uid": str(uuid.uuid4()),
+             "name": f"Movie {i}",
+             "imdb_score": 7.5,
+             "genre": ["Adventure", " Family", " Fantasy", " Musical"],
+             "director": "Victor Fleming",
+             "popularity": 83.0,
+             "created_at": now,
+             "modified_at": now} for i in range(size)]
+
+
+def odmantic_path(docs: list) -> bytes:
+    movies = [Movie.parse_doc(doc) for doc in docs]
+    resp = {"data": movies, "count": 1000, "size": len(docs), "page": 1}
+    return json.dumps(jsonable_encoder(resp), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def record_path(docs: list) -> bytes:
+    record_cls = record_type(Movie)
+    movies = [record_cls(doc) for doc in docs]
+    resp = {"data": movies, "count": 1000, "size": len(docs), "page": 1}
+    return dumps(resp)
+
+
+def measure(func, docs: list, requests: int) -> dict:
+    func(docs)
+    start = time.process_time()
+    for _ in range(requests):
+        func(docs)
+    cpu = (time.process_time() - start) / requests
+
+    tracemalloc.start()
+    func(docs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_us": cpu * 1e6, "peak_kib": peak / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=10, help="movies per page")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    docs = raw_documents(args.size)
+    assert json.loads(odmantic_path(docs)) == json.loads(record_path(docs))
+
+    results = {name: measure(func, docs, args.requests)
+               for name, func in [("odmantic", odmantic_path), ("records", record_path)]}
+    for name, result in results.items():
+        print(f"{name:<10} {result['cpu_us']:>10.1f} us/request {result['peak_kib']:>10.1f} KiB peak")
+    print(f"speedup    {results['odmantic']['cpu_us'] / results['records']['cpu_us']:>10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+/search without a keyword: the columnar catalog against the Mongo path (find + sort on the repo's
+indexes + count), on the same synthetic catalog.
+
+    python benchmarks/bench_search_engine.py --rows 1000000 10000000
+    python benchmarks/bench_search_engine.py --rows 1000000 --mongo mongodb://localhost:27017
+
+Without --mongo only the columnar engine is measured. The Mongo catalog is written to the
+bench_search database, which is dropped first. The catalog takes about 150 MB per million rows, the
+uids and their slots dominate, the columns themselves are 29 bytes per row.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.search.columnar import ColumnarCatalog  # noqa: E402
+
+GENRES = ["Drama", "Comedy", "Action", "Adventure", "Family", "Fantasy", "Horror", "Musical", "Romance",
+          "Sci-Fi", "Thriller", "War", "Western", "Animation", "Crime", "Documentary"]
+CHUNK_SIZE = 100000
+
+# (label, genres, min_rating, max_rating, skip)
+QUERIES = [
+    ("all", [], 0.0, 10.0, 0),
+    ("one genre", ["Comedy"], 0.0, 10.0, 0),
+    ("rating range", [], 7.0, 9.0, 0),
+    ("genres + range", ["Drama", "War"], 6.5, 10.0, 0),
+    ("page 100", ["Drama"], 0.0, 10.0, 990),
+]
+
+
+def synthetic_chunks(rows: int, seed: int = 42):
+    """
+    Yield lists of movie documents, CHUNK_SIZE at a time
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, CHUNK_SIZE):
+        n = min(CHUNK_SIZE, rows - start)
+        scores = np.round(rng.uniform(1.0, 10.0, n), 1).tolist()
+        popularity = np.round(rng.pareto(2.0, n) * 10, 2).tolist()
+        genre_counts = rng.integers(1, 4, n).tolist()
+        genre_picks = rng.integers(0, len(GENRES), (n, 3)).tolist()
+        directors = rng.integers(0, max(1, rows // 20), n).tolist()
+        yield [{"uid": f"m{start + i:09d}",
+                "name": f"Movie {start + i}",
+                "imdb_score": scores[i],
+                "popularity": popularity[i],
+                "genre": sorted({GENRES[g] for g in genre_picks[i][:genre_counts[i]]}),
+                "director": f"Director {directors[i]}"} for i in range(n)]
+
+
+def timed(func, repeat: int) -> dict:
+    func()
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return {"p50_ms": statistics.median(durations) * 1000,
+            "p99_ms": durations[min(len(durations) - 1, int(len(durations) * 0.99))] * 1000}
+
+
+def bench_columnar(rows: int, repeat: int) -> dict:
+    catalog, loading = ColumnarCatalog(), 0.0
+    for chunk in synthetic_chunks(rows):
+        start = time.perf_counter()
+        catalog.add_all(chunk)
+        loading += time.perf_counter() - start
+    print(f"  columnar load: {loading:.1f}s")
+    return {label: timed(lambda: catalog.search(genres, low, high, skip=skip, limit=10), repeat)
+            for label, genres, low, high, skip in QUERIES}
+
+
+def bench_mongo(rows: int, repeat: int, uri: str) -> dict:
+    from pymongo import MongoClient
+
+    from app.db.indexes import INDEXES
+    from app.models.movie import Movie
+
+    client = MongoClient(uri)
+    client.drop_database("bench_search")
+    collection = client["bench_search"][Movie.__collection__]
+    loading = 0.0
+    for chunk in synthetic_chunks(rows):
+        start = time.perf_counter()
+        collection.insert_many(chunk, ordered=False)
+        loading += time.perf_counter() - start
+    start = time.perf_counter()
+    collection.create_indexes(INDEXES[Movie.__collection__])
+    print(f"  mongo load: {loading:.1f}s, indexes: {time.perf_counter() - start:.1f}s")
+
+    def search(genres, low, high, skip):
+        query = {"imdb_score": {"$gte": low, "$lte": high}}
+        if genres:
+            query["genre"] = {"$in": genres}
+        list(collection.find(query, {"_id": False}).sort([("popularity", -1), ("uid", 1)]).skip(skip).limit(10))
+        collection.count_documents(query)
+
+    try:
+        return {label: timed(lambda: search(genres, low, high, skip), repeat)
+                for label, genres, low, high, skip in QUERIES}
+    finally:
+        client.drop_database("bench_search")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000, 10000000])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--mongo", help="MongoDB URI, the Mongo path is skipped without it")
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        print(f"{rows} rows")
+        engines = {"columnar": bench_columnar(rows, args.repeat)}
+        if args.mongo:
+            engines["mongo"] = bench_mongo(rows, args.repeat, args.mongo)
+        for label, *_ in QUERIES:
+            line = "  ".join(f"{name} p50 {results[label]['p50_ms']:8.2f} ms p99 {results[label]['p99_ms']:8.2f} ms"
+                             for name, results in engines.items())
+            print(f"  {label:<15} {line}")
+
+
+if __name__ == '__main__':
+    main()
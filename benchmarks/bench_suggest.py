@@ -0,0 +1,80 @@
+"""
+/suggest in process: build time of the prefix index, then latency of random prefixes (1 to 10 characters of
+existing names, as typed) and of writes, on a synthetic catalog.
+
+    python benchmarks/bench_suggest.py --rows 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.search.suggest import PrefixIndex  # noqa: E402
+
+WORDS = ["the", "star", "night", "return", "king", "love", "dark", "city", "last", "lost", "house", "man", "war",
+         "blue", "river", "dead", "secret", "life", "summer", "ghost", "dream", "road", "fire", "moon", "empire",
+         "amélie", "château", "zero", "queen", "island", "shadow", "storm", "girl", "time", "world", "heart"]
+GENRES = ["Drama", "Comedy", "Action", "Adventure", "Family", "Fantasy", "Horror", "Musical", "Romance",
+          "Sci-Fi", "Thriller", "War", "Western", "Animation", "Crime", "Documentary"]
+
+
+def synthetic_movies(rows: int, rng: random.Random):
+    for i in range(rows):
+        yield {"uid": f"m{i:09d}",
+               "name": " ".join(rng.choice(WORDS).title() for _ in range(rng.randint(1, 4))) + f" {i}",
+               "popularity": round(rng.paretovariate(2.0) * 10, 2),
+               "genre": rng.sample(GENRES, rng.randint(1, 3)),
+               "director": f"Director {rng.randrange(max(1, rows // 20))}"}
+
+
+def percentiles(durations: list) -> str:
+    durations = sorted(durations)
+    p99 = durations[min(len(durations) - 1, int(len(durations) * 0.99))]
+    return f"p50 {statistics.median(durations) * 1e6:7.1f} us  p99 {p99 * 1e6:7.1f} us"
+
+
+def bench(rows: int, queries: int, rng: random.Random):
+    movies = list(synthetic_movies(rows, rng))
+    index = PrefixIndex()
+    start = time.perf_counter()
+    index.load("movie", movies)
+    index.load("director", ({"uid": f"d{i}", "name": f"Director {i}"} for i in range(max(1, rows // 20))))
+    index.load("genre", ({"uid": f"g{i}", "name": genre} for i, genre in enumerate(GENRES)))
+    index.finish()
+    print(f"  build: {time.perf_counter() - start:.1f}s, {len(index)} entries, {len(index.keys)} keys")
+
+    prefixes = [movie["name"][:rng.randint(1, 10)] for movie in rng.sample(movies, queries)]
+    durations = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        index.suggest(prefix, 10)
+        durations.append(time.perf_counter() - start)
+    print(f"  suggest: {percentiles(durations)}")
+
+    durations = []
+    for movie in rng.sample(movies, min(queries, 10000)):
+        movie = dict(movie, popularity=round(rng.paretovariate(2.0) * 10, 2))
+        start = time.perf_counter()
+        index.add_movies([movie])
+        durations.append(time.perf_counter() - start)
+    print(f"  update:  {percentiles(durations)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--queries", type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    for rows in args.rows:
+        print(f"{rows} movies")
+        bench(rows, args.queries, rng)
+
+
+if __name__ == '__main__':
+    main()
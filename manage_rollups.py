@@ -0,0 +1,7 @@
+import asyncio
+
+from app.db.rollups import main
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
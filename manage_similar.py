@@ -0,0 +1,7 @@
+import asyncio
+
+from app.search.similar import main
+
+
+if __name__ == '__main__':
+    raise SystemExit(asyncio.run(main()))
@@ -0,0 +1,154 @@
+"""
+In-memory stand-in for the motor collections the bulk writers, the importer, the rollups, the similar movie
+lists and the index tools are tested against
+"""
+import asyncio
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+DUPLICATE_KEY = 11000
+
+
+def matches(document: dict, query: dict) -> bool:
+    """
+    Equality, $in (on a value or an array) and $exists, the only filters the code under test sends
+    """
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict) and "$in" in condition:
+            values = value if isinstance(value, list) else [value]
+            if not any(item in condition["$in"] for item in values):
+                return False
+        elif isinstance(condition, dict) and "$exists" in condition:
+            if (field in document) != condition["$exists"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class BulkResult:
+    def __init__(self):
+        self.inserted_count = self.matched_count = self.modified_count = 0
+        self.upserted_count = self.deleted_count = 0
+
+    def details(self, errors: list) -> dict:
+        return {"writeErrors": errors, "nInserted": self.inserted_count, "nMatched": self.matched_count,
+                "nModified": self.modified_count, "nUpserted": self.upserted_count, "nRemoved": self.deleted_count}
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def limit(self, limit):
+        return FakeCursor(self.documents[:limit])
+
+    def __aiter__(self):
+        async def iterate():
+            for document in self.documents:
+                yield document
+        return iterate()
+
+
+class FakeCollection:
+    """
+    Applies unordered bulk_writes to documents in memory and records the requests
+    :param documents: initial documents, given an _id when they have none
+    :param unique: fields of a unique index, an insert repeating them fails with a duplicate key
+    :param groups: results of aggregate(), pipelines are recorded but not evaluated
+    """
+
+    def __init__(self, documents=(), unique=None, groups=()):
+        self.documents = [dict({"_id": ObjectId()}, **document) for document in documents]
+        self.unique = unique
+        self.groups = list(groups)
+        self.requests, self.pipelines = [], []
+        self.finds = 0
+        # Seconds waited by the next bulk_writes
+        self.delays = []
+        # Filters of the upserts that lose a race: another writer inserts the document first
+        self.racing_upserts = []
+        # Documents whose writes fail with a lost connection, failing their whole bulk_write
+        self.unreachable = []
+
+    def by_id(self) -> dict:
+        return {document["_id"]: document for document in self.documents}
+
+    def find(self, query: dict, projection: dict = None) -> FakeCursor:
+        self.finds += 1
+        return FakeCursor([dict(document) for document in self.documents if matches(document, query)])
+
+    async def aggregate(self, pipeline: list, allowDiskUse: bool = False):
+        self.pipelines.append(pipeline)
+        for group in self.groups:
+            yield group
+
+    async def delete_many(self, query: dict) -> BulkResult:
+        return await self.bulk_write([DeleteMany(query)])
+
+    async def bulk_write(self, requests, ordered=True) -> BulkResult:
+        requests = list(requests)
+        self.requests.extend(requests)
+        if self.delays:
+            await asyncio.sleep(self.delays.pop(0))
+        if any(matches(document, request._filter) for request in requests if hasattr(request, "_filter")
+               for document in self.unreachable):
+            raise AutoReconnect("connection closed")
+        result, errors = BulkResult(), []
+        for index, request in enumerate(requests):
+            error = self._apply(request, result)
+            if error is not None:
+                errors.append(dict(error, index=index))
+        if errors:
+            raise BulkWriteError(result.details(errors))
+        return result
+
+    def _apply(self, request, result: BulkResult):
+        if isinstance(request, InsertOne):
+            return self._insert(dict(request._doc), result)
+        if isinstance(request, (DeleteOne, DeleteMany)):
+            doomed = [document for document in self.documents if matches(document, request._filter)]
+            doomed = doomed[:1] if isinstance(request, DeleteOne) else doomed
+            self.documents = [document for document in self.documents if document not in doomed]
+            result.deleted_count += len(doomed)
+            return None
+
+        found = next((document for document in self.documents if matches(document, request._filter)), None)
+        if found is None and request._upsert:
+            if request._filter in self.racing_upserts:
+                self.racing_upserts.remove(request._filter)
+                self._insert(dict(request._filter), BulkResult())
+                return {"code": DUPLICATE_KEY, "errmsg": "E11000 duplicate key"}
+            if isinstance(request, ReplaceOne):
+                return self._insert(dict(request._filter, **request._doc), result, upsert=True)
+            return self._insert(dict(request._filter, **request._doc.get("$setOnInsert", {}),
+                                     **request._doc.get("$set", {})), result, upsert=True)
+        if found is None:
+            return None
+        result.matched_count += 1
+        if isinstance(request, ReplaceOne):
+            changed = request._doc != {field: value for field, value in found.items() if field != "_id"}
+            found.clear()
+            found.update(dict(request._filter, **request._doc))
+        else:
+            update = {field: value for field, value in request._doc.get("$set", {}).items()
+                      if found.get(field) != value}
+            found.update(update)
+            changed = bool(update)
+        result.modified_count += changed
+        return None
+
+    def _insert(self, document: dict, result: BulkResult, upsert: bool = False):
+        document.setdefault("_id", ObjectId())
+        if self.unique and any(all(other.get(field) == document.get(field) for field in self.unique)
+                               for other in self.documents):
+            return {"code": DUPLICATE_KEY, "errmsg": "E11000 duplicate key"}
+        self.documents.append(document)
+        if upsert:
+            result.upserted_count += 1
+        else:
+            result.inserted_count += 1
+        return None
@@ -134,3 +134,27 @@ class AuthTokenTestCases(unittest.TestCase):
         }
         response = self.client.request(method="post", url="/auth/token", json=old_user)
         self.assertEqual(401, response.status_code)
+
+    def test_logout(self):
+        old_user = {
+            "email_id": "testemail2@gmail.com",
+            "password": "password"
+        }
+        tokens = [self.client.request(method="post", url="/auth/token", json=old_user).json().get("access_token")
+                  for _ in range(2)]
+        for token in tokens:
+            response = self.client.request(method="get", url="/", headers={"access-token": token})
+            self.assertEqual(200, response.status_code)
+
+        response = self.client.request(method="get", url="/logout", headers={"access-token": tokens[0]})
+        self.assertEqual(200, response.status_code)
+        response = self.client.request(method="get", url="/", headers={"access-token": tokens[0]})
+        self.assertEqual(401, response.status_code)
+        response = self.client.request(method="get", url="/", headers={"access-token": tokens[1]})
+        self.assertEqual(200, response.status_code)
+
+        response = self.client.request(method="get", url="/logout", params={"everywhere": True},
+                                       headers={"access-token": tokens[1]})
+        self.assertEqual(200, response.status_code)
+        response = self.client.request(method="get", url="/", headers={"access-token": tokens[1]})
+        self.assertEqual(401, response.status_code)
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from app.config import Config
+from app.db.bulk import bulk_create, bulk_delete, bulk_patch, summary, validate_changes
+from app.models.movie import Genre, Movie
+from tests.fakes import FakeCollection
+
+
+def collection_of(*uids) -> FakeCollection:
+    # Like the unique uid index
+    return FakeCollection([{"uid": uid} for uid in uids], unique=("uid",))
+
+
+def by_uid(collection: FakeCollection) -> dict:
+    return {document["uid"]: document for document in collection.documents}
+
+
+def movie(uid: str) -> dict:
+    return {"uid": uid, "name": f"movie {uid}", "imdb_score": 7.0, "genre": ["Drama"], "director": "Lucas",
+            "popularity": 70.0}
+
+
+def statuses(bulk_summary: dict) -> list:
+    return [(result["index"], result["uid"], result["status"]) for result in bulk_summary["results"]]
+
+
+class ValidateChangesTestCases(unittest.TestCase):
+    def test_valid_changes(self):
+        self.assertDictEqual({"imdb_score": 8.1, "name": "Oz"},
+                             validate_changes(Movie, {"imdb_score": "8.1", "name": "Oz"}))
+        self.assertDictEqual({}, validate_changes(Genre, {}))
+
+    def test_invalid_changes(self):
+        for changes in [{"imdb_score": "high"}, {"genre": "Drama"}, {"uid": "x"}, {"modified_at": None},
+                        {"password": "x"}]:
+            with self.assertRaises(ValueError):
+                validate_changes(Movie, changes)
+
+
+class SummaryTestCases(unittest.TestCase):
+    def test_counts(self):
+        results = [{"index": 0, "uid": "a", "status": "created"}, {"index": 1, "uid": "a", "status": "error"},
+                   {"index": 2, "uid": "b", "status": "created"}]
+        self.assertDictEqual({"created": 2, "error": 1}, summary(results)["counts"])
+
+
+@mock.patch.object(Config, "BULK_CHUNK_SIZE", 2)
+class BulkWriteTestCases(unittest.TestCase):
+    def test_create_maps_write_errors_to_items(self):
+        database = {Movie.__collection__: collection_of("b")}
+        items = [movie("a"), {"uid": "x", "name": "X"}, movie("b"), movie("c"), movie("d"), movie("a")]
+        result, created = asyncio.run(bulk_create(database, Movie, items))
+
+        # Write error indexes are positions in their chunk: ["a", "b"], ["c", "d"], ["a"]
+        self.assertListEqual([(0, "a", "created"), (1, "x", "invalid"), (2, "b", "error"), (3, "c", "created"),
+                              (4, "d", "created"), (5, "a", "error")], statuses(result))
+        self.assertIn("E11000", result["results"][2]["detail"])
+        self.assertListEqual(["a", "c", "d"], [movie.uid for movie in created])
+        self.assertEqual(0, database[Movie.__collection__].finds)
+
+    def test_patch_reads_once_for_not_found(self):
+        collection = collection_of("a", "c")
+        items = [{"uid": "a", "imdb_score": 8.0}, {"uid": "b", "imdb_score": 8.0}, {"uid": "c", "name": "C"},
+                 {"uid": "d", "imdb_score": "high"}, {"imdb_score": 8.0}]
+        result = asyncio.run(bulk_patch({Movie.__collection__: collection}, Movie, items))
+
+        self.assertListEqual([(0, "a", "updated"), (1, "b", "not_found"), (2, "c", "updated"),
+                              (3, "d", "invalid"), (4, None, "invalid")], statuses(result))
+        self.assertEqual(8.0, by_uid(collection)["a"]["imdb_score"])
+        # Only the first chunk has an update matching nothing
+        self.assertEqual(1, collection.finds)
+
+    def test_delete_reads_then_deletes_the_existing(self):
+        collection = collection_of("a", "c", "z")
+        result = asyncio.run(bulk_delete({Movie.__collection__: collection}, Movie, ["a", "b", "c", "d", "e"]))
+
+        self.assertListEqual([(0, "a", "deleted"), (1, "b", "not_found"), (2, "c", "deleted"),
+                              (3, "d", "not_found"), (4, "e", "not_found")], statuses(result))
+        self.assertDictEqual({"deleted": 2, "not_found": 3}, result["counts"])
+        self.assertEqual(3, collection.finds)
+        # One DeleteMany of the existing uids per chunk, none for a chunk with nothing to delete
+        self.assertListEqual([["a"], ["c"]], [request._filter["uid"]["$in"] for request in collection.requests])
+        self.assertListEqual(["z"], list(by_uid(collection)))
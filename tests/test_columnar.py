@@ -0,0 +1,85 @@
+import random
+import unittest
+
+from app.search.columnar import MAX_GENRES, ColumnarCatalog, np
+
+GENRES = ["Drama", " Family", "Family", "Comedy", " Fantasy"]
+
+
+def reference(movies: dict, genres, min_rating, max_rating) -> list:
+    matches = [movie for movie in movies.values()
+               if min_rating <= movie["imdb_score"] <= max_rating and (not genres or set(movie["genre"]) & set(genres))]
+    return sorted(matches, key=lambda movie: (-movie["popularity"], movie["uid"]))
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class ColumnarCatalogTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = random.Random(7)
+        self.movies = {}
+        for i in range(2000):
+            uid = f"{rng.getrandbits(64):016x}"
+            self.movies[uid] = {"uid": uid, "imdb_score": round(rng.uniform(1, 10), 1),
+                                # few distinct values, so that pages have ties on popularity
+                                "popularity": float(rng.randint(0, 50)),
+                                "genre": rng.sample(GENRES, rng.randint(0, 3)), "director": f"d{rng.randint(0, 40)}"}
+        self.catalog = ColumnarCatalog(capacity=8)
+        self.catalog.add_all(list(self.movies.values()))
+
+    def assert_matches_reference(self, genres, min_rating, max_rating):
+        expected = reference(self.movies, genres, min_rating, max_rating)
+        for skip, limit in [(0, 10), (25, 7), (len(expected), 10)]:
+            uids, count, _ = self.catalog.search(genres, min_rating, max_rating, skip=skip, limit=limit)
+            self.assertEqual(len(expected), count)
+            self.assertListEqual([movie["uid"] for movie in expected[skip:skip + limit]], uids)
+
+        # Keyset pagination walks every match once, in order
+        walked, after = [], None
+        while True:
+            uids, _, _ = self.catalog.search(genres, min_rating, max_rating, limit=13, after=after)
+            walked.extend(uids)
+            if len(uids) < 13:
+                break
+            after = (self.movies[uids[-1]]["popularity"], uids[-1])
+        self.assertListEqual([movie["uid"] for movie in expected], walked)
+
+    def test_filters(self):
+        self.assert_matches_reference([], 0.0, 10.0)
+        self.assert_matches_reference(["Drama"], 5.0, 8.0)
+        self.assert_matches_reference([" Family", "Comedy"], 0.0, 10.0)
+        self.assert_matches_reference(["Unknown"], 0.0, 10.0)
+
+    def test_updates_and_deletes(self):
+        uids = list(self.movies)
+        for uid in uids[:300]:
+            self.catalog.remove(uid)
+            del self.movies[uid]
+        moved = dict(self.movies[uids[400]], popularity=1000.0, genre=["Comedy"])
+        new = {"uid": "new", "imdb_score": 5.0, "popularity": 50.0, "genre": ["Drama"], "director": "x"}
+        self.catalog.add_all([moved, new])
+        self.movies.update({moved["uid"]: moved, "new": new})
+
+        self.assertEqual(len(self.movies), len(self.catalog))
+        # The deleted slots are reused
+        self.assertEqual(2000, self.catalog.size)
+        self.assert_matches_reference([], 0.0, 10.0)
+        self.assert_matches_reference(["Comedy"], 0.0, 10.0)
+
+    def test_facets(self):
+        mask = self.catalog.mask(["Drama"], 5.0, 8.0)
+        raw = self.catalog.facets(mask, ["genre", "imdb_score"])
+        matches = reference(self.movies, ["Drama"], 5.0, 8.0)
+        # Genres are trimmed, like in the Mongo facets
+        family = sum(movie["genre"].count(" Family") + movie["genre"].count("Family") for movie in matches)
+        self.assertIn({"_id": "Family", "count": family}, raw["genre"])
+        self.assertEqual(len(matches), sum(row["count"] for row in raw["imdb_score"]))
+        self.assertListEqual(sorted(row["_id"] for row in raw["imdb_score"]), [row["_id"] for row in raw["imdb_score"]])
+
+    def test_too_many_genres(self):
+        self.catalog.add_all([{"uid": f"g{i}", "imdb_score": 5.0, "popularity": 1.0, "genre": [f"genre {i}"]}
+                              for i in range(MAX_GENRES)])
+        self.assertFalse(self.catalog.supported)
+
+
+if __name__ == '__main__':
+    unittest.main()
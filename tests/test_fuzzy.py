@@ -0,0 +1,122 @@
+import random
+import unittest
+from unittest import mock
+
+from app.search import fuzzy
+from app.search.fuzzy import Pattern, TrigramIndex, edit_distance, trigrams, word_distance
+from app.search.suggest import fold
+
+WORDS = ["Star", "Wars", "The", "Return", "King", "Night", "Amélie", "Stardust", "Lord", "Of", "Rings"]
+
+
+def reference_distance(a: str, b: str) -> int:
+    row = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        previous, row[0] = row[0], i
+        for j, other in enumerate(b, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (char != other))
+    return row[-1]
+
+
+class TrigramIndexTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.rng = random.Random(5)
+        self.movies = {}
+        for i in range(800):
+            self.add_movie(f"m{i}")
+        self.movies["oz"] = {"uid": "oz", "name": "The Wizard of Oz", "director": "Victor Fleming",
+                             "popularity": 83.0, "imdb_score": 8.3, "genre": ["Adventure", " Family"]}
+        self.index = TrigramIndex()
+        self.index.add_all(self.movies.values())
+
+    def add_movie(self, uid: str) -> dict:
+        movie = self.movies[uid] = {
+            "uid": uid, "name": " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(1, 4))),
+            "popularity": float(self.rng.randint(0, 30)), "director": f"Director {self.rng.randint(0, 40)}",
+            "imdb_score": float(self.rng.randint(10, 90)) / 10, "genre": self.rng.sample(["Drama", " War"], 1)}
+        return movie
+
+    def assert_consistent(self):
+        # Posting lists hold exactly the trigrams of the indexed texts, in increasing order
+        expected = {}
+        for text_id, text in self.index.texts.items():
+            for gram in trigrams(text):
+                expected.setdefault(gram, []).append(text_id)
+        self.assertDictEqual(expected, {gram: list(postings) for gram, postings in self.index.postings.items()})
+        owners = {}
+        for uid, doc in self.index.docs.items():
+            for text_id in doc.texts:
+                owners.setdefault(text_id, set()).add(uid)
+        self.assertDictEqual(owners, self.index.owners)
+        self.assertSetEqual(set(self.movies), set(self.index.docs))
+
+    def test_trigrams(self):
+        self.assertSetEqual({"  o", " oz", "oz "}, trigrams("oz"))
+        self.assertSetEqual(set(), trigrams(""))
+
+    def test_edit_distance(self):
+        self.assertEqual(0, edit_distance("wizard", "wizard", 3))
+        self.assertEqual(1, edit_distance("wizzard", "wizard", 3))
+        self.assertEqual(2, edit_distance("kitten", "sittin", 3))
+        self.assertEqual(3, edit_distance("kitten", "", 3))
+        for _ in range(500):
+            a = "".join(self.rng.choice("abc") for _ in range(self.rng.randint(0, 9)))
+            b = "".join(self.rng.choice("abc") for _ in range(self.rng.randint(0, 9)))
+            self.assertEqual(min(reference_distance(a, b), 4), edit_distance(a, b, 4), (a, b))
+
+    def test_search(self):
+        self.assertEqual(("oz", 1), self.index.search("wizzard of oz")[0])
+        self.assertEqual(("oz", 1), self.index.search("Victor Flemming")[0])
+        self.assertEqual("oz", self.index.search("THE WIZARD OF OZ")[0][0])
+        self.assertListEqual([], self.index.search("  "))
+        self.assertListEqual([], self.index.search("xq"))
+
+        # Ranked by edit distance, then difference in number of words, then popularity
+        query = [Pattern(word) for word in ("stardust", "night")]
+        hits = self.index.search("stardust night")
+        self.assertTrue(hits)
+        keys = []
+        for uid, distance in hits:
+            movie = self.movies[uid]
+            key = min((word_distance(query, fold(movie[field])), abs(len(fold(movie[field]).split()) - 2))
+                      for field in ("name", "director"))
+            self.assertEqual(key[0], distance)
+            keys.append(key + (-movie["popularity"],))
+        self.assertListEqual(sorted(keys), keys)
+
+    def test_filters(self):
+        self.assertEqual("oz", self.index.search("wizzard of oz", genres=["Family"])[0][0])
+        self.assertNotIn("oz", [uid for uid, _ in self.index.search("wizzard of oz", genres=["Drama"])])
+        self.assertNotIn("oz", [uid for uid, _ in self.index.search("wizzard of oz", min_rating=8.5)])
+        for uid, _ in self.index.search("return king", genres=["War"], min_rating=3.0, max_rating=6.0):
+            movie = self.movies[uid]
+            self.assertIn(" War", movie["genre"])
+            self.assertTrue(3.0 <= movie["imdb_score"] <= 6.0)
+
+    def test_not_selective(self):
+        with mock.patch.object(fuzzy, "MAX_CANDIDATES", 5):
+            self.assertIsNone(self.index.search("the"))
+
+    def test_writes(self):
+        for step in range(400):
+            choice = self.rng.random()
+            if choice < 0.4:
+                movie = self.movies[self.rng.choice(list(self.movies))]
+                movie["name"] = self.add_movie("scratch")["name"]
+                del self.movies["scratch"]
+                self.index.add(movie)
+            elif choice < 0.7:
+                uid = self.rng.choice(list(self.movies))
+                del self.movies[uid]
+                self.index.remove(uid)
+            else:
+                self.index.add(self.add_movie(f"n{step}"))
+            if step % 100 == 0:
+                self.assert_consistent()
+        self.assert_consistent()
+        self.index.remove("missing")
+        self.assert_consistent()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import asyncio
+import time
+import unittest
+
+from fastapi import HTTPException
+
+from app.auth.hashing import HashingPool
+
+
+class HashingPoolTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.pool = HashingPool(workers=2, max_queue=1)
+
+    def tearDown(self) -> None:
+        self.pool.shutdown()
+
+    def test_runs_off_the_event_loop(self):
+        async def run():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            task = asyncio.ensure_future(ticker())
+            result = await self.pool.run(lambda: time.sleep(0.2) or "hashed")
+            task.cancel()
+            return result, ticks
+
+        result, ticks = asyncio.run(run())
+        self.assertEqual("hashed", result)
+        self.assertGreater(ticks, 5)
+
+    def test_rejects_when_saturated(self):
+        async def run():
+            return await asyncio.gather(*[self.pool.run(time.sleep, 0.1) for _ in range(5)], return_exceptions=True)
+
+        results = asyncio.run(run())
+        rejected = [result for result in results if isinstance(result, HTTPException)]
+        self.assertEqual(2, len(rejected))
+        self.assertEqual(429, rejected[0].status_code)
+        self.assertEqual(2, self.pool.stats["rejected"])
+        self.assertEqual(0, self.pool.in_flight)
@@ -0,0 +1,141 @@
+import asyncio
+import io
+import json
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+
+from app.db import importer
+from app.db.importer import import_movies, iter_json_records, key_digest, movie_document, natural_key
+from app.models.movie import Director, Genre, Movie
+from tests.fakes import FakeCollection
+
+ROWS = [{"99popularity": 83.0, "director": "Victor Fleming", "genre": ["Adventure", " Family"],
+         "imdb_score": 8.3, "name": "The Wizard of Oz"},
+        {"99popularity": 88.0, "director": "George Lucas", "genre": ["Action", " Sci-Fi"],
+         "imdb_score": 8.8, "name": "Star Wars, \"A New Hope\" [1977]"}]
+
+
+class ParserTestCases(unittest.TestCase):
+    def test_json_array(self):
+        text = json.dumps(ROWS, indent=2)
+        for chunk_size in (1, 7, 1 << 16):
+            self.assertListEqual(ROWS, list(iter_json_records(io.StringIO(text), chunk_size=chunk_size)))
+
+    def test_ndjson(self):
+        text = "\n".join(json.dumps(row) for row in ROWS) + "\n"
+        for chunk_size in (1, 7, 1 << 16):
+            self.assertListEqual(ROWS, list(iter_json_records(io.StringIO(text), chunk_size=chunk_size)))
+
+    def test_single_object_and_empty_file(self):
+        self.assertListEqual(ROWS[:1], list(iter_json_records(io.StringIO(json.dumps(ROWS[0])))))
+        self.assertListEqual([], list(iter_json_records(io.StringIO(""))))
+        self.assertListEqual([], list(iter_json_records(io.StringIO(" [ ] "))))
+
+    def test_truncated_file(self):
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_json_records(io.StringIO(json.dumps(ROWS)[:-20]), chunk_size=8))
+
+
+class MovieDocumentTestCases(unittest.TestCase):
+    def test_valid_row(self):
+        document = movie_document(ROWS[0])
+        self.assertEqual(["Adventure", "Family"], document["genre"])
+        self.assertEqual(83.0, document["popularity"])
+        self.assertEqual(("The Wizard of Oz", "Victor Fleming"), natural_key(document))
+        self.assertNotIn("uid", document)
+
+    def test_content_hash(self):
+        document = movie_document(ROWS[0])
+        same = movie_document(dict(ROWS[0], genre="Adventure, Family"))
+        self.assertEqual(document["content_hash"], same["content_hash"])
+        self.assertNotEqual(document["content_hash"], movie_document(dict(ROWS[0], imdb_score=8.4))["content_hash"])
+        self.assertNotEqual(key_digest(("a", "bc")), key_digest(("ab", "c")))
+
+    def test_invalid_rows(self):
+        for row in [[], {"name": "x"}, dict(ROWS[0], imdb_score="n/a"), dict(ROWS[0], name=" ")]:
+            with self.assertRaises(ValueError):
+                movie_document(row)
+
+
+def feed(rows) -> io.StringIO:
+    return io.StringIO("\n".join(json.dumps(row) for row in rows))
+
+
+class ImportTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.database = {Movie.__collection__: FakeCollection(), Genre.__collection__: FakeCollection(),
+                         Director.__collection__: FakeCollection()}
+        self.movies = self.database[Movie.__collection__]
+        self.rows = [dict(ROWS[0], name=f"Movie {i}", imdb_score=float(i)) for i in range(5)] + ROWS[1:]
+        patcher = mock.patch.object(importer, "rebuild_all", mock.AsyncMock())
+        self.rebuild_all = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_import(self, rows, **kwargs) -> dict:
+        return asyncio.run(import_movies(self.database, feed(rows), **dict({"batch_size": 2}, **kwargs)))
+
+    def stored(self) -> dict:
+        return {natural_key(document): document for document in self.movies.documents}
+
+    def test_rerun_is_unchanged(self):
+        stats = self.run_import(self.rows)
+        self.assertEqual((6, 0, 0), (stats["inserted"], stats["updated"], stats["unchanged"]))
+        self.assertEqual(2, len(self.database[Director.__collection__].documents))
+        before = {key: dict(document) for key, document in self.stored().items()}
+
+        self.rebuild_all.reset_mock()
+        stats = self.run_import(self.rows)
+        self.assertEqual((0, 0, 6), (stats["inserted"], stats["updated"], stats["unchanged"]))
+        self.assertDictEqual(before, self.stored())
+        self.rebuild_all.assert_not_called()
+
+    def test_changed_rows_are_updated(self):
+        self.run_import(self.rows)
+        before = self.stored()[("Movie 1", "Victor Fleming")]
+        rows = [dict(row, imdb_score=9.9) if row["name"] == "Movie 1" else row for row in self.rows]
+        stats = self.run_import(rows + [dict(ROWS[0], name="Movie 9")])
+        self.assertEqual((1, 1, 5), (stats["inserted"], stats["updated"], stats["unchanged"]))
+        after = self.stored()[("Movie 1", "Victor Fleming")]
+        self.assertEqual(9.9, after["imdb_score"])
+        self.assertEqual(before["uid"], after["uid"])
+        self.assertEqual(7, len(self.movies.documents))
+
+    def test_delete_missing(self):
+        self.run_import(self.rows)
+        # Created through the API, not by an import
+        self.movies.documents.append({"_id": ObjectId(), "uid": "api", "name": "Movie 0", "director": "Someone"})
+        stats = self.run_import(self.rows[1:], delete=True)
+        self.assertEqual(1, stats["deleted"])
+        self.assertNotIn(("Movie 0", "Victor Fleming"), self.stored())
+        self.assertIn(("Movie 0", "Someone"), self.stored())
+        self.assertEqual(0, self.run_import(self.rows[1:], delete=False)["deleted"])
+
+    def test_last_row_wins_across_batches(self):
+        # The first batch is the slowest to write, the later rows of its key still land last
+        self.movies.delays = [0.05, 0.0, 0.0]
+        rows = [dict(ROWS[0], imdb_score=score) for score in (1.0, 2.0, 3.0)]
+        stats = self.run_import(rows, batch_size=1, in_flight=3)
+        self.assertEqual(1, len(self.movies.documents))
+        self.assertEqual(3.0, self.movies.documents[0]["imdb_score"])
+        self.assertEqual((1, 2), (stats["inserted"], stats["updated"]))
+
+    def test_racing_insert_is_updated(self):
+        # Inserted by another import between the read and the upsert
+        self.movies.racing_upserts.append({"name": ROWS[0]["name"], "director": ROWS[0]["director"]})
+        stats = self.run_import(ROWS)
+        self.assertEqual((1, 1, 0), (stats["inserted"], stats["updated"], stats["failed"]))
+        self.assertEqual(2, len(self.movies.documents))
+        self.assertEqual(movie_document(ROWS[0])["content_hash"],
+                         self.stored()[natural_key(ROWS[0])]["content_hash"])
+
+    def test_failed_batch_keeps_missing_rows(self):
+        self.run_import(self.rows)
+        self.movies.documents = [document for document in self.movies.documents if document["name"] != "Movie 3"]
+        self.movies.unreachable.append({"name": "Movie 3", "director": "Victor Fleming"})
+        stats = self.run_import([dict(row, imdb_score=9.9) for row in self.rows[1:]], delete=True)
+        # The batch of Movie 3 and Movie 4 is lost, the others are written and nothing is deleted
+        self.assertEqual((2, 3, 0), (stats["failed"], stats["updated"], stats["deleted"]))
+        self.assertIn(("Movie 0", "Victor Fleming"), self.stored())
+        self.assertEqual(4.0, self.stored()[("Movie 4", "Victor Fleming")]["imdb_score"])
@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+from app.db.indexes import INDEXES, diff_indexes, drop_duplicates
+from app.models.movie import Movie
+from tests.fakes import FakeCollection
+
+
+class IndexSpecTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.spec = [
+            IndexModel([("uid", ASCENDING)], name="uid", unique=True),
+            IndexModel([("popularity", DESCENDING), ("uid", ASCENDING)], name="popularity_uid"),
+            IndexModel([("name", TEXT), ("director", TEXT)], name="name_text_director_text",
+                       default_language="none"),
+        ]
+
+    def test_in_sync(self):
+        existing = {
+            "_id_": {"key": [("_id", 1)], "v": 2},
+            "uid": {"key": [("uid", 1)], "unique": True, "v": 2},
+            "popularity_uid": {"key": [("popularity", -1), ("uid", 1)], "v": 2},
+            "name_text_director_text": {"key": [("_fts", "text"), ("_ftsx", 1)], "v": 2,
+                                        "weights": {"director": 1, "name": 1}, "default_language": "none",
+                                        "language_override": "language", "textIndexVersion": 3},
+        }
+        report = diff_indexes(self.spec, existing)
+        self.assertListEqual(["uid", "popularity_uid", "name_text_director_text"], report["ok"])
+        self.assertFalse(report["missing"] or report["drifted"] or report["extra"])
+
+    def test_text_index_language(self):
+        # An english text index drops stop words, it is rebuilt without a language
+        existing = {"name_text_director_text": {"key": [("_fts", "text"), ("_ftsx", 1)], "v": 2,
+                                                "weights": {"director": 1, "name": 1}, "default_language": "english",
+                                                "language_override": "language", "textIndexVersion": 3}}
+        self.assertListEqual(["name_text_director_text"], diff_indexes(self.spec, existing)["drifted"])
+
+    def test_missing_drifted_and_extra(self):
+        existing = {
+            "_id_": {"key": [("_id", 1)], "v": 2},
+            "uid": {"key": [("uid", 1)], "v": 2},
+            "popularity_1": {"key": [("popularity", 1)], "v": 2},
+        }
+        report = diff_indexes(self.spec, existing)
+        self.assertListEqual(["popularity_uid", "name_text_director_text"], report["missing"])
+        self.assertListEqual(["uid"], report["drifted"])
+        self.assertListEqual(["popularity_1"], report["extra"])
+
+    def test_collation(self):
+        spec = [IndexModel([("name", ASCENDING)], name="name_ci", collation={"locale": "en", "strength": 2})]
+        existing = {"name_ci": {"key": [("name", 1)], "v": 2,
+                                "collation": {"locale": "en", "caseLevel": False, "caseFirst": "off", "strength": 2,
+                                              "numericOrdering": False, "alternate": "non-ignorable",
+                                              "maxVariable": "punct", "normalization": False, "backwards": False,
+                                              "version": "57.1"}}}
+        self.assertListEqual(["name_ci"], diff_indexes(spec, existing)["ok"])
+        existing["name_ci"]["collation"]["strength"] = 3
+        self.assertListEqual(["name_ci"], diff_indexes(spec, existing)["drifted"])
+        del existing["name_ci"]["collation"]
+        self.assertListEqual(["name_ci"], diff_indexes(spec, existing)["drifted"])
+
+    def test_movie_spec_covers_handler_lookups(self):
+        keys = [list(index.document["key"].items()) for index in INDEXES[Movie.__collection__]]
+        self.assertIn([("uid", ASCENDING)], keys)
+        self.assertIn([("popularity", DESCENDING), ("uid", ASCENDING)], keys)
+        self.assertIn([("director", ASCENDING), ("popularity", DESCENDING), ("uid", ASCENDING)], keys)
+
+
+class DropDuplicatesTestCases(unittest.TestCase):
+    def test_keeps_the_last_modified(self):
+        index = next(index for index in INDEXES[Movie.__collection__] if index.document["name"] == "name_director")
+        self.assertTrue(index.document["unique"])
+        groups = [{"_id": ["Oz", "Fleming"], "ids": [3, 2, 1]}, {"_id": ["A", "B"], "ids": [5, 4]}]
+        collection = FakeCollection([{"_id": _id} for _id in range(1, 6)], groups=groups)
+        self.assertEqual(3, asyncio.run(drop_duplicates(collection, index)))
+        self.assertListEqual([3, 5], list(collection.by_id()))
+        pipeline = collection.pipelines[0]
+        # Only the imported movies the partial index covers, newest first
+        self.assertDictEqual({"content_hash": {"$exists": True}}, pipeline[0]["$match"])
+        self.assertDictEqual({"modified_at": -1, "_id": -1}, pipeline[1]["$sort"])
+        self.assertListEqual(["$name", "$director"], pipeline[2]["$group"]["_id"])
@@ -0,0 +1,48 @@
+import asyncio
+import unittest
+
+from app.db.loader import BatchLoader
+
+
+class BatchLoaderTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.batches = []
+
+        async def batch_fn(keys):
+            self.batches.append(keys)
+            return {key: key.upper() for key in keys if key != "missing"}
+
+        self.loader = BatchLoader(batch_fn, max_batch_size=3)
+
+    def test_one_query_per_tick(self):
+        async def run():
+            return await asyncio.gather(self.loader.load("a"), self.loader.load("b"), self.loader.load("a"),
+                                        self.loader.load("missing"))
+
+        self.assertListEqual(["A", "B", "A", None], asyncio.run(run()))
+        self.assertListEqual([["a", "b", "missing"]], self.batches)
+
+    def test_max_batch_size(self):
+        values = asyncio.run(self.loader.load_many(["a", "b", "c", "d"]))
+        self.assertListEqual(["A", "B", "C", "D"], values)
+        self.assertListEqual([["a", "b", "c"], ["d"]], self.batches)
+
+    def test_later_ticks_are_new_batches(self):
+        async def run():
+            first = await self.loader.load("a")
+            second = await self.loader.load("a")
+            return first, second
+
+        self.assertTupleEqual(("A", "A"), asyncio.run(run()))
+        self.assertListEqual([["a"], ["a"]], self.batches)
+
+    def test_errors_reach_every_caller(self):
+        async def failing(keys):
+            raise RuntimeError("down")
+
+        loader = BatchLoader(failing)
+
+        async def run():
+            return await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in asyncio.run(run())))
@@ -51,7 +51,8 @@ class DirectorsTestCases(unittest.TestCase):
             ],
             "count": 5,
             "size": 10,
-            "page": 1
+            "page": 1,
+            "next_cursor": None
         }
         response = self.client.request(method="get", url="/directors")
         self.assertEqual(200, response.status_code)
@@ -71,7 +72,8 @@ class DirectorsTestCases(unittest.TestCase):
             ],
             "count": 5,
             "size": 10,
-            "page": 1
+            "page": 1,
+            "next_cursor": None
         }
 
         size = 20
@@ -104,6 +106,16 @@ class DirectorsTestCases(unittest.TestCase):
         if len(response.get("data")) > 0:
             self.assertIn(keyword, response.get("data")[0].get("name").lower())
 
+    def test_list_directors_by_partial_keyword(self):
+        self.test_add_directors()
+        for params in [{"keyword": "fleming 1"}, {"keyword": "FLEMING", "match": "word"},
+                       {"keyword": "test vic", "match": "prefix"}]:
+            response = self.client.request(method="get", url="/directors", params=dict(params, size=50))
+            self.assertEqual(200, response.status_code)
+            self.assertIn("test Victor Fleming 1", [director["name"] for director in response.json()["data"]], params)
+        response = self.client.request(method="get", url="/directors", params={"keyword": "fleming", "match": "prefix"})
+        self.assertNotIn("test Victor Fleming 1", [director["name"] for director in response.json()["data"]])
+
     def test_edit_director_by_id(self):
         list_of_added_directors = self.test_add_directors()
         uid = list_of_added_directors[0].get("uid")
@@ -120,4 +132,33 @@ class DirectorsTestCases(unittest.TestCase):
             response = self.client.request(method="delete", url=f"/directors/{uid}", headers={"access-token": self.access_token})
             self.assertEqual(200, response.status_code)
             response = response.json()
-            self.assertEqual(uid, response.get("uid"))
\ No newline at end of file
+            self.assertEqual(uid, response.get("uid"))
+
+    def test_get_director_by_id(self):
+        director = self.test_add_directors()[0]
+        movies = [{"name": f"test rollup movie {i}", "imdb_score": score, "genre": ["Drama"],
+                   "director": director["name"], "popularity": popularity}
+                  for i, (score, popularity) in enumerate([(7.0, 60.0), (9.0, 80.0), (5.0, 70.0)])]
+        response = self.client.request(method="post", url="/movies", headers={"access-token": self.access_token}, json=movies)
+        self.assertEqual(200, response.status_code)
+
+        response = self.client.request(method="get", url=f"/directors/{director['uid']}", params={"size": 2})
+        self.assertEqual(200, response.status_code)
+        page = response.json()
+        self.assertEqual(3, page["movie_count"])
+        self.assertAlmostEqual(7.0, page["mean_imdb_score"])
+        self.assertEqual(9.0, page["max_imdb_score"])
+        self.assertAlmostEqual(210.0, page["total_popularity"])
+        self.assertListEqual(["test rollup movie 1", "test rollup movie 2"],
+                             [movie["name"] for movie in page["filmography"]])
+
+        # An update recomputes the rollup
+        uid = page["filmography"][0]["uid"]
+        response = self.client.request(method="patch", url=f"/movies/{uid}", headers={"access-token": self.access_token}, json={"director": "test another director"})
+        self.assertEqual(200, response.status_code)
+        page = self.client.request(method="get", url=f"/directors/{director['uid']}").json()
+        self.assertEqual(2, page["movie_count"])
+        self.assertEqual(7.0, page["max_imdb_score"])
+
+        response = self.client.request(method="get", url=f"/directors/{uuid.uuid4()}")
+        self.assertEqual(404, response.status_code)
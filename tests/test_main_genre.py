@@ -1,4 +1,5 @@
 import unittest
+import uuid
 
 from fastapi.testclient import TestClient
 
@@ -44,7 +45,8 @@ class GenresTestCases(unittest.TestCase):
             ],
             "count": 4,
             "size": 10,
-            "page": 1
+            "page": 1,
+            "next_cursor": None
         }
         response = self.client.request(method="get", url="/genres")
         self.assertEqual(200, response.status_code)
@@ -63,7 +65,8 @@ class GenresTestCases(unittest.TestCase):
             ],
             "count": 4,
             "size": 10,
-            "page": 1
+            "page": 1,
+            "next_cursor": None
         }
 
         size = 20
@@ -96,6 +99,20 @@ class GenresTestCases(unittest.TestCase):
         if len(response.get("data")) > 0:
             self.assertIn(keyword, response.get("data")[0].get("name").lower())
 
+    def test_list_genres_by_partial_keyword(self):
+        self.test_add_genres()
+        # Anywhere in the name by default, the start of the name with match=prefix
+        for params in [{"keyword": "genre 1"}, {"keyword": "RE 1", "match": "word"},
+                       {"keyword": "new g", "match": "prefix"}]:
+            response = self.client.request(method="get", url="/genres", params=dict(params, size=50))
+            self.assertEqual(200, response.status_code)
+            self.assertIn("New Genre 1", [genre["name"] for genre in response.json()["data"]], params)
+        response = self.client.request(method="get", url="/genres", params={"keyword": "genre", "match": "prefix"})
+        self.assertNotIn("New Genre 1", [genre["name"] for genre in response.json()["data"]])
+        # Escaped
+        response = self.client.request(method="get", url="/genres", params={"keyword": "new.*1"})
+        self.assertNotIn("New Genre 1", [genre["name"] for genre in response.json()["data"]])
+
     def test_edit_genre_by_id(self):
         list_of_added_genres = self.test_add_genres()
         genre_id = list_of_added_genres[0].get("uid")
@@ -114,3 +131,31 @@ class GenresTestCases(unittest.TestCase):
             genre_id = added_genre.get("uid")
             response = self.client.request(method="delete", url=f"/genres/{genre_id}", headers={"access-token": self.access_token})
             self.assertEqual(200, response.status_code)
+
+    def test_genre_top(self):
+        name = f"test leaderboard {uuid.uuid4()}"
+        response = self.client.request(method="post", url="/genres", headers={"access-token": self.access_token},
+                                       json=[{"name": name}])
+        genre_id = response.json()[0]["uid"]
+        movies = [{"name": f"test leaderboard movie {i}", "imdb_score": score, "genre": [name],
+                   "director": "test leaderboard director", "popularity": popularity}
+                  for i, (score, popularity) in enumerate([(7.0, 60.0), (9.0, 50.0), (5.0, 70.0)])]
+        response = self.client.request(method="post", url="/movies", headers={"access-token": self.access_token},
+                                       json=movies)
+        self.assertEqual(200, response.status_code)
+
+        response = self.client.request(method="get", url=f"/genres/{genre_id}/top")
+        self.assertEqual(200, response.status_code)
+        top = response.json()["data"]
+        self.assertListEqual([70.0, 60.0, 50.0], [movie["popularity"] for movie in top])
+        response = self.client.request(method="get", url=f"/genres/{genre_id}/top", params={"by": "imdb_score", "size": 2})
+        self.assertListEqual([9.0, 7.0], [movie["imdb_score"] for movie in response.json()["data"]])
+
+        # A delete recomputes the leaderboards of the genre
+        response = self.client.request(method="delete", url=f"/movies/{top[0]['uid']}", headers={"access-token": self.access_token})
+        self.assertEqual(200, response.status_code)
+        response = self.client.request(method="get", url=f"/genres/{genre_id}/top")
+        self.assertListEqual([60.0, 50.0], [movie["popularity"] for movie in response.json()["data"]])
+
+        response = self.client.request(method="get", url=f"/genres/{genre_id}/top", params={"by": "name"})
+        self.assertEqual(400, response.status_code)
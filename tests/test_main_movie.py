@@ -1,9 +1,12 @@
 import json
 import unittest
+import uuid
+from unittest import mock
 
 from fastapi.testclient import TestClient
 
 from app import create_app, Config
+from app.search.columnar import np
 
 
 class MoviesTestCases(unittest.TestCase):
@@ -61,7 +64,8 @@ class MoviesTestCases(unittest.TestCase):
             }],
             "count": 1,
             "size": 10,
-            "page": 1
+            "page": 1,
+            "next_cursor": None
         }
         response = self.client.request(method="get", url="/movies")
         self.assertEqual(200, response.status_code)
@@ -75,7 +79,8 @@ class MoviesTestCases(unittest.TestCase):
             "data": [],
             "count": 0,
             "size": 10,
-            "page": 1
+            "page": 1,
+            "next_cursor": None
         }
 
         size = 20
@@ -98,6 +103,78 @@ class MoviesTestCases(unittest.TestCase):
         self.assertEqual(page, response.get("page"))
         self.assertListEqual(list(expected_response.keys()), list(response.keys()))
 
+    def test_list_all_movies_cursor_pagination(self):
+        self.test_add_movies()
+        self.test_add_movies()
+        size = 1
+        response = self.client.request(method="get", url="/movies", params={"size": str(size)})
+        self.assertEqual(200, response.status_code)
+        first_page = response.json()
+        self.assertIsNotNone(first_page.get("next_cursor"))
+
+        response = self.client.request(method="get", url="/movies",
+                                       params={"size": str(size), "cursor": first_page.get("next_cursor")})
+        self.assertEqual(200, response.status_code)
+        second_page = response.json()
+        self.assertEqual(size, len(second_page.get("data")))
+        self.assertNotEqual(first_page.get("data")[0].get("uid"), second_page.get("data")[0].get("uid"))
+        self.assertGreaterEqual(first_page.get("data")[0].get("popularity"),
+                                second_page.get("data")[0].get("popularity"))
+
+        response = self.client.request(method="get", url="/movies", params={"cursor": "not-a-cursor"})
+        self.assertEqual(400, response.status_code)
+
+    def test_list_all_movies_without_count(self):
+        response = self.client.request(method="get", url="/movies", params={"with_count": "false"})
+        self.assertEqual(200, response.status_code)
+        self.assertIsNone(response.json().get("count"))
+
+    def test_search_movies_with_facets(self):
+        self.test_add_movies()
+        response = self.client.request(method="get", url="/search",
+                                       params={"genres": "Adventure", "facets": "genre,imdb_score"})
+        self.assertEqual(200, response.status_code)
+        response = response.json()
+        self.assertListEqual(["genre", "imdb_score"], list(response.get("facets").keys()))
+        self.assertIn("Adventure", [row.get("value") for row in response.get("facets").get("genre")])
+        self.assertEqual(response.get("count"), sum(row.get("count") for row in response.get("facets").get("imdb_score")))
+
+        response = self.client.request(method="get", url="/search", params={"facets": "director"})
+        self.assertEqual(400, response.status_code)
+
+    def test_list_movies_sparse_fields(self):
+        movie_id = self.test_add_movies()[0].get("uid")
+        response = self.client.request(method="get", url="/movies", params={"fields": "name,imdb_score"})
+        self.assertEqual(200, response.status_code)
+        for movie in response.json().get("data"):
+            self.assertSetEqual({"uid", "popularity", "name", "imdb_score"}, set(movie.keys()))
+
+        response = self.client.request(method="get", url=f"/movies/{movie_id}", params={"fields": "name"})
+        self.assertEqual(200, response.status_code)
+        self.assertDictEqual({"uid": movie_id, "name": "The Wizard of Oz"}, response.json())
+
+        response = self.client.request(method="get", url="/search", params={"fields": "name,unknown"})
+        self.assertEqual(400, response.status_code)
+
+    def test_export_movies(self):
+        self.test_add_movies()
+        response = self.client.request(method="get", url="/movies/export", params={"batch_size": 1})
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.headers["content-type"].startswith("application/x-ndjson"))
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertTrue(len(lines) > 0)
+        self.assertIn("The Wizard of Oz", [movie.get("name") for movie in lines])
+
+        response = self.client.request(method="get", url="/movies/export",
+                                       params={"format": "csv", "fields": "name,genre", "keyword": "wizard"})
+        self.assertEqual(200, response.status_code)
+        rows = response.text.splitlines()
+        self.assertEqual("uid,name,genre", rows[0])
+        self.assertIn("The Wizard of Oz", rows[1])
+
+        response = self.client.request(method="get", url="/movies/export", params={"format": "xml"})
+        self.assertEqual(400, response.status_code)
+
     def test_list_all_movies_by_keyword(self):
         keyword = "star war"
         response = self.client.request(method="get", url="/movies", params={"keyword": keyword})
@@ -108,6 +185,17 @@ class MoviesTestCases(unittest.TestCase):
         if len(response.get("data")) > 0:
             self.assertIn(keyword, response.get("data")[0].get("name").lower())
 
+    def test_get_movie_by_id_conditional(self):
+        movie_id = self.test_add_movies()[0].get("uid")
+        response = self.client.request(method="get", url=f"/movies/{movie_id}")
+        self.assertEqual(200, response.status_code)
+        etag = response.headers.get("etag")
+        self.assertIsNotNone(etag)
+        self.assertIsNotNone(response.headers.get("last-modified"))
+
+        response = self.client.request(method="get", url=f"/movies/{movie_id}", headers={"If-None-Match": etag})
+        self.assertEqual(304, response.status_code)
+
     def test_edit_movie_by_id(self):
         list_of_added_movies = self.test_add_movies()
         movie_id = list_of_added_movies[0].get("uid")
@@ -136,3 +224,154 @@ class MoviesTestCases(unittest.TestCase):
             response = self.client.request(method="delete", url=f"/movies/{movie_id}",
                                            headers={"access-token": self.access_token})
             self.assertEqual(200, response.status_code)
+
+    def test_bulk_movies(self):
+        headers = {"access-token": self.access_token}
+        new_movies = [{"popularity": 80.0, "director": "Bulk Director", "genre": ["Drama"], "imdb_score": 7.0,
+                       "name": f"Bulk movie {i}"} for i in range(3)]
+        new_movies.append({"name": "missing fields"})
+        response = self.client.request(method="post", url="/movies/bulk", headers=headers, json=new_movies)
+        self.assertEqual(200, response.status_code)
+        response = response.json()
+        self.assertDictEqual({"created": 3, "invalid": 1}, response["counts"])
+        self.assertEqual("invalid", response["results"][3]["status"])
+        uids = [result["uid"] for result in response["results"][:3]]
+
+        changes = [{"uid": uids[0], "imdb_score": 7.5}, {"uid": "unknown", "imdb_score": 1.0},
+                   {"uid": uids[1], "imdb_score": "high"}]
+        response = self.client.request(method="patch", url="/movies/bulk", headers=headers, json=changes)
+        self.assertEqual(200, response.status_code)
+        self.assertListEqual(["updated", "not_found", "invalid"],
+                             [result["status"] for result in response.json()["results"]])
+        response = self.client.request(method="get", url=f"/movies/{uids[0]}")
+        self.assertEqual(7.5, response.json()["imdb_score"])
+
+        response = self.client.request(method="delete", url="/movies/bulk", headers=headers, json=uids + ["unknown"])
+        self.assertEqual(200, response.status_code)
+        self.assertDictEqual({"deleted": 3, "not_found": 1}, response.json()["counts"])
+
+    def test_patch_movie_if_match(self):
+        headers = {"access-token": self.access_token}
+        movie_id = self.test_add_movies()[0].get("uid")
+        etag = self.client.request(method="get", url=f"/movies/{movie_id}").headers["etag"]
+
+        response = self.client.request(method="patch", url=f"/movies/{movie_id}", headers=dict(headers, **{"If-Match": etag}),
+                                       json={"imdb_score": 9.1})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(9.1, response.json()["imdb_score"])
+        self.assertEqual("The Wizard of Oz", response.json()["name"])
+        self.assertNotEqual(etag, response.headers["etag"])
+
+        response = self.client.request(method="patch", url=f"/movies/{movie_id}", headers=dict(headers, **{"If-Match": etag}),
+                                       json={"imdb_score": 1.0})
+        self.assertEqual(412, response.status_code)
+        response = self.client.request(method="delete", url=f"/movies/{movie_id}", headers=dict(headers, **{"If-Match": etag}))
+        self.assertEqual(412, response.status_code)
+
+        response = self.client.request(method="patch", url=f"/movies/{movie_id}", headers=headers, json={"uid": "x"})
+        self.assertEqual(400, response.status_code)
+        response = self.client.request(method="patch", url="/movies/unknown", headers=headers, json={"imdb_score": 1.0})
+        self.assertEqual(404, response.status_code)
+
+    def test_batch_get_movies(self):
+        uids = [movie.get("uid") for movie in self.test_add_movies() + self.test_add_movies()]
+        response = self.client.request(method="get", url="/movies", params={"ids": ",".join(uids[::-1] + ["unknown"])})
+        self.assertEqual(200, response.status_code)
+        response = response.json()
+        self.assertListEqual(uids[::-1], [movie["uid"] for movie in response["data"]])
+        self.assertListEqual(["unknown"], response["missing"])
+
+        response = self.client.request(method="post", url="/movies/batch-get", params={"fields": "name"},
+                                       json={"ids": uids})
+        self.assertEqual(200, response.status_code)
+        self.assertSetEqual({"uid", "name"}, set(response.json()["data"][0]))
+
+    @unittest.skipIf(np is None, "numpy is not installed")
+    def test_similar_movies(self):
+        # Genres of this run only, so that no other movie is related
+        genres = [f"test similar {uuid.uuid4().hex}" for _ in range(2)]
+        movies = [{"name": "test similar base", "director": "test similar director", "genre": genres,
+                   "imdb_score": 8.0, "popularity": 50.0},
+                  {"name": "test similar twin", "director": "test similar director", "genre": genres,
+                   "imdb_score": 8.1, "popularity": 55.0},
+                  {"name": "test similar genre", "director": "someone else", "genre": genres[:1],
+                   "imdb_score": 3.0, "popularity": 5.0}]
+        # The catalog is loaded at startup, the lists are then computed on writes
+        with mock.patch.object(Config, "SIMILAR_MOVIES_ENABLED", True), \
+                TestClient(create_app(self.test_config)) as client:
+            response = client.request(method="post", url="/movies", headers={"access-token": self.access_token},
+                                      json=movies)
+            self.assertEqual(200, response.status_code)
+            uids = [movie["uid"] for movie in response.json()]
+            response = client.request(method="get", url=f"/movies/{uids[0]}/similar")
+        self.assertEqual(200, response.status_code)
+        response = response.json()
+        self.assertEqual(uids[0], response["uid"])
+        self.assertListEqual(uids[1:], [movie["uid"] for movie in response["data"]])
+        scores = [movie["similarity"] for movie in response["data"]]
+        self.assertListEqual(sorted(scores, reverse=True), scores)
+        self.assertGreater(scores[0], 0.9)
+
+        response = self.client.request(method="get", url="/movies/unknown/similar")
+        self.assertEqual(404, response.status_code)
+
+    def test_suggest(self):
+        prefix = f"zq{uuid.uuid4().hex[:8]}"
+        movies = [{"name": f"{prefix} {name}", "director": "Victor Fleming", "genre": ["Drama"], "imdb_score": 7.0,
+                   "popularity": popularity} for name, popularity in [("Alpha", 10.0), ("Beta", 90.0), ("Gamma", 50.0)]]
+        # The index is loaded at startup, then kept up to date by the writes
+        with mock.patch.object(Config, "SUGGEST_ENABLED", True), TestClient(create_app(self.test_config)) as client:
+            response = client.request(method="post", url="/movies", headers={"access-token": self.access_token},
+                                      json=movies)
+            self.assertEqual(200, response.status_code)
+            response = client.request(method="get", url="/suggest", params={"q": prefix.upper()})
+            self.assertEqual(200, response.status_code)
+            # Most popular first
+            self.assertListEqual([("movie", f"{prefix} {name}") for name in ("Beta", "Gamma", "Alpha")],
+                                 [(item["kind"], item["name"]) for item in response.json()["data"]])
+            response = client.request(method="get", url="/suggest", params={"q": f"{prefix} g", "size": 1})
+            self.assertListEqual([f"{prefix} Gamma"], [item["name"] for item in response.json()["data"]])
+
+            response = client.request(method="get", url="/suggest", params={"q": "a", "size": 1000})
+            self.assertEqual(400, response.status_code)
+
+        # Disabled by default
+        response = self.client.request(method="get", url="/suggest", params={"q": prefix})
+        self.assertEqual(503, response.status_code)
+
+    def test_search_keyword_matches(self):
+        movie = self.test_add_movies()[0]
+        for match, keyword in [("word", "wizard"), ("phrase", "WIZARD OF"), ("prefix", "the wiz"),
+                               ("regex", "^the w.*z$")]:
+            response = self.client.request(method="get", url="/search",
+                                           params={"keyword": keyword, "match": match, "size": 50})
+            self.assertEqual(200, response.status_code, match)
+            self.assertIn(movie["name"], [item["name"] for item in response.json()["data"]], match)
+        # Escaped unless match=regex
+        response = self.client.request(method="get", url="/search", params={"keyword": "wiz.*", "match": "prefix"})
+        self.assertEqual(0, response.json()["count"])
+
+        # Stop words are words too
+        response = self.client.request(method="post", url="/movies", headers={"access-token": self.access_token},
+                                       json=[{"name": "It", "director": "Andy Muschietti", "genre": ["Horror"],
+                                             "imdb_score": 7.3, "popularity": 73.0}])
+        self.assertEqual(200, response.status_code)
+        for match in ("word", "phrase"):
+            response = self.client.request(method="get", url="/search",
+                                           params={"keyword": "it", "match": match, "size": 50})
+            self.assertIn("It", [item["name"] for item in response.json()["data"]], match)
+
+        response = self.client.request(method="get", url="/search", params={"keyword": "(wiz", "match": "regex"})
+        self.assertEqual(400, response.status_code)
+        response = self.client.request(method="get", url="/search", params={"keyword": "wiz", "match": "glob"})
+        self.assertEqual(400, response.status_code)
+
+    def test_fuzzy_search(self):
+        movie = self.test_add_movies()[0]
+        # Without the trigram index fuzzy=true is a regular keyword search
+        params = {"keyword": "Wizard of Oz", "fuzzy": "true", "size": 50}
+        if Config.FUZZY_SEARCH_ENABLED:
+            params["keyword"] = "wizzard of oz"
+        response = self.client.request(method="get", url="/search", params=params)
+        self.assertEqual(200, response.status_code)
+        self.assertIn(movie["name"], [item["name"] for item in response.json()["data"]])
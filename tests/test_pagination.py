@@ -0,0 +1,60 @@
+import unittest
+
+from fastapi import HTTPException
+
+from app.db.query import CountCache
+from app.main.utils import decode_cursor, encode_cursor, keyset_query, page_of_hits
+from app.models.movie import Genre, Movie
+
+
+class CursorTestCases(unittest.TestCase):
+    def test_round_trip(self):
+        cursor = encode_cursor(83.0, "some-uid")
+        self.assertNotIn("=", cursor)
+        self.assertListEqual([83.0, "some-uid"], decode_cursor(cursor))
+
+    def test_invalid_cursor(self):
+        for cursor in ["not-a-cursor", encode_cursor(1, 2, 3), encode_cursor("x")]:
+            with self.assertRaises(HTTPException) as ctx:
+                decode_cursor(cursor)
+            self.assertEqual(400, ctx.exception.status_code)
+
+    def test_keyset_query_descending(self):
+        query = keyset_query(Movie.popularity, Movie.uid, encode_cursor(83.0, "abc"), descending=True)
+        self.assertDictEqual({"$or": ({"popularity": {"$lt": 83.0}},
+                                      {"$and": ({"popularity": {"$eq": 83.0}}, {"uid": {"$gt": "abc"}})})},
+                             dict(query))
+
+    def test_page_of_hits(self):
+        hits = [(str(i), 1.0) for i in range(5)]
+        uids, cursor = page_of_hits(hits, size=2, page=1, cursor="")
+        self.assertListEqual(["0", "1"], uids)
+        uids, cursor = page_of_hits(hits, size=2, page=1, cursor=cursor)
+        self.assertListEqual(["2", "3"], uids)
+        uids, cursor = page_of_hits(hits, size=2, page=1, cursor=cursor)
+        self.assertListEqual(["4"], uids)
+        self.assertIsNone(cursor)
+
+
+class CountCacheTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = CountCache(max_size=2)
+
+    def test_invalidate_drops_model_entries_only(self):
+        self.cache.set(Movie, "a", 1, self.cache.generation(Movie))
+        self.cache.set(Genre, "a", 2, self.cache.generation(Genre))
+        self.cache.invalidate(Movie)
+        self.assertIsNone(self.cache.get(Movie, "a"))
+        self.assertEqual(2, self.cache.get(Genre, "a"))
+
+    def test_stale_generation_is_not_stored(self):
+        generation = self.cache.generation(Movie)
+        self.cache.invalidate(Movie)
+        self.cache.set(Movie, "a", 1, generation)
+        self.assertIsNone(self.cache.get(Movie, "a"))
+
+    def test_size_bound(self):
+        for key in ["a", "b", "c"]:
+            self.cache.set(Movie, key, 1, self.cache.generation(Movie))
+        self.assertIsNone(self.cache.get(Movie, "a"))
+        self.assertEqual(1, self.cache.get(Movie, "c"))
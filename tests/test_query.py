@@ -0,0 +1,141 @@
+import asyncio
+import json
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.config import Config
+from app.db.keywords import CASE_INSENSITIVE, command_options, keyword_match, keyword_query
+from app.db import query
+from app.db.query import CountCache, parse_fields
+from app.db.records import dumps, record_type
+from app.main import utils
+from app.main.routers import batch_get
+from app.main.utils import csv_row, search_queries
+from app.models.movie import Movie
+
+
+class SparseFieldsTestCases(unittest.TestCase):
+    def test_no_fields(self):
+        self.assertIsNone(parse_fields(Movie, ""))
+        self.assertIsNone(parse_fields(Movie, " , "))
+
+    def test_projection_always_has_uid(self):
+        self.assertDictEqual({"_id": False, "uid": True, "name": True, "imdb_score": True},
+                             parse_fields(Movie, "name, imdb_score"))
+        self.assertDictEqual({"_id": True, "uid": True, "popularity": True, "name": True},
+                             parse_fields(Movie, "id,name", required=("uid", "popularity")))
+
+    def test_unknown_fields(self):
+        with self.assertRaises(HTTPException) as ctx:
+            parse_fields(Movie, "name,password")
+        self.assertEqual(400, ctx.exception.status_code)
+        self.assertIn("password", ctx.exception.detail)
+
+
+class RecordTestCases(unittest.TestCase):
+    def test_record_from_document(self):
+        object_id = ObjectId()
+        record = record_type(Movie)({"_id": object_id, "uid": "a", "name": "The Wizard of Oz", "extra": 1})
+        self.assertEqual("a", record.uid)
+        self.assertFalse(hasattr(record, "popularity"))
+        self.assertDictEqual({"uid": "a", "name": "The Wizard of Oz", "id": str(object_id)}, record.to_dict())
+        self.assertIs(record_type(Movie), type(record))
+
+    def test_dumps(self):
+        record = record_type(Movie)({"uid": "a", "created_at": datetime(2021, 5, 1, 12, 30, 0, 5)})
+        body = dumps({"data": [record], "count": 1, "next_cursor": None})
+        self.assertDictEqual({"data": [{"uid": "a", "created_at": "2021-05-01T12:30:00.000005"}],
+                              "count": 1, "next_cursor": None}, json.loads(body))
+
+
+class BatchGetTestCases(unittest.TestCase):
+    def test_records_are_serialized(self):
+        async def find_movies_by_uids(uids, projection=None):
+            return [record_type(Movie)({"uid": "a", "name": "The Wizard of Oz"})]
+
+        with mock.patch.object(utils, "find_movies_by_uids", find_movies_by_uids):
+            response = asyncio.run(batch_get(ids=["a", "b"], fields="name"))
+        self.assertEqual(200, response.status_code)
+        self.assertDictEqual({"data": [{"uid": "a", "name": "The Wizard of Oz"}], "missing": ["b"]},
+                             json.loads(response.body))
+
+
+class CountCacheTestCases(unittest.TestCase):
+    def test_entries_expire(self):
+        cache = CountCache(max_size=2, ttl=60)
+        cache.set(Movie, "a", 1, cache.generation(Movie))
+        self.assertEqual(1, cache.get(Movie, "a"))
+        with mock.patch.object(query.time, "monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get(Movie, "a"))
+        self.assertDictEqual({}, cache.entries)
+
+
+class KeywordQueryTestCases(unittest.TestCase):
+    def test_word(self):
+        queries, options = keyword_query("name", "star -war (", "word", text_index=True)
+        self.assertListEqual([{"$text": {"$search": "star war"}},
+                              {"name": {"$regex": "star|war", "$options": "i"}}], queries)
+        self.assertDictEqual({}, options)
+        queries, _ = keyword_query("name", "?!", "word", text_index=True)
+        self.assertListEqual([{"name": {"$in": []}}], queries)
+
+    def test_phrase(self):
+        queries, options = keyword_query("name", ' Star  "Wars.* ', "phrase", text_index=True)
+        self.assertListEqual([{"$text": {"$search": '"Star Wars.*"'}},
+                              {"name": {"$regex": r"Star\ Wars\.\*", "$options": "i"}}], queries)
+        self.assertDictEqual({}, options)
+
+    def test_without_text_index(self):
+        queries, options = keyword_query("name", " Peter  Jackson.* ", "phrase")
+        self.assertListEqual([{"name": {"$regex": r"Peter\ Jackson\.\*", "$options": "i"}}], queries)
+        self.assertDictEqual({}, options)
+        queries, options = keyword_query("name", " Sci-Fi  act ", "word")
+        self.assertListEqual([{"name": {"$regex": r"Sci\-Fi|act", "$options": "i"}}], queries)
+        self.assertDictEqual({}, options)
+
+    def test_prefix(self):
+        queries, options = keyword_query("name", "Mus.*", "prefix", text_index=True)
+        self.assertListEqual([{"name": {"$gte": "Mus.*", "$lt": "Mus.*\uffff"}}], queries)
+        self.assertDictEqual({"collation": CASE_INSENSITIVE}, options)
+
+    def test_regex(self):
+        queries, options = keyword_query("name", "^star (wars|trek)$", "regex")
+        self.assertListEqual([{"name": {"$regex": "^star (wars|trek)$", "$options": "i"}}], queries)
+        self.assertDictEqual({"max_time_ms": Config.REGEX_MAX_TIME_MS}, options)
+        self.assertDictEqual({"maxTimeMS": Config.REGEX_MAX_TIME_MS, "collation": CASE_INSENSITIVE},
+                             command_options({"max_time_ms": Config.REGEX_MAX_TIME_MS, "collation": CASE_INSENSITIVE}))
+        with self.assertRaises(HTTPException) as ctx:
+            keyword_query("name", "(star", "regex")
+        self.assertEqual(400, ctx.exception.status_code)
+
+    def test_keyword_match(self):
+        self.assertEqual("word", keyword_match(""))
+        self.assertEqual("phrase", keyword_match("", phrase_match=True))
+        self.assertEqual("prefix", keyword_match("prefix", phrase_match=True))
+        with self.assertRaises(HTTPException) as ctx:
+            keyword_match("glob")
+        self.assertEqual(400, ctx.exception.status_code)
+
+
+class ExportTestCases(unittest.TestCase):
+    def test_search_queries(self):
+        queries, options = search_queries("  ", [], 0.0, 10.0, "word")
+        self.assertListEqual([{"imdb_score": {"$gte": 0.0}}, {"imdb_score": {"$lte": 10.0}}],
+                             [dict(query) for query in queries])
+        self.assertDictEqual({}, options)
+        queries, options = search_queries("star war", ["Family"], 2.0, 8.0, "word")
+        self.assertDictEqual({"$text": {"$search": "star war"}}, queries[0])
+        self.assertDictEqual({"genre": {"$in": ["Family"]}}, dict(queries[2]))
+        queries, options = search_queries("star", [], 0.0, 10.0, "prefix")
+        self.assertDictEqual({"collation": CASE_INSENSITIVE}, options)
+
+    def test_csv_row(self):
+        object_id = ObjectId()
+        row = csv_row({"_id": object_id, "genre": ["Adventure", " Family"], "created_at": datetime(2021, 5, 1)})
+        self.assertDictEqual({"id": object_id, "genre": "Adventure|Family", "created_at": "2021-05-01T00:00:00"},
+                             row)
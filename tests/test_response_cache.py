@@ -0,0 +1,147 @@
+import asyncio
+import json
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from fastapi import HTTPException, Request
+
+from app.main import cache
+from app.main.cache import ResponseCache, cached_response, if_match_versions, item_tag, new_version
+from app.models.movie import Genre, Movie
+
+
+def conditional_request(**headers):
+    return Request({"type": "http", "headers": [(name.replace("_", "-").encode(), value.encode())
+                                                for name, value in headers.items()]})
+
+
+class ResponseCacheTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = ResponseCache(max_size=2, ttl=60)
+        self.calls = 0
+
+        @cached_response(self.cache, Movie)
+        async def list_movies(request=None, keyword: str = "", size: int = 10):
+            self.calls += 1
+            return {"data": [keyword], "size": size}
+
+        self.list_movies = list_movies
+
+    def test_hit_after_miss(self):
+        first = asyncio.run(self.list_movies(request=None, keyword="oz"))
+        second = asyncio.run(self.list_movies(keyword="oz", size=10))
+        self.assertEqual(1, self.calls)
+        self.assertEqual(first.body, second.body)
+        self.assertDictEqual({"data": ["oz"], "size": 10}, json.loads(second.body))
+        self.assertEqual(1, self.cache.stats["hits"])
+        self.assertEqual(1, self.cache.stats["misses"])
+
+    def test_invalidate_per_model(self):
+        asyncio.run(self.list_movies(keyword="oz"))
+        self.cache.invalidate(Genre)
+        asyncio.run(self.list_movies(keyword="oz"))
+        self.assertEqual(1, self.calls)
+        self.cache.invalidate(Movie)
+        asyncio.run(self.list_movies(keyword="oz"))
+        self.assertEqual(2, self.calls)
+
+    def test_ttl_and_lru(self):
+        self.cache.ttl = -1
+        asyncio.run(self.list_movies(keyword="oz"))
+        asyncio.run(self.list_movies(keyword="oz"))
+        self.assertEqual(2, self.calls)
+
+        self.cache.ttl = 60
+        self.cache.clear()
+        for keyword in ["a", "b", "c"]:
+            asyncio.run(self.list_movies(keyword=keyword))
+        self.assertEqual(2, len(self.cache.entries))
+        self.assertEqual(1, self.cache.stats["evictions"])
+
+    def test_write_during_miss_is_not_cached(self):
+        @cached_response(self.cache, Movie)
+        async def racing_read():
+            self.cache.invalidate(Movie)
+            return {"data": []}
+
+        asyncio.run(racing_read())
+        self.assertEqual(0, len(self.cache.entries))
+
+
+class ConditionalGetTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = ResponseCache(max_size=10, ttl=60)
+        self.version = 1
+
+        @cached_response(self.cache, Movie)
+        async def list_movies(request=None, keyword: str = ""):
+            return {"data": [keyword], "v": self.version}
+
+        @cached_response(self.cache, Movie)
+        async def get_movie_by_id(movie_id, request=None):
+            return {"uid": movie_id}
+
+        self.list_movies = list_movies
+        self.get_movie_by_id = get_movie_by_id
+
+    def test_list_etag_changes_with_body(self):
+        response = asyncio.run(self.list_movies(request=None))
+        etag = response.headers["etag"]
+
+        response = asyncio.run(self.list_movies(request=conditional_request(if_none_match=etag)))
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b"", response.body)
+
+        response = asyncio.run(self.list_movies(request=conditional_request(if_none_match=f'W/{etag}, "x"')))
+        self.assertEqual(304, response.status_code)
+
+        # A write this process does not know about (another worker, the importer) shows once the TTL expires
+        self.version = 2
+        with mock.patch.object(cache.time, "monotonic", return_value=time.monotonic() + 61):
+            response = asyncio.run(self.list_movies(request=conditional_request(if_none_match=etag)))
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response.headers["etag"])
+        self.assertEqual(2, json.loads(response.body)["v"])
+
+    def test_list_etag_survives_unrelated_write(self):
+        etag = asyncio.run(self.list_movies(request=None)).headers["etag"]
+        self.cache.invalidate(Movie)
+        response = asyncio.run(self.list_movies(request=conditional_request(if_none_match=etag)))
+        self.assertEqual(304, response.status_code)
+
+    def test_list_has_no_last_modified(self):
+        response = asyncio.run(self.list_movies(request=None))
+        self.assertNotIn("last-modified", response.headers)
+        response = asyncio.run(self.list_movies(
+            request=conditional_request(if_modified_since="Fri, 01 Jan 2100 00:00:00 GMT")))
+        self.assertEqual(200, response.status_code)
+
+    def test_item_etag_from_body(self):
+        etag = asyncio.run(self.get_movie_by_id("a", request=None)).headers["etag"]
+        response = asyncio.run(self.get_movie_by_id("a", request=conditional_request(if_none_match=etag)))
+        self.assertEqual(304, response.status_code)
+        response = asyncio.run(self.get_movie_by_id("b", request=conditional_request(if_none_match=etag)))
+        self.assertEqual(200, response.status_code)
+
+
+class VersionTestCases(unittest.TestCase):
+    def test_if_match_round_trip(self):
+        modified_at = new_version()
+        self.assertEqual(0, modified_at.microsecond % 1000)
+        for etag in [item_tag(modified_at), item_tag(modified_at, "_id", "name")]:
+            self.assertListEqual([modified_at], if_match_versions(conditional_request(if_match=etag)))
+        versions = if_match_versions(conditional_request(if_match=f'{item_tag(datetime(2021, 5, 1))}, "x", W/"1"'))
+        self.assertListEqual([datetime(2021, 5, 1)], versions)
+
+    def test_no_precondition(self):
+        self.assertIsNone(if_match_versions(None))
+        self.assertIsNone(if_match_versions(conditional_request()))
+        self.assertIsNone(if_match_versions(conditional_request(if_match="*")))
+
+    def test_unusable_if_match(self):
+        for if_match in ['"abc"', 'W/"1"']:
+            with self.assertRaises(HTTPException) as ctx:
+                if_match_versions(conditional_request(if_match=if_match))
+            self.assertEqual(412, ctx.exception.status_code)
@@ -0,0 +1,49 @@
+import time
+import unittest
+from datetime import datetime, timedelta
+
+from app.auth.revocation import BloomFilter, RevocationList
+
+
+class BloomFilterTestCases(unittest.TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        keys = [f"jti-{i}" for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"jti-{i}")
+        false_positives = sum(f"other-{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class RevocationListTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.revocations = RevocationList(capacity=100)
+        self.expires_at = datetime.utcnow() + timedelta(minutes=30)
+
+    def test_unknown_token_is_not_revoked(self):
+        self.assertFalse(self.revocations.check({"sub": "a@b.c", "jti": "x", "iat": time.time()}))
+        self.assertFalse(self.revocations.check({"sub": "a@b.c"}))
+
+    def test_revoked_jti_needs_confirmation(self):
+        self.revocations._add({"jti": "x", "sub": "a@b.c", "expires_at": self.expires_at})
+        self.assertIsNone(self.revocations.check({"sub": "a@b.c", "jti": "x"}))
+        self.revocations.confirmed["x"] = time.time() + 60
+        self.assertTrue(self.revocations.check({"sub": "a@b.c", "jti": "x"}))
+
+    def test_user_cutoff(self):
+        cutoff = time.time()
+        self.revocations._add({"sub": "a@b.c", "cutoff": cutoff, "expires_at": self.expires_at})
+        self.assertTrue(self.revocations.check({"sub": "a@b.c", "jti": "old", "iat": cutoff - 10}))
+        self.assertTrue(self.revocations.check({"sub": "a@b.c"}))
+        self.assertFalse(self.revocations.check({"sub": "a@b.c", "jti": "new", "iat": cutoff + 1}))
+        self.assertFalse(self.revocations.check({"sub": "x@y.z", "jti": "old", "iat": cutoff - 10}))
+
+        # an older cutoff never replaces a newer one
+        self.revocations._add({"sub": "a@b.c", "cutoff": cutoff - 100, "expires_at": self.expires_at})
+        self.assertEqual(cutoff, self.revocations.cutoffs["a@b.c"][0])
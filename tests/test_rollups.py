@@ -0,0 +1,72 @@
+import asyncio
+import unittest
+
+from app.config import Config
+from app.db.rollups import DIRECTOR_STATS, GENRE_TOP, add_to_director_stats, add_to_genre_top, director_view
+from app.db.rollups import directors_of, genres_of, movie_summary
+from app.models.movie import Movie
+from tests.fakes import FakeCollection
+
+
+def movie(uid, director, imdb_score, popularity, genre=("Drama",)):
+    return Movie(uid=uid, name=f"movie {uid}", imdb_score=imdb_score, genre=list(genre), director=director,
+                 popularity=popularity)
+
+
+class DirectorStatsTestCases(unittest.TestCase):
+    def test_add_is_one_upsert_per_director(self):
+        database = {DIRECTOR_STATS: FakeCollection()}
+        movies = [movie("a", "Lucas", 7.0, 60.0), movie("b", "Lucas", 9.0, 80.0), movie("c", "Fleming", 8.0, 50.0)]
+        asyncio.run(add_to_director_stats(database, movies))
+
+        requests = {request._filter["_id"]: request._doc for request in database[DIRECTOR_STATS].requests}
+        self.assertSetEqual({"Lucas", "Fleming"}, set(requests))
+        update = requests["Lucas"]
+        self.assertDictEqual({"count": 2, "sum_imdb_score": 16.0, "total_popularity": 140.0}, update["$inc"])
+        self.assertDictEqual({"max_imdb_score": 9.0}, update["$max"])
+        self.assertEqual(Config.FILMOGRAPHY_SIZE, update["$push"]["top"]["$slice"])
+        self.assertListEqual(["a", "b"], [summary["uid"] for summary in update["$push"]["top"]["$each"]])
+
+    def test_summary_and_keys(self):
+        self.assertDictEqual({"uid": "a", "name": "movie a", "imdb_score": 7.0, "popularity": 60.0, "genre": ["Drama"]},
+                             movie_summary(movie("a", "Lucas", 7.0, 60.0)))
+        self.assertSetEqual({"Lucas", "Fleming"},
+                            directors_of([{"director": "Lucas"}, movie("c", "Fleming", 8.0, 50.0), {"uid": "x"}]))
+
+    def test_director_view(self):
+        director = {"uid": "d", "name": "Lucas"}
+        stats = {"count": 2, "sum_imdb_score": 16.0, "max_imdb_score": 9.0, "total_popularity": 140.0,
+                 "top": [{"uid": "b"}, {"uid": "a"}]}
+        view = director_view(director, stats, size=1)
+        self.assertEqual(8.0, view["mean_imdb_score"])
+        self.assertEqual(9.0, view["max_imdb_score"])
+        self.assertListEqual([{"uid": "b"}], view["filmography"])
+
+        view = director_view(director, None, size=10)
+        self.assertEqual(0, view["movie_count"])
+        self.assertIsNone(view["mean_imdb_score"])
+        self.assertListEqual([], view["filmography"])
+
+
+class GenreTopTestCases(unittest.TestCase):
+    def test_add_pushes_to_both_leaderboards(self):
+        database = {GENRE_TOP: FakeCollection()}
+        movies = [movie("a", "Lucas", 7.0, 60.0, ["Drama", "Adventure"]), movie("b", "Lucas", 9.0, 80.0)]
+        asyncio.run(add_to_genre_top(database, movies))
+
+        requests = {request._filter["_id"]: request._doc for request in database[GENRE_TOP].requests}
+        self.assertSetEqual({"Drama", "Adventure"}, set(requests))
+        drama = requests["Drama"]["$push"]
+        self.assertSetEqual({"popularity", "imdb_score"}, set(drama))
+        self.assertDictEqual({"imdb_score": -1, "uid": 1}, drama["imdb_score"]["$sort"])
+        self.assertEqual(Config.LEADERBOARD_SIZE, drama["popularity"]["$slice"])
+        self.assertListEqual(["a", "b"], [summary["uid"] for summary in drama["popularity"]["$each"]])
+        self.assertListEqual(["a"], [summary["uid"] for summary in requests["Adventure"]["$push"]["popularity"]["$each"]])
+
+    def test_genres_of(self):
+        self.assertSetEqual({"Drama", "Adventure"},
+                            genres_of([{"genre": ["Drama"]}, movie("a", "Lucas", 7.0, 60.0, ["Adventure"]), {"uid": "x"}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from app.main import utils
+from app.search import InvertedIndex, tokenize
+
+
+MOVIES = [
+    {"uid": "1", "name": "The Wizard of Oz", "director": "Victor Fleming", "popularity": 83.0,
+     "imdb_score": 8.3, "genre": ["Adventure", " Family", " Fantasy", " Musical"]},
+    {"uid": "2", "name": "Star Wars", "director": "George Lucas", "popularity": 88.0,
+     "imdb_score": 8.8, "genre": ["Action", " Adventure", " Fantasy", " Sci-Fi"]},
+    {"uid": "3", "name": "Star Trek", "director": "J.J. Abrams", "popularity": 79.0,
+     "imdb_score": 7.9, "genre": ["Action", " Adventure", " Sci-Fi"]},
+    {"uid": "4", "name": "Wars of the Star Kings", "director": "Nobody", "popularity": 10.0,
+     "imdb_score": 3.1, "genre": ["Drama"]},
+]
+
+
+class InvertedIndexTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = InvertedIndex()
+        self.index.add_all(MOVIES)
+
+    def test_tokenize(self):
+        self.assertListEqual(["the", "wizard", "of", "oz"], tokenize("The Wizard of  Oz!"))
+        self.assertListEqual([], tokenize(None))
+
+    def test_term_query(self):
+        uids = [uid for uid, _ in self.index.search("star")]
+        self.assertSetEqual({"2", "3", "4"}, set(uids))
+        # "Star Wars" is the shorter document, so it ranks first
+        self.assertListEqual(["2", "3"], uids[:2])
+
+    def test_phrase_query(self):
+        uids = [uid for uid, _ in self.index.search("star wars", phrase=True)]
+        self.assertListEqual(["2"], uids)
+
+    def test_phrase_does_not_cross_fields(self):
+        self.assertListEqual([], self.index.search("oz victor", phrase=True))
+        self.assertListEqual(["1"], [uid for uid, _ in self.index.search("victor fleming", phrase=True)])
+
+    def test_filters(self):
+        uids = [uid for uid, _ in self.index.search("star", genres=["Sci-Fi"], min_rating=8.0)]
+        self.assertListEqual(["2"], uids)
+
+    def test_update_and_remove(self):
+        self.index.add({"uid": "2", "name": "A New Hope", "director": "George Lucas",
+                        "popularity": 88.0, "imdb_score": 8.8, "genre": []})
+        self.assertNotIn("2", [uid for uid, _ in self.index.search("wars")])
+        self.assertListEqual(["2"], [uid for uid, _ in self.index.search("hope")])
+
+        self.index.remove("2")
+        self.assertListEqual([], self.index.search("hope"))
+        self.assertNotIn("hope", self.index.postings)
+        self.assertEqual(3, len(self.index))
+
+
+class IndexFacetsTestCases(unittest.TestCase):
+    def test_index_facets(self):
+        from app.main.utils import index_facets
+        from app.search import MOVIE_INDEX
+
+        MOVIE_INDEX.add_all(MOVIES)
+        try:
+            facets = index_facets(MOVIE_INDEX.search("star"), ["genre", "imdb_score"])
+        finally:
+            MOVIE_INDEX.clear()
+        self.assertDictEqual({"value": "Action", "count": 2}, facets["genre"][0])
+        self.assertListEqual([{"from": 3, "to": 4, "count": 1}, {"from": 7, "to": 8, "count": 1},
+                              {"from": 8, "to": 9, "count": 1}], facets["imdb_score"])
+
+
+class KeepInSyncTestCases(unittest.TestCase):
+    def test_rebuilds_when_the_collections_changed(self):
+        # Unchanged, changed by another process, unchanged since, then the worker shuts down
+        versions = mock.AsyncMock(side_effect=["v0", "v1", "v1", asyncio.CancelledError()])
+        build = mock.AsyncMock()
+        with mock.patch.object(utils, "collections_version", versions), \
+                mock.patch.object(utils, "build_in_memory_indexes", build):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(utils.keep_indexes_in_sync(0, "v0"))
+        self.assertEqual(1, build.await_count)
+
+    def test_failed_check_is_retried(self):
+        versions = mock.AsyncMock(side_effect=[ConnectionError(), "v1", asyncio.CancelledError()])
+        build = mock.AsyncMock()
+        with mock.patch.object(utils, "collections_version", versions), \
+                mock.patch.object(utils, "build_in_memory_indexes", build), self.assertLogs(utils.logger):
+            with self.assertRaises(asyncio.CancelledError):
+                asyncio.run(utils.keep_indexes_in_sync(0, "v0"))
+        self.assertEqual(1, build.await_count)
+
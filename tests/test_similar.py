@@ -0,0 +1,91 @@
+import asyncio
+import random
+import unittest
+
+from app.search.columnar import ColumnarCatalog, np
+from app.search.similar import SIMILAR_MOVIES, batch_neighbours, features, refresh_similar, row_neighbours, similarity
+from tests.fakes import FakeCollection
+
+GENRES = ["Drama", "Comedy", "Family", "War", "Western"]
+
+
+def catalog_of(movies) -> ColumnarCatalog:
+    catalog = ColumnarCatalog(capacity=8)
+    catalog.add_all(movies)
+    return catalog
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class SimilarMoviesTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        rng = random.Random(3)
+        self.movies = [{"uid": f"m{i:03d}", "imdb_score": round(rng.uniform(1, 10), 1),
+                        "popularity": round(rng.uniform(0, 100), 1), "genre": rng.sample(GENRES, rng.randint(1, 2)),
+                        "director": f"d{rng.randint(0, 15)}"} for i in range(120)]
+        self.catalog = catalog_of(self.movies)
+
+    def test_similarity(self):
+        catalog = catalog_of([
+            {"uid": "a", "imdb_score": 8.0, "popularity": 50.0, "genre": ["Drama", "War"], "director": "x"},
+            {"uid": "b", "imdb_score": 8.0, "popularity": 50.0, "genre": ["Drama", "War"], "director": "x"},
+            {"uid": "c", "imdb_score": 2.0, "popularity": 1.0, "genre": ["Comedy"], "director": "y"},
+        ])
+        scores = similarity(features(catalog), np.array([0, 0]), np.array([1, 2]))
+        self.assertAlmostEqual(1.0, scores[0])
+        self.assertLess(scores[1], 0.3)
+
+    def test_batch_matches_exact_when_the_window_covers_everything(self):
+        slots, scores = batch_neighbours(self.catalog, k=5, window=len(self.movies))
+        for slot in range(len(self.movies)):
+            exact_slots, exact_scores = row_neighbours(features(self.catalog), slot, 5)
+            np.testing.assert_allclose(exact_scores, scores[slot][:len(exact_scores)])
+            self.assertNotIn(slot, slots[slot].tolist())
+
+    def test_small_window_is_close(self):
+        _, exact = batch_neighbours(self.catalog, k=5, window=len(self.movies))
+        _, windowed = batch_neighbours(self.catalog, k=5, window=10)
+        self.assertTrue((windowed <= exact + 1e-9).all())
+        self.assertGreater(windowed.mean(), 0.95 * exact.mean())
+
+    def test_refresh_recomputes_the_affected_lists(self):
+        slots, scores = batch_neighbours(self.catalog, k=5, window=len(self.movies))
+        collection = FakeCollection([{"_id": self.catalog.uids[slot],
+                                      "uids": [self.catalog.uids[s] for s in slots[slot].tolist()],
+                                      "scores": scores[slot].tolist()} for slot in range(len(self.movies))])
+        deleted = collection.by_id()["m000"]["uids"][0]
+        listing = [doc["_id"] for doc in collection.documents if deleted in doc["uids"]]
+        self.catalog.remove(deleted)
+        twin = dict(self.movies[0], uid="twin")
+        self.catalog.add(twin)
+
+        asyncio.run(refresh_similar({SIMILAR_MOVIES: collection}, self.catalog, written=["twin"], deleted=[deleted]))
+        lists = collection.by_id()
+        self.assertNotIn(deleted, lists)
+        for uid in listing:
+            self.assertNotIn(deleted, lists[uid]["uids"])
+        self.assertEqual("m000", lists["twin"]["uids"][0])
+        # The new movie made it into the list of its twin
+        self.assertEqual("twin", lists["m000"]["uids"][0])
+
+    def test_features_are_a_snapshot(self):
+        columns = features(self.catalog)
+        removed = self.catalog.slots["m001"]
+        self.catalog.remove("m001")
+        # Reuses the slot of m001, then grows the columns
+        self.catalog.add_all([dict(self.movies[0], uid=f"new{i}") for i in range(200)])
+        self.assertEqual("m001", columns["uids"][removed])
+        self.assertTrue(columns["alive"][removed])
+        self.assertEqual(len(self.movies), len(columns["genre_bits"]))
+        slots, _ = row_neighbours(columns, 0, 5)
+        self.assertNotIn(None, [columns["uids"][slot] for slot in slots.tolist()])
+
+    def test_refresh_is_skipped_without_every_genre(self):
+        collection = FakeCollection([])
+        self.catalog.supported = False
+        self.assertEqual(0, asyncio.run(refresh_similar({SIMILAR_MOVIES: collection}, self.catalog,
+                                                        written=["m000"])))
+        self.assertListEqual([], collection.documents)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import random
+import unittest
+from unittest import mock
+
+from app.search import suggest
+from app.search.suggest import PrefixIndex, fold, keys_of
+
+WORDS = ["Star", "Wars", "The", "Return", "King", "Night", "Amélie", "Stardust", "Lord", "Of", "Rings"]
+
+
+class PrefixIndexTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.rng = random.Random(3)
+        self.movies = {}
+        for i in range(1500):
+            self.add_movie(f"m{i}")
+        self.names = {("director", f"d{i}"): f"Director {i}" for i in range(30)}
+        self.names.update({("genre", "g0"): "Drama", ("genre", "g1"): "War", ("genre", "g2"): "Stories"})
+
+        self.index = PrefixIndex()
+        self.index.load("movie", self.movies.values())
+        for kind in ("director", "genre"):
+            self.index.load(kind, [{"uid": uid, "name": name} for (other, uid), name in self.names.items()
+                                   if other == kind])
+        self.index.finish()
+
+    def add_movie(self, uid: str) -> dict:
+        movie = self.movies[uid] = {
+            "uid": uid, "name": " ".join(self.rng.choice(WORDS) for _ in range(self.rng.randint(1, 5))),
+            # few distinct values, so that rankings have ties on popularity
+            "popularity": float(self.rng.randint(0, 30)), "director": f"Director {self.rng.randint(0, 40)}",
+            "genre": self.rng.sample(["Drama", " War", "Stories"], self.rng.randint(0, 2))}
+        return movie
+
+    def reference(self, query: str, size: int) -> list:
+        popularity = {}
+        for movie in self.movies.values():
+            for key in [("director", movie["director"])] + [("genre", genre.strip()) for genre in movie["genre"]]:
+                popularity[key] = max(popularity.get(key, 0.0), movie["popularity"])
+        entries = [("movie", uid, movie["name"], movie["popularity"]) for uid, movie in self.movies.items()]
+        entries += [(kind, uid, name, popularity.get((kind, name), 0.0)) for (kind, uid), name in self.names.items()]
+        prefix = fold(query)
+        matches = sorted((-score, name, kind, uid) for kind, uid, name, score in entries
+                         if any(key.startswith(prefix) for key in keys_of(name)))
+        return [(kind, uid) for _, _, kind, uid in matches[:min(size, suggest.TOP_SIZE)]]
+
+    def assert_matches_reference(self):
+        for query in ["s", "St", "star ", "star w", "the r", "w", "AMELIE", "amé", "director 1", "d", "lord of th",
+                      "rings", "zzz"]:
+            for size in (1, 10, 20):
+                suggestions = self.index.suggest(query, size)
+                self.assertListEqual(self.reference(query, size),
+                                     [(suggestion["kind"], suggestion["uid"]) for suggestion in suggestions])
+
+    def test_fold(self):
+        self.assertEqual("amelie poulain", fold("  Amélie -- POULAIN!"))
+        self.assertListEqual(["the lord of the rings", "lord of the rings", "of the rings", "the rings"],
+                             keys_of("The Lord of the Rings"))
+        self.assertListEqual([], keys_of(""))
+
+    def test_suggest(self):
+        self.assert_matches_reference()
+        self.assertListEqual([], self.index.suggest("", 10))
+        self.assertListEqual([], self.index.suggest("star", 0))
+
+    def test_writes(self):
+        for step in range(600):
+            choice = self.rng.random()
+            if choice < 0.4:
+                movie = self.movies[self.rng.choice(list(self.movies))]
+                movie["popularity"] = float(self.rng.randint(0, 40))
+                if self.rng.random() < 0.3:
+                    movie["name"] = self.add_movie("scratch")["name"]
+                    del self.movies["scratch"]
+                self.index.add_movies([movie])
+            elif choice < 0.7:
+                uid = self.rng.choice(list(self.movies))
+                del self.movies[uid]
+                self.index.remove("movie", uid)
+            elif choice < 0.9:
+                self.index.add_movies([self.add_movie(f"n{step}")])
+            else:
+                uid = f"d{self.rng.randint(0, 40)}"
+                if self.rng.random() < 0.3:
+                    self.names.pop(("director", uid), None)
+                    self.index.remove("director", uid)
+                else:
+                    self.names[("director", uid)] = f"Director {self.rng.randint(0, 40)}"
+                    self.index.add_names("director", [{"uid": uid, "name": self.names[("director", uid)]}])
+            if step % 200 == 0:
+                self.assert_matches_reference()
+        self.assert_matches_reference()
+
+    def test_small_blocks(self):
+        # Blocks split and empty out, cached prefixes are dropped and filled again
+        with mock.patch.multiple(suggest, BLOCK_SIZE=4, SCAN_LIMIT=8, CACHE_SIZE=6, TOP_SIZE=5):
+            self.setUp()
+            self.test_writes()
+
+
+if __name__ == '__main__':
+    unittest.main()
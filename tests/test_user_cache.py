@@ -0,0 +1,53 @@
+import time
+import unittest
+from unittest import mock
+
+from app.auth import cache
+from app.auth.cache import UserCache, invalidate_user
+from app.models.user import User
+
+
+class UserCacheTestCases(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = UserCache(max_size=2, ttl=60)
+        self.user = User(email_id="a@b.c", is_authenticated=True)
+
+    def test_hit_after_miss(self):
+        self.assertIsNone(self.cache.get("a@b.c", "token"))
+        self.cache.set("a@b.c", "token", self.user, self.cache.generation("a@b.c"))
+        user = self.cache.get("a@b.c", "token")
+        self.assertEqual(self.user, user)
+        self.assertIsNot(self.user, user)
+        self.assertIsNone(self.cache.get("a@b.c", "other token"))
+        self.assertEqual(1, self.cache.stats["hits"])
+        self.assertEqual(2, self.cache.stats["misses"])
+
+    def test_entry_never_outlives_token(self):
+        self.cache.set("a@b.c", "token", self.user, 0, token_expires_at=time.time() - 1)
+        self.assertIsNone(self.cache.get("a@b.c", "token"))
+        self.assertEqual(0, len(self.cache.entries))
+
+    def test_invalidate_user(self):
+        self.cache.set("a@b.c", "t1", self.user, 0)
+        self.cache.set("x@y.z", "t2", User(email_id="x@y.z"), 0)
+        generation = self.cache.generation("a@b.c")
+        self.cache.invalidate("a@b.c")
+        self.assertIsNone(self.cache.get("a@b.c", "t1"))
+        self.assertIsNotNone(self.cache.get("x@y.z", "t2"))
+        # read before the invalidation, not stored
+        self.cache.set("a@b.c", "t1", self.user, generation)
+        self.assertIsNone(self.cache.get("a@b.c", "t1"))
+
+    def test_invalidate_user_helper(self):
+        self.cache.set("a@b.c", "t1", self.user, 0)
+        with mock.patch.object(cache, "USER_CACHE", self.cache):
+            invalidate_user("a@b.c")
+        self.assertIsNone(self.cache.get("a@b.c", "t1"))
+        self.assertEqual(1, self.cache.stats["invalidations"])
+
+    def test_lru_eviction(self):
+        for token in ["t1", "t2", "t3"]:
+            self.cache.set("a@b.c", token, self.user, 0)
+        self.assertIsNone(self.cache.get("a@b.c", "t1"))
+        self.assertEqual(1, self.cache.stats["evictions"])
+        self.assertSetEqual({"t2", "t3"}, self.cache.by_subject["a@b.c"])